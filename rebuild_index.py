@@ -33,6 +33,11 @@ def main():
         print(f"   - File: {index_file}")
         print(f"   - Entries: {lines:,}")
         print(f"   - Size: {file_size:,} KB")
+        if not (index_dir / "manifest.json").exists():
+            # index cũ chỉ có JSONL -> chuyển sang định dạng nhị phân (mmap)
+            build_script = ROOT / "src" / "tools" / "build_vector_index.py"
+            print("💾 Chưa có binary index - đang chuyển đổi từ index.jsonl...")
+            os.system(f'python "{build_script}" --index "{index_dir}" --convert-only')
         print("💡 Sử dụng index hiện có. Nếu muốn rebuild, xóa thư mục index/ trước.")
         return 0
         
@@ -0,0 +1,287 @@
+"""
+Phần dùng chung của hai server (server.py - Flask, server_asgi.py - FastAPI), không phụ thuộc framework:
+Gemini, dựng context, chuỗi SSE của /ask/stream, đầu vào/đầu ra /ask_batch, kiểm tra quyền /admin.
+"""
+import os, time, json, hmac, ipaddress
+from pathlib import Path
+import google.generativeai as genai
+
+from core.pipeline import retrieve_context, stream_answer, answer_batch, BATCH_LLM_CONCURRENCY
+from core.settings import Settings
+from core.context_packer import CONTEXT_PACKER, pack_context
+from core import result_cache, metrics
+from core.eventlog import say
+from core.utils import print_timing_info, is_online
+
+ROOT = Path(__file__).resolve().parents[2]  # project root
+APP_DIR = ROOT / "app"
+GEMINI_PROMPT_PATH = ROOT / "prompts" / "gemini_answer.txt"
+
+settings = Settings()
+
+def gemini_enabled() -> bool:
+    return bool(os.getenv("GOOGLE_API_KEY", "").strip())
+
+def citations_to_context(citations) -> str:
+    if CONTEXT_PACKER:
+        # Gemini: không giới hạn token, chỉ gom khoản cùng Điều + bỏ SOURCE/trùng lặp
+        return pack_context(citations or [])[0]
+    buf = []
+    for c in citations or []:
+        title  = c.get("title","")
+        art    = c.get("article","")
+        clause = c.get("clause")
+        text   = (c.get("text") or "").strip()
+        src    = c.get("source","")
+        tag = f"[{title} | Điều {art}" + (f", Khoản {clause}]" if clause else "]")
+        buf.append(f"{tag}\n{text}\nSOURCE: {src}")
+    return "\n---\n".join(buf)
+
+def head(s: str, n: int = 50) -> str:
+    s = (s or "").strip().replace("\n", " ")
+    return s[:n]
+
+def _gemini_prompt(question: str, context: str) -> str:
+    # Đọc system prompt từ file
+    try:
+        system_prompt = GEMINI_PROMPT_PATH.read_text(encoding="utf-8")
+    except Exception:
+        # Fallback prompt nếu file không tồn tại
+        system_prompt = (
+            "Bạn là Luật sư tư vấn pháp luật Việt Nam chuyên nghiệp. "
+            "Tư vấn dựa trên CONTEXT chính xác và thực tiễn. "
+            "CHỈ sử dụng thông tin có trong CONTEXT. "
+            "Mỗi kết luận phải có trích dẫn văn bản pháp luật đầy đủ (Luật/Nghị định | Điều X, Khoản Y). "
+            "Trả lời đầy đủ, chi tiết như luật sư chuyên nghiệp."
+        )
+    
+    return f'''{system_prompt}
+
+CONTEXT:
+{context}
+
+CÂU HỎI:
+{question}
+'''
+
+def gemini_answer(question: str, context: str) -> str | None:
+    key = os.getenv("GOOGLE_API_KEY", "").strip()
+    if not key:
+        return None
+    model_id = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+    genai.configure(api_key=key)
+    prompt = _gemini_prompt(question, context)
+    try:
+        model = genai.GenerativeModel(model_id)
+        res = model.generate_content(prompt)
+        return (res.text or "").strip()
+    except Exception:
+        # Fallback: thử model 1.5 nếu 2.0 không khả dụng
+        metrics.backend_retry("gemini", "chat")
+        try:
+            model = genai.GenerativeModel("gemini-1.5-flash")
+            res = model.generate_content(prompt)
+            return (res.text or "").strip()
+        except Exception as e2:
+            say(f"Gemini error: {e2}", level="error", event="gemini_error", error=str(e2))
+            metrics.backend_error("gemini", "chat")
+            return None
+
+def gemini_key(question: str, context: str) -> str:
+    return result_cache.answer_key(question, context, os.getenv("GEMINI_MODEL", "gemini-2.0-flash"), GEMINI_PROMPT_PATH)
+
+_GEMINI_DONE = {"STOP", "MAX_TOKENS", "1", "2"}
+
+def _gemini_finish(chunk) -> str:
+    """finish_reason của chunk ("" khi chưa kết thúc)."""
+    try:
+        fr = chunk.candidates[0].finish_reason
+    except (AttributeError, IndexError, TypeError):
+        return ""
+    name = str(getattr(fr, "name", fr) or "")
+    return "" if name in ("0", "FINISH_REASON_UNSPECIFIED") else name
+
+def _gemini_text(chunk) -> str:
+    try:
+        return chunk.text or ""
+    except (AttributeError, ValueError):  # chunk không có part (vd. chunk cuối chỉ mang finish_reason)
+        return ""
+
+def _gemini_stream(question: str, context: str):
+    """
+    Generator token từ Gemini (stream=True). Lỗi trước token đầu -> thử gemini-1.5-flash.
+    Kết thúc bình thường chỉ khi Gemini báo xong (finish_reason STOP/MAX_TOKENS) hoặc không model nào
+    trả token; lỗi hay kết thúc bất thường sau token đầu -> raise (câu trả lời cụt).
+    """
+    key = os.getenv("GOOGLE_API_KEY", "").strip()
+    if not key:
+        return
+    genai.configure(api_key=key)
+    prompt = _gemini_prompt(question, context)
+    for model_id in (os.getenv("GEMINI_MODEL", "gemini-2.0-flash"), "gemini-1.5-flash"):
+        started, finish = False, ""
+        try:
+            for chunk in genai.GenerativeModel(model_id).generate_content(prompt, stream=True):
+                text = _gemini_text(chunk)
+                finish = _gemini_finish(chunk) or finish
+                if text:
+                    started = True
+                    yield text
+            if finish in _GEMINI_DONE:
+                return
+            raise RuntimeError(f"Gemini stream kết thúc bất thường (finish_reason={finish or 'không có'})")
+        except Exception as e:
+            say(f"Gemini stream error ({model_id}): {e}", level="warning", event="gemini_stream_error",
+                model=model_id, error=str(e))
+            if started:
+                metrics.backend_error("gemini", "chat_stream")
+                raise
+            metrics.backend_retry("gemini", "chat_stream")
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_events(question: str, t0: float):
+    """
+    Chuỗi SSE của /ask/stream (dùng chung cho Flask và server ASGI): `citations` ngay khi
+    retrieval xong, sau đó nhiều `token`, cuối cùng `done` với bảng thời gian - hoặc `error`
+    nếu backend lỗi / stream đứt giữa chừng (câu trả lời đã gửi là không đầy đủ và không được cache).
+    """
+    with metrics.track_in_flight():
+        yield from _stream_events_inner(question, t0)
+
+def _stream_events_inner(question: str, t0: float):
+    use_gemini = is_online() and gemini_enabled()
+    retrieved = retrieve_context(question, settings)
+    citations = retrieved["hits"]
+    if use_gemini:
+        mode, ai, model = "gemini-online", "gemini", os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+    else:
+        mode = "direct-cite" if retrieved["direct"] else "rag+llm"
+        ai, model = "ollama", os.getenv("LLM_MODEL", "qwen2.5:3b-instruct")
+
+    ttfb_ms = round((time.perf_counter() - t0) * 1000.0, 2)
+    yield _sse("citations", {
+        "mode": mode, "ai": ai, "model": model,
+        "citations": citations,
+        "chosen_titles": retrieved["chosen_titles"],
+        "question_head": head(question),
+        "context_head": head(retrieved["ctx"]),
+    })
+
+    t_llm0 = time.perf_counter()
+    ttft_ms, n_tokens = None, 0
+
+    def emit(source):
+        nonlocal ttft_ms, n_tokens
+        for tok in source:
+            if ttft_ms is None:
+                ttft_ms = round((time.perf_counter() - t0) * 1000.0, 2)
+            n_tokens += 1
+            yield _sse("token", {"t": tok})
+
+    answer_cached = False
+    error = None
+    try:
+        if use_gemini:
+            context = citations_to_context(citations)
+            key = gemini_key(question, context)
+            cached = result_cache.get_answer(key)
+            if cached is not None:
+                answer_cached = True
+                yield from emit([cached])
+            else:
+                buf = []
+                for tok in _gemini_stream(question, context):
+                    buf.append(tok)
+                    yield from emit([tok])
+                # tới đây = Gemini báo xong (stream đứt -> _gemini_stream raise, bỏ qua dòng này)
+                result_cache.put_answer(key, "".join(buf))
+            if not n_tokens:
+                # Gemini lỗi/không trả gì -> fallback pipeline offline như /ask
+                say("⚠️ Gemini không phản hồi - chuyển sang Ollama", level="warning", event="gemini_fallback")
+                mode, ai, model = "ollama-offline", "ollama", os.getenv("LLM_MODEL", "qwen2.5:3b-instruct")
+                yield _sse("mode", {"mode": mode, "ai": ai, "model": model})
+        if not n_tokens:
+            yield from emit(stream_answer(question, retrieved, settings))
+            answer_cached = retrieved.get("answer_cached", False)
+    except Exception as e:
+        metrics.record_error("ask_stream")
+        error = str(e)
+
+    t_end = time.perf_counter()
+    timing_data = {
+        **retrieved["timings"],
+        "ttfb_ms": ttfb_ms,
+        "ttft_ms": ttft_ms,
+        "llm_ms": round((t_end - t_llm0) * 1000.0, 2),
+        "total_ms": round((t_end - t0) * 1000.0, 2),
+    }
+    print_timing_info(timing_data)
+    if error is not None:
+        # sự kiện kết thúc là `error` thay cho `done`: client không coi phần đã nhận là câu trả lời hoàn chỉnh
+        yield _sse("error", {"status": "error", "error": error, "mode": mode, "ai": ai, "model": model,
+                             "tokens": n_tokens, "timings": timing_data})
+        return
+    metrics.record_request(mode, timing_data, llm_ran=not answer_cached)
+    yield _sse("done", {"status": "success", "mode": mode, "ai": ai, "model": model,
+                        "tokens": n_tokens, "timings": timing_data,
+                        "cached": {"retrieval": retrieved["cached"], "answer": answer_cached}})
+
+def batch_request(body: bytes, mimetype: str):
+    """
+    Đầu vào /ask_batch: JSON {"questions": [...], "concurrency": N} hoặc JSONL (mỗi dòng {"id", "question"}
+    hoặc một chuỗi). Trả về (danh sách câu hỏi, concurrency đã giới hạn bởi BATCH_LLM_CONCURRENCY;
+    concurrency không phải số -> dùng BATCH_LLM_CONCURRENCY).
+    """
+    text = (body or b"").decode("utf-8", errors="replace")
+    conc = BATCH_LLM_CONCURRENCY
+    if mimetype == "application/json":
+        try:
+            data = json.loads(text or "{}")
+        except ValueError:
+            return [], conc
+        if isinstance(data, dict):
+            try:
+                conc = min(conc, max(1, int(data.get("concurrency") or conc)))
+            except (TypeError, ValueError, OverflowError):  # "x", [2], Infinity... -> giữ BATCH_LLM_CONCURRENCY
+                pass
+            data = data.get("questions")
+        return (data if isinstance(data, list) else []), conc
+    items = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(line)
+    return items, conc
+
+def batch_events(items, concurrency: int):
+    """Dòng JSONL của /ask_batch (dùng chung cho Flask và ASGI), mỗi câu một dòng ngay khi tới lượt."""
+    with metrics.track_in_flight():
+        for r in answer_batch(items, settings, concurrency=concurrency):
+            if r["status"] == "success":
+                metrics.record_request(r["mode"], r["timings"], llm_ran=not r["cached"]["answer"])
+            else:
+                metrics.record_error("ask_batch")
+            yield json.dumps(r, ensure_ascii=False) + "\n"
+
+def _loopback(host: str | None) -> bool:
+    try:
+        ip = ipaddress.ip_address((host or "").split("%")[0])
+    except ValueError:
+        return False
+    return ip.is_loopback or bool(getattr(ip, "ipv4_mapped", None) and ip.ipv4_mapped.is_loopback)
+
+def admin_denied(token: str | None, client: str | None) -> int | None:
+    """
+    Mã lỗi HTTP nếu request /admin không được phép, None nếu được phép. Có ADMIN_TOKEN: header phải khớp (401).
+    ADMIN_TOKEN rỗng: chỉ nhận request từ máy local 127.0.0.1/::1 (403) - server lắng nghe 0.0.0.0.
+    """
+    expected = os.getenv("ADMIN_TOKEN", "").strip()
+    if expected:
+        return None if hmac.compare_digest((token or "").encode(), expected.encode()) else 401
+    return None if _loopback(client) else 403
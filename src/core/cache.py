@@ -0,0 +1,168 @@
+# core/cache.py
+"""
+Cache LRU + TTL dùng chung, thread-safe, có tầng lưu đĩa (SQLite) tuỳ chọn
+để dữ liệu còn lại sau khi khởi động lại process.
+"""
+import os, re, json, time, sqlite3, threading, hashlib, unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+from core.eventlog import say
+
+_WS_RE = re.compile(r"\s+")
+
+def normalize_text(s: str) -> str:
+    """Chuẩn hoá câu hỏi để làm khoá cache: Unicode NFC, chữ thường, gộp khoảng trắng, bỏ dấu câu cuối."""
+    s = unicodedata.normalize("NFC", s or "").lower()
+    s = _WS_RE.sub(" ", s).strip()
+    return s.rstrip(" ?.!…")
+
+def make_key(*parts) -> str:
+    """Ghép các phần thành khoá cố định độ dài (sha1)."""
+    raw = "\x1f".join("" if p is None else str(p) for p in parts)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class _SqliteStore:
+    """Tầng đĩa: bảng key -> (expires_at, value JSON)."""
+    _PRUNE_EVERY = 256
+
+    def __init__(self, path: str, table: str, max_rows: int):
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        self.table = re.sub(r"\W", "_", table)
+        self.max_rows = max_rows
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} "
+            "(k TEXT PRIMARY KEY, expires REAL, stored REAL, v TEXT)"
+        )
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._db.execute(f"SELECT expires, v FROM {self.table} WHERE k=?", (key,)).fetchone()
+        if not row:
+            return None
+        expires, v = row
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+        return expires, json.loads(v)
+
+    def set(self, key: str, value: Any, expires: float):
+        v = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (k, expires, stored, v) VALUES (?, ?, ?, ?)",
+                (key, expires, time.time(), v),
+            )
+            self._writes += 1
+            if self._writes % self._PRUNE_EVERY == 0:
+                self._prune()
+
+    def _prune(self):
+        self._db.execute(f"DELETE FROM {self.table} WHERE expires > 0 AND expires < ?", (time.time(),))
+        self._db.execute(
+            f"DELETE FROM {self.table} WHERE k NOT IN "
+            f"(SELECT k FROM {self.table} ORDER BY stored DESC LIMIT ?)",
+            (self.max_rows,),
+        )
+
+    def delete(self, key: str):
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table} WHERE k=?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table}")
+
+class LRUCache:
+    """
+    Cache LRU giới hạn `maxsize` phần tử, mỗi phần tử hết hạn sau `ttl` giây (0 = không hết hạn).
+    Nếu có `path`, giá trị (phải JSON-serializable) được ghi thêm vào SQLite;
+    miss trên RAM sẽ đọc lại từ đĩa.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 0.0, path: Optional[str] = None,
+                 name: str = "cache", disk_factor: int = 10):
+        self.name = name
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = max(0.0, float(ttl))
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._disk = None
+        if path:
+            try:
+                self._disk = _SqliteStore(path, name, max_rows=max(self.maxsize, 1) * disk_factor)
+            except Exception as e:
+                say(f"⚠️ [{name}] không mở được cache trên đĩa {path}: {e}", level="warning", event="cache_open_error")
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, key: str, default=None):
+        if not self.enabled:
+            return default
+        now = time.time()
+        with self._lock:
+            ent = self._data.get(key)
+            if ent is not None:
+                expires, value = ent
+                if not expires or expires >= now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+        if self._disk is not None:
+            got = self._disk.get(key)
+            if got is not None:
+                expires, value = got
+                with self._lock:
+                    self._put(key, value, expires)
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def _put(self, key: str, value: Any, expires: float):
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set(self, key: str, value: Any):
+        if not self.enabled:
+            return
+        expires = time.time() + self.ttl if self.ttl else 0.0
+        with self._lock:
+            self._put(key, value, expires)
+        if self._disk is not None:
+            try:
+                self._disk.set(key, value, expires)
+            except Exception as e:
+                say(f"⚠️ [{self.name}] ghi cache đĩa lỗi: {e}", level="warning", event="cache_write_error")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "persistent": self._disk is not None,
+            }
@@ -0,0 +1,121 @@
+"""
+Đóng gói CONTEXT cho LLM theo ngân sách token (ước lượng), thay cho cắt theo số ký tự.
+
+So với định dạng cũ (mỗi hit: "[title | Điều X, Khoản Y]" + tiêu đề điều + text + "SOURCE: file://..."):
+  - các khoản/điểm cùng một Điều được gom dưới MỘT header, tiêu đề điều chỉ ghi một lần;
+  - bỏ dòng SOURCE (đường dẫn file không giúp LLM trả lời; citations trả về API vẫn giữ source);
+  - bỏ hit gần trùng nội dung (Jaccard 3-gram âm tiết >= CONTEXT_DEDUP và cùng các con số - hai khoản
+    chỉ khác mức phạt/thời hạn KHÔNG bị coi là trùng) với hit đã chọn;
+  - hit được xét theo thứ tự xếp hạng, hit không vừa ngân sách thì bỏ qua và thử hit sau (hit ngắn hơn vẫn vào được).
+Prompt ngắn hơn -> prefill Ollama trên CPU nhanh hơn (thời gian prefill tăng theo số token prompt).
+"""
+import os, re, math
+from typing import Dict, List, Optional, Tuple
+
+CONTEXT_PACKER = os.getenv("CONTEXT_PACKER", "true").lower() == "true"
+# Ước lượng token = ký tự / CHARS_PER_TOKEN (tiếng Việt có dấu với tokenizer Qwen/Llama ~ 2.5-3.5)
+CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "3.0"))
+CONTEXT_DEDUP = float(os.getenv("CONTEXT_DEDUP", "0.85"))
+
+_WORD_RE = re.compile(r"[0-9a-zA-ZÀ-ỹđĐ]+")
+_NUM_RE = re.compile(r"\d+(?:[.,]\d+)*")
+_SEP = "\n---\n"
+
+def estimate_tokens(text: str) -> int:
+    return int(math.ceil(len(text or "") / CHARS_PER_TOKEN))
+
+def budget_tokens(max_context_tokens: int, max_context_chars: int) -> int:
+    """MAX_CONTEXT_TOKENS nếu đặt (> 0), không thì quy đổi MAX_CONTEXT_CHARS sang token."""
+    return max_context_tokens if max_context_tokens > 0 else int(max_context_chars / CHARS_PER_TOKEN)
+
+def _shingles(text: str) -> Tuple[frozenset, tuple]:
+    """(tập 3-gram âm tiết, dãy con số) của một đoạn text."""
+    w = _WORD_RE.findall(text.lower())
+    nums = tuple(_NUM_RE.findall(text))
+    if len(w) < 3:
+        return frozenset(w), nums
+    return frozenset(zip(w, w[1:], w[2:])), nums
+
+def _near_dup(sig: Tuple[frozenset, tuple], seen: List[Tuple[frozenset, tuple]]) -> bool:
+    sh, nums = sig
+    if not sh:
+        return False
+    for other, other_nums in seen:
+        if nums != other_nums:
+            continue
+        inter = len(sh & other)
+        if inter and inter / len(sh | other) >= CONTEXT_DEDUP:
+            return True
+    return False
+
+def _split_heading(text: str) -> Tuple[str, str]:
+    """Text của unit = "tiêu đề điều\\nnội dung" (xem corpus.iter_file_units); không có dòng thứ hai -> không tách."""
+    head, sep, body = (text or "").strip().partition("\n")
+    return (head.strip(), body.strip()) if sep else ("", head.strip())
+
+def _clause_label(clause) -> str:
+    # corpus: "k" (khoản), "k.d" (điểm của khoản), "d" (điểm ngay dưới điều, không qua khoản)
+    k, _, d = str(clause).partition(".")
+    if not k.isdigit() and not d:
+        return f"Điểm {k}"
+    return f"Khoản {k}" + (f" điểm {d}" if d else "")
+
+def _clause_order(clause) -> tuple:
+    k, _, d = str(clause or "").partition(".")
+    return (int(k) if k.isdigit() else 10 ** 6, k, d)
+
+class _Group:
+    """Các hit cùng (title, Điều), giữ vị trí của hit xếp hạng cao nhất."""
+    def __init__(self, title: str, article: str):
+        self.title = title
+        self.article = article
+        self.items: List[Tuple[Optional[str], str, str]] = []  # (clause, tiêu đề, nội dung)
+
+    def render(self) -> str:
+        heads = {h for _, h, _ in self.items}
+        common = heads.pop() if len(heads) == 1 else ""
+        if len(self.items) == 1:
+            clause, head, body = self.items[0]
+            tag = f"[{self.title} | Điều {self.article}" + (f", {_clause_label(clause)}]" if clause else "]")
+            return "\n".join(x for x in (tag, head, body) if x)
+        lines = [f"[{self.title} | Điều {self.article}]" + (f" {common}" if common else "")]
+        for clause, head, body in sorted(self.items, key=lambda it: _clause_order(it[0])):
+            text = body if common else "\n".join(x for x in (head, body) if x)
+            lines.append(f"{_clause_label(clause)}: {text}" if clause else text)
+        return "\n".join(lines)
+
+def pack_context(hits: List[Dict], max_tokens: Optional[int] = None) -> Tuple[str, Dict]:
+    """
+    CONTEXT từ hits (đã xếp hạng) trong ngân sách `max_tokens` (ước lượng; None = không giới hạn).
+    Trả về (context, thống kê: số hit dùng / bỏ vì trùng / bỏ vì ngân sách, token ước lượng).
+    """
+    groups: Dict[Tuple[str, str], _Group] = {}
+    order: List[_Group] = []
+    seen: List[Tuple[frozenset, tuple]] = []
+    used = dup = over = 0
+    total = 0
+    for h in hits:
+        head, body = _split_heading(h.get("text", ""))
+        sh = _shingles(body)
+        if _near_dup(sh, seen):
+            dup += 1
+            continue
+        key = (h.get("title", ""), str(h.get("article", "")))
+        g = groups.get(key)
+        cand = _Group(*key) if g is None else g
+        before = 0 if g is None else estimate_tokens(g.render())
+        cand.items.append((h.get("clause"), head, body))
+        cost = estimate_tokens(cand.render()) - before + (estimate_tokens(_SEP) if g is None and order else 0)
+        if max_tokens is not None and total + cost > max_tokens:
+            cand.items.pop()
+            over += 1
+            continue
+        if g is None:
+            groups[key] = cand
+            order.append(cand)
+        total += cost
+        seen.append(sh)
+        used += 1
+    ctx = _SEP.join(g.render() for g in order)
+    return ctx, {"hits_used": used, "hits_dup": dup, "hits_over_budget": over,
+                 "articles": len(order), "tokens": estimate_tokens(ctx)}
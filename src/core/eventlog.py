@@ -0,0 +1,150 @@
+"""
+Log có cấu trúc, không chặn request: mỗi sự kiện là một dict (JSON một dòng) gắn request ID,
+được đẩy vào hàng đợi; một thread nền gom và ghi theo lô.
+
+Hai chế độ (LOG_FORMAT):
+    rich - giao diện đẹp cho CLI tương tác (bảng Rich, dòng tiến trình có emoji) như trước
+    json - cho server: thread request chỉ dựng dict + put_nowait, không render/ghi console;
+           hàng đợi đầy -> bỏ sự kiện (đếm trong stats()) thay vì chặn request
+Entry point chọn mặc định bằng configure() (server: json, run_cli: rich); biến LOG_FORMAT luôn được ưu tiên.
+"""
+import os, sys, json, time, uuid, queue, atexit, threading, contextvars
+from typing import Dict, Optional, TextIO
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info").lower()
+LOG_FILE = os.getenv("LOG_FILE", "").strip()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+_MIN_LEVEL = _LEVELS.get(LOG_LEVEL, 20)
+
+_request_id: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Dùng X-Request-ID của client nếu có (cắt 64 ký tự), không thì sinh mới; gán cho context hiện tại."""
+    rid = (incoming or "").strip()[:64] or uuid.uuid4().hex[:16]
+    _request_id.set(rid)
+    return rid
+
+def request_id() -> Optional[str]:
+    return _request_id.get()
+
+class _Writer:
+    """Thread nền rút hàng đợi, ghi mỗi lô một lần write + flush."""
+    def __init__(self, stream: TextIO, maxsize: int):
+        self.stream = stream
+        self.q: "queue.Queue[dict]" = queue.Queue(maxsize=max(1, maxsize))
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self._t = threading.Thread(target=self._run, name="eventlog-writer", daemon=True)
+        self._t.start()
+
+    def put(self, rec: dict):
+        try:
+            self.q.put_nowait(rec)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.q.get()]
+            try:
+                while len(batch) < 512:
+                    batch.append(self.q.get_nowait())
+            except queue.Empty:
+                pass
+            self._write(batch)
+
+    def _write(self, batch):
+        lines = []
+        for rec in batch:
+            if rec is None:
+                continue
+            try:
+                lines.append(json.dumps(rec, ensure_ascii=False, default=str))
+            except (TypeError, ValueError):
+                self.errors += 1
+        try:
+            if lines:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            self.written += len(lines)
+        except Exception:
+            self.errors += len(lines)
+        for _ in batch:
+            self.q.task_done()
+
+    def flush(self, timeout: float = 2.0):
+        """Đợi hàng đợi được ghi hết (tối đa `timeout` giây)."""
+        deadline = time.time() + timeout
+        while self.q.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.005)
+
+_FORMAT: Optional[str] = None
+_WRITER: Optional[_Writer] = None
+_LOCK = threading.Lock()
+
+def configure(default: str = "rich", stream: Optional[TextIO] = None) -> str:
+    """
+    Chọn chế độ: LOG_FORMAT nếu có, không thì `default` (rich | json | off).
+    `stream`: nơi ghi JSON (mặc định LOG_FILE hoặc stdout).
+    """
+    global _FORMAT, _WRITER
+    fmt = (os.getenv("LOG_FORMAT", "").strip().lower() or default).lower()
+    if fmt not in ("rich", "json", "off"):
+        fmt = "rich"
+    with _LOCK:
+        if fmt == "json" and (_WRITER is None or stream is not None):
+            if _WRITER is not None:
+                _WRITER.flush()
+            if stream is None:
+                stream = open(LOG_FILE, "a", encoding="utf-8") if LOG_FILE else sys.stdout
+            _WRITER = _Writer(stream, LOG_QUEUE_SIZE)
+        _FORMAT = fmt
+    return fmt
+
+def log_format() -> str:
+    return _FORMAT or "rich"
+
+def json_mode() -> bool:
+    return _FORMAT == "json"
+
+def pretty() -> bool:
+    """True khi được render Rich/print ra console (CLI)."""
+    return _FORMAT in (None, "rich")
+
+def log(event: str, level: str = "info", **fields):
+    """Ghi một sự kiện có cấu trúc (chỉ ở chế độ json; chế độ khác bỏ qua)."""
+    if _FORMAT != "json" or _LEVELS.get(level, 20) < _MIN_LEVEL:
+        return
+    rec = {"ts": round(time.time(), 6), "level": level, "event": event}
+    rid = _request_id.get()
+    if rid is not None:
+        rec["rid"] = rid
+    rec.update(fields)
+    _WRITER.put(rec)
+
+def say(msg: str, level: str = "debug", event: str = "progress", **fields):
+    """Dòng tiến trình cho người đọc: CLI in ra như cũ, server ghi thành sự kiện `event`."""
+    if _FORMAT == "json":
+        log(event, level, msg=msg, **fields)
+    elif _FORMAT != "off":
+        print(msg, flush=True)
+
+def stats() -> Dict:
+    w = _WRITER
+    return {
+        "format": log_format(),
+        "level": LOG_LEVEL,
+        "queued": w.q.qsize() if w else 0,
+        "written": w.written if w else 0,
+        "dropped": w.dropped if w else 0,
+        "errors": w.errors if w else 0,
+    }
+
+def flush(timeout: float = 2.0):
+    if _WRITER is not None:
+        _WRITER.flush(timeout)
+
+atexit.register(flush)
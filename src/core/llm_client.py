@@ -1,5 +1,8 @@
 # core/llm_client.py
-import os, time, httpx, json
+import os, time, httpx, json, threading, asyncio, weakref
+from concurrent.futures import ThreadPoolExecutor
+from core import metrics
+from core.eventlog import say
 
 BASE_URL = (
     os.getenv("OLLAMA_BASE_URL")
@@ -13,18 +16,159 @@ HTTP_RETRIES     = int(os.getenv("HTTP_RETRIES", "2"))
 HTTP_BACKOFF_SEC = float(os.getenv("HTTP_RETRY_BACKOFF", "2.0"))
 DEBUG_EMBED      = os.getenv("DEBUG_EMBED", "0") == "1"
 
+# Connection pool dùng chung cho cả process (keep-alive, tái sử dụng kết nối)
+HTTP_POOL_MAX         = int(os.getenv("HTTP_POOL_MAX", "20"))
+HTTP_POOL_KEEPALIVE   = int(os.getenv("HTTP_POOL_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED         = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+# Server ASGI: pool riêng cho AsyncClient; request vượt quá số kết nối xếp hàng trên semaphore
+# (không PoolTimeout), nên số request đang chờ Ollama không bị giới hạn bởi HTTP_POOL_MAX
+ASYNC_HTTP_POOL_MAX   = int(os.getenv("ASYNC_HTTP_POOL_MAX", "64"))
+
+# Timeout theo từng loại thao tác; chỉ phần đọc của chat mới cần dài (LLM sinh chậm trên CPU)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_WRITE_TIMEOUT   = float(os.getenv("HTTP_WRITE_TIMEOUT", "30"))
+HTTP_POOL_TIMEOUT    = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+CHAT_READ_TIMEOUT    = float(os.getenv("CHAT_READ_TIMEOUT", str(HTTP_TIMEOUT_SEC)))
+EMBED_READ_TIMEOUT   = float(os.getenv("EMBED_READ_TIMEOUT", "120"))
+
 def _headers():
     return {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type":  "application/json",
     }
 
-def _client():
-    return httpx.Client(
-        timeout=httpx.Timeout(connect=HTTP_TIMEOUT_SEC, read=HTTP_TIMEOUT_SEC, write=HTTP_TIMEOUT_SEC, pool=None),
-        http2=False,
+def _timeout(op: str = "chat") -> httpx.Timeout:
+    read = EMBED_READ_TIMEOUT if op == "embed" else CHAT_READ_TIMEOUT
+    return httpx.Timeout(connect=HTTP_CONNECT_TIMEOUT, read=read, write=HTTP_WRITE_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+def _limits(max_connections: int = HTTP_POOL_MAX, max_keepalive: int = HTTP_POOL_KEEPALIVE) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
     )
 
+def _atimeout(op: str = "chat") -> httpx.Timeout:
+    # chờ kết nối đã nằm ở semaphore (_aslot) -> không đặt pool timeout
+    t = _timeout(op)
+    return httpx.Timeout(connect=t.connect, read=t.read, write=t.write, pool=None)
+
+def _http2() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401  (httpx[http2])
+        return True
+    except ImportError:
+        say("⚠️ HTTP2_ENABLED=true nhưng thiếu gói 'h2' (pip install httpx[http2]) - dùng HTTP/1.1", level="warning", event="http2_unavailable")
+        return False
+
+# ---- Thống kê pool: đếm request và số kết nối TCP mới mở (qua trace extension của httpcore)
+_STATS = {"requests": 0, "connections_opened": 0}
+_STATS_LOCK = threading.Lock()
+
+def _count(key: str):
+    with _STATS_LOCK:
+        _STATS[key] += 1
+
+def _trace(event_name, info):
+    if event_name == "connection.connect_tcp.complete":
+        _count("connections_opened")
+
+async def _atrace(event_name, info):
+    if event_name == "connection.connect_tcp.complete":
+        _count("connections_opened")
+
+def _on_request(request):
+    _count("requests")
+    request.extensions["trace"] = _trace
+
+async def _aon_request(request):
+    _count("requests")
+    request.extensions["trace"] = _atrace
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+_ASYNC_CLIENTS = weakref.WeakKeyDictionary()  # event loop -> AsyncClient (AsyncClient gắn với loop tạo ra nó)
+_ASYNC_SLOTS = weakref.WeakKeyDictionary()    # event loop -> Semaphore(ASYNC_HTTP_POOL_MAX)
+_ASYNC_WAITING = 0
+
+def _client() -> httpx.Client:
+    """httpx.Client dùng chung (thread-safe). Không đóng client này sau mỗi request."""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = httpx.Client(
+                    timeout=_timeout("chat"), limits=_limits(), http2=_http2(),
+                    event_hooks={"request": [_on_request]},
+                )
+    return _CLIENT
+
+def _async_client() -> httpx.AsyncClient:
+    """httpx.AsyncClient dùng chung cho event loop hiện tại."""
+    loop = asyncio.get_running_loop()
+    cl = _ASYNC_CLIENTS.get(loop)
+    if cl is None or cl.is_closed:
+        n = max(1, ASYNC_HTTP_POOL_MAX)
+        cl = httpx.AsyncClient(
+            timeout=_atimeout("chat"), limits=_limits(n, n), http2=_http2(),
+            event_hooks={"request": [_aon_request]},
+        )
+        _ASYNC_CLIENTS[loop] = cl
+        _ASYNC_SLOTS[loop] = asyncio.Semaphore(n)
+    return cl
+
+class _aslot:
+    """Giữ một trong ASYNC_HTTP_POOL_MAX chỗ của loop hiện tại trong suốt một request (hàng đợi không giới hạn)."""
+    async def __aenter__(self):
+        global _ASYNC_WAITING
+        _async_client()
+        self.sem = _ASYNC_SLOTS[asyncio.get_running_loop()]
+        _ASYNC_WAITING += 1
+        try:
+            await self.sem.acquire()
+        finally:
+            _ASYNC_WAITING -= 1
+
+    async def __aexit__(self, *exc):
+        self.sem.release()
+
+def _pool_connections(cl) -> list:
+    try:
+        return list(cl._transport._pool.connections)
+    except Exception:
+        return []
+
+def pool_stats() -> dict:
+    """Thống kê connection pool: số request, số kết nối mới, tỷ lệ tái sử dụng, kết nối đang mở."""
+    with _STATS_LOCK:
+        req, opened = _STATS["requests"], _STATS["connections_opened"]
+    conns = _pool_connections(_CLIENT) if _CLIENT is not None else []
+    for cl in list(_ASYNC_CLIENTS.values()):
+        conns += _pool_connections(cl)
+    return {
+        "requests": req,
+        "connections_opened": opened,
+        "reuse_ratio": round(1.0 - opened / req, 4) if req else 0.0,
+        "open_connections": len(conns),
+        "idle_connections": sum(1 for c in conns if c.is_idle()),
+        "max_connections": HTTP_POOL_MAX,
+        "max_keepalive": HTTP_POOL_KEEPALIVE,
+        "async_max_connections": ASYNC_HTTP_POOL_MAX,
+        "async_waiting": _ASYNC_WAITING,
+        "http2": HTTP2_ENABLED,
+    }
+
+def close_clients():
+    """Đóng client dùng chung (gọi khi tắt process)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is not None:
+            _CLIENT.close()
+            _CLIENT = None
+
 def chat(messages, model=None, max_tokens=256, temperature=0.0, stream=False):
     """
     Chat với LLM qua OpenAI-compatible API.
@@ -48,91 +192,225 @@ def chat(messages, model=None, max_tokens=256, temperature=0.0, stream=False):
         last_err = None
         for attempt in range(HTTP_RETRIES + 1):
             try:
-                with _client() as client:
-                    r = client.post(url, headers=_headers(), json=payload)
+                r = _client().post(url, headers=_headers(), json=payload, timeout=_timeout("chat"))
                 r.raise_for_status()
                 data = r.json()
                 return data["choices"][0]["message"]["content"]
             except Exception as e:
                 last_err = e
                 if attempt < HTTP_RETRIES:
+                    metrics.backend_retry("ollama", "chat")
                     time.sleep(HTTP_BACKOFF_SEC * (attempt + 1))
                 else:
+                    metrics.backend_error("ollama", "chat")
                     raise last_err
     else:
-        # Streaming: trả về generator
+        # Streaming: trả về generator. Generator kết thúc bình thường <=> backend báo xong
+        # ("[DONE]" hoặc finish_reason); lỗi giữa chừng / mất kết nối trước đó -> raise
         def stream_response():
+            done = False
             try:
-                with _client() as client:
-                    with client.stream("POST", url, headers=_headers(), json=payload) as r:
-                        r.raise_for_status()
-                        for line in r.iter_lines():
-                            if line.strip():
-                                if line.startswith(b"data: "):
-                                    line = line[6:]
-                                if line == b"[DONE]":
-                                    break
-                                try:
-                                    chunk = json.loads(line)
-                                    delta = chunk.get("choices", [{}])[0].get("delta", {})
-                                    content = delta.get("content", "")
-                                    if content:
-                                        yield content
-                                except:
-                                    continue
+                with _client().stream("POST", url, headers=_headers(), json=payload, timeout=_timeout("chat")) as r:
+                    r.raise_for_status()
+                    for line in r.iter_lines():
+                        if line.strip():
+                            if line.startswith("data: "):
+                                line = line[6:]
+                            if line == "[DONE]":
+                                done = True
+                                break
+                            try:
+                                choice = (json.loads(line).get("choices") or [{}])[0]
+                                content = (choice.get("delta") or {}).get("content", "")
+                            except Exception:
+                                continue
+                            if choice.get("finish_reason"):
+                                done = True
+                            if content:
+                                yield content
+                if not done:
+                    raise RuntimeError("Stream LLM kết thúc trước khi hoàn tất (không có [DONE]/finish_reason)")
             except Exception as e:
-                print(f"⚠️ Streaming error: {e}")
+                metrics.backend_error("ollama", "chat_stream")
+                say(f"⚠️ Streaming error: {e}", level="warning", event="stream_error")
+                raise
         return stream_response()
 
-def embed_ollama(texts, model=None):
-    """
-    Ưu tiên Ollama native /api/embeddings (prompt),
-    nếu 404 thì fallback sang OpenAI-compatible /v1/embeddings (input).
-    """
-    mdl = model or os.getenv("EMBED_MODEL", "nomic-embed-text")
-    base = BASE_URL
+async def achat(messages, model=None, max_tokens=256, temperature=0.0):
+    """Bản async (không streaming) của chat(), dùng AsyncClient dùng chung."""
+    mdl = model or os.getenv("LLM_MODEL", "qwen2.5:3b-instruct")
+    url = f"{BASE_URL}/v1/chat/completions"
+    payload = {"model": mdl, "messages": messages, "max_tokens": max_tokens,
+               "temperature": temperature, "stream": False}
+    last_err = None
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            async with _aslot():
+                r = await _async_client().post(url, headers=_headers(), json=payload, timeout=_atimeout("chat"))
+            r.raise_for_status()
+            return r.json()["choices"][0]["message"]["content"]
+        except Exception as e:
+            last_err = e
+            if attempt < HTTP_RETRIES:
+                metrics.backend_retry("ollama", "chat")
+                await asyncio.sleep(HTTP_BACKOFF_SEC * (attempt + 1))
+    metrics.backend_error("ollama", "chat")
+    raise last_err
 
+EMBED_BATCH_SIZE  = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+
+# Endpoint embedding đã dò được (nhớ cho cả process, không dò lại mỗi lần gọi):
+#   "embed"      -> Ollama /api/embed      {"input": [...]}  -> {"embeddings": [[...], ...]}
+#   "v1"         -> OpenAI /v1/embeddings  {"input": [...]}  -> {"data": [{"index", "embedding"}, ...]}
+#   "embeddings" -> Ollama cũ /api/embeddings {"prompt": t}  -> {"embedding": [...]} (1 text / request)
+_EMBED_MODE = None
+_EMBED_MODE_LOCK = threading.Lock()
+
+def _check_vectors(vecs, n, mdl):
+    if len(vecs) != n:
+        raise RuntimeError(f"Embeddings trả về {len(vecs)} vector cho {n} input (model={mdl})")
+    for emb in vecs:
+        if not isinstance(emb, list) or not emb or not isinstance(emb[0], (int, float)):
+            raise RuntimeError(f"Embeddings malformed for model={mdl}")
+    return vecs
+
+def _embed_request(client, mode, texts, mdl):
+    """Một request embedding cho cả batch theo `mode`. Trả về None nếu endpoint 404."""
+    if mode == "embed":
+        r = client.post(f"{BASE_URL}/api/embed", headers=_headers(), json={"model": mdl, "input": texts}, timeout=_timeout("embed"))
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r.json().get("embeddings") or []
+    if mode == "v1":
+        r = client.post(f"{BASE_URL}/v1/embeddings", headers=_headers(), json={"model": mdl, "input": texts}, timeout=_timeout("embed"))
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        data = sorted(r.json().get("data", []), key=lambda d: d.get("index", 0))
+        return [d.get("embedding") for d in data]
+    # endpoint cũ: không có dạng batch
     outs = []
+    for t in texts:
+        r = client.post(f"{BASE_URL}/api/embeddings", headers=_headers(), json={"model": mdl, "prompt": t}, timeout=_timeout("embed"))
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        outs.append(r.json().get("embedding"))
+    return outs
+
+def _detect_embed_mode(client, texts, mdl):
+    """Dò endpoint một lần (các thread khác đợi). Trả về vectors của batch dùng để dò, None nếu đã có mode."""
+    global _EMBED_MODE
+    with _EMBED_MODE_LOCK:
+        if _EMBED_MODE:
+            return None
+        for mode in ("embed", "v1", "embeddings"):
+            vecs = _embed_request(client, mode, texts, mdl)
+            if vecs is not None:
+                vecs = _check_vectors(vecs, len(texts), mdl)
+                _EMBED_MODE = mode
+                if DEBUG_EMBED:
+                    say(f"[embed] dùng endpoint: {mode}", level="info", event="embed_endpoint")
+                return vecs
+        raise RuntimeError(f"Không tìm thấy embedding endpoint tại {BASE_URL} (model={mdl})")
+
+def _embed_batch(client, texts, mdl):
     last_err = None
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            if not _EMBED_MODE:
+                vecs = _detect_embed_mode(client, texts, mdl)
+                if vecs is not None:
+                    return vecs
+            vecs = _embed_request(client, _EMBED_MODE, texts, mdl)
+            if vecs is None:
+                raise RuntimeError(f"Embedding endpoint '{_EMBED_MODE}' trả về 404 (model={mdl})")
+            return _check_vectors(vecs, len(texts), mdl)
+        except Exception as e:
+            last_err = e
+            if attempt < HTTP_RETRIES:
+                metrics.backend_retry("ollama", "embed")
+                time.sleep(HTTP_BACKOFF_SEC * (attempt + 1))
+    metrics.backend_error("ollama", "embed")
+    raise last_err
 
-    for t in texts:
-        # 1) thử native
-        payload_native = {"model": mdl, "prompt": t}
-        url_native = f"{base}/api/embeddings"
+def embed_ollama(texts, model=None, batch_size=None, concurrency=None):
+    """
+    Embed danh sách texts theo batch thật (nhiều input / request).
+    Ưu tiên Ollama /api/embed, fallback /v1/embeddings, cuối cùng /api/embeddings (từng text).
+    Endpoint được dò một lần rồi ghi nhớ. Các batch chạy song song tối đa `concurrency` request.
+    """
+    mdl = model or os.getenv("EMBED_MODEL", "nomic-embed-text")
+    texts = list(texts)
+    if not texts:
+        return []
+    bs = max(1, int(batch_size or EMBED_BATCH_SIZE))
+    conc = max(1, int(concurrency or EMBED_CONCURRENCY))
+    batches = [texts[i:i + bs] for i in range(0, len(texts), bs)]
 
-        # 2) fallback openai-compatible
-        payload_oai = {"model": mdl, "input": t}
-        url_oai = f"{base}/v1/embeddings"
+    client = _client()
+    if len(batches) == 1 or conc == 1:
+        results = [_embed_batch(client, b, mdl) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(conc, len(batches))) as ex:
+            results = list(ex.map(lambda b: _embed_batch(client, b, mdl), batches))
 
-        for attempt in range(HTTP_RETRIES + 1):
-            try:
-                with _client() as client:
-                    r = client.post(url_native, headers=_headers(), json=payload_native)
-                if r.status_code == 404:
-                    # thử openai-compatible
-                    with _client() as client:
-                        r2 = client.post(url_oai, headers=_headers(), json=payload_oai)
-                    r2.raise_for_status()
-                    data = r2.json()
-                    # dạng OpenAI: {"data":[{"embedding":[...]}]}
-                    emb_list = data.get("data", [])
-                    if not emb_list:
-                        raise RuntimeError(f"Empty embedding (v1) for model={mdl}")
-                    emb = emb_list[0].get("embedding")
-                else:
-                    r.raise_for_status()
-                    data = r.json()
-                    emb = data.get("embedding")
+    outs = []
+    for vecs in results:
+        outs.extend(vecs)
+    return outs
 
-                if not isinstance(emb, list) or not emb or not isinstance(emb[0], (int, float)):
-                    raise RuntimeError(f"Embeddings malformed for model={mdl}")
-                outs.append(emb)
-                break
-            except Exception as e:
-                last_err = e
-                if attempt < HTTP_RETRIES:
-                    time.sleep(HTTP_BACKOFF_SEC * (attempt + 1))
-                else:
-                    raise last_err
+async def aembed_ollama(texts, model=None, batch_size=None, concurrency=None):
+    """Bản async của embed_ollama(): cùng endpoint đã dò, tối đa `concurrency` request song song."""
+    mdl = model or os.getenv("EMBED_MODEL", "nomic-embed-text")
+    texts = list(texts)
+    if not texts:
+        return []
+    if not _EMBED_MODE:
+        # dò endpoint bằng client sync (chỉ một lần cho cả process)
+        await asyncio.to_thread(_detect_embed_mode, _client(), texts[:1], mdl)
+    bs = max(1, int(batch_size or EMBED_BATCH_SIZE))
+    sem = asyncio.Semaphore(max(1, int(concurrency or EMBED_CONCURRENCY)))
+    client = _async_client()
 
+    async def one(batch):
+        body = {"model": mdl, "input": batch}
+        async with sem:
+            last_err = None
+            for attempt in range(HTTP_RETRIES + 1):
+                try:
+                    if _EMBED_MODE == "embed":
+                        async with _aslot():
+                            r = await client.post(f"{BASE_URL}/api/embed", headers=_headers(), json=body, timeout=_atimeout("embed"))
+                        r.raise_for_status()
+                        vecs = r.json().get("embeddings") or []
+                    elif _EMBED_MODE == "v1":
+                        async with _aslot():
+                            r = await client.post(f"{BASE_URL}/v1/embeddings", headers=_headers(), json=body, timeout=_atimeout("embed"))
+                        r.raise_for_status()
+                        data = sorted(r.json().get("data", []), key=lambda d: d.get("index", 0))
+                        vecs = [d.get("embedding") for d in data]
+                    else:
+                        vecs = []
+                        for t in batch:
+                            async with _aslot():
+                                r = await client.post(f"{BASE_URL}/api/embeddings", headers=_headers(),
+                                                      json={"model": mdl, "prompt": t}, timeout=_atimeout("embed"))
+                            r.raise_for_status()
+                            vecs.append(r.json().get("embedding"))
+                    return _check_vectors(vecs, len(batch), mdl)
+                except Exception as e:
+                    last_err = e
+                    if attempt < HTTP_RETRIES:
+                        metrics.backend_retry("ollama", "embed")
+                        await asyncio.sleep(HTTP_BACKOFF_SEC * (attempt + 1))
+            metrics.backend_error("ollama", "embed")
+            raise last_err
+
+    results = await asyncio.gather(*(one(texts[i:i + bs]) for i in range(0, len(texts), bs)))
+    outs = []
+    for vecs in results:
+        outs.extend(vecs)
     return outs
@@ -0,0 +1,304 @@
+"""
+Registry metric trong process + xuất dạng text Prometheus (GET /metrics).
+
+Ghi metric nằm trên đường nóng nên được giữ ở mức rẻ nhất: mỗi series (một tổ hợp nhãn) là một
+object tạo sẵn một lần, ghi = một lock không tranh chấp + vài phép cộng (histogram: bisect trên
+bucket cố định), không cấp phát. Giá trị đã có sẵn ở nơi khác (cache hit/miss, số unit của index,
+connection pool) không ghi trên đường nóng mà được đọc qua callback lúc scrape.
+"""
+import os, threading, time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# giây; từ bước CPU dưới 1ms (merge/context) tới LLM trên CPU hàng chục giây
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_str(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = float(value)
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # phần tử cuối: > bucket lớn nhất (+Inf)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Series của một tổ hợp nhãn (tạo lần đầu, sau đó chỉ là một lần tra dict)."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: cần nhãn {self.labelnames}, nhận {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _series(self) -> List[Tuple[tuple, object]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._series():
+            out.append(f"{self.name}{_label_str(self.labelnames, values)} {_fmt(child.value)}")
+        return out
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for values, child in self._series():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le_label = 'le="%s"' % _fmt(le)
+                out.append(f"{self.name}_bucket{_label_str(self.labelnames, values, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_label_str(self.labelnames, values)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_label_str(self.labelnames, values)} {acc}")
+        return out
+
+class CallbackMetric:
+    """Metric đọc lúc scrape: `fn()` trả về {tuple giá trị nhãn: số}."""
+    def __init__(self, name: str, doc: str, kind: str, labelnames: Sequence[str], fn: Callable[[], Dict[tuple, float]]):
+        self.name, self.doc, self.kind = name, doc, kind
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception as e:
+            return [f"# {self.name}: lỗi đọc ({_escape(e)})"]
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for labels, v in values.items():
+            if v is not None:
+                out.append(f"{self.name}{_label_str(self.labelnames, labels)} {_fmt(v)}")
+        return out
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} đã đăng ký")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, doc, labelnames))
+
+    def gauge(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, doc, labelnames))
+
+    def histogram(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, doc, labelnames, buckets))
+
+    def callback(self, name: str, doc: str, kind: str, labelnames: Sequence[str], fn) -> CallbackMetric:
+        return self.register(CallbackMetric(name, doc, kind, labelnames, fn))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.histogram("aura_stage_seconds", "Thời gian từng bước xử lý câu hỏi (giây)", ["stage"])
+REQUESTS = REGISTRY.counter("aura_requests_total", "Số câu hỏi đã trả lời theo mode", ["mode"])
+REQUEST_ERRORS = REGISTRY.counter("aura_request_errors_total", "Số câu hỏi lỗi theo endpoint", ["endpoint"])
+IN_FLIGHT = REGISTRY.gauge("aura_requests_in_flight", "Số câu hỏi đang xử lý")
+VECTOR_STATUS = REGISTRY.counter("aura_vector_leg_total",
+                                 "Kết quả nhánh vector (ok, timeout, error, off, ref, cached)", ["status"])
+BACKEND_ERRORS = REGISTRY.counter("aura_backend_errors_total",
+                                  "Lỗi gọi backend (sau khi hết retry) theo backend và thao tác", ["backend", "op"])
+BACKEND_RETRIES = REGISTRY.counter("aura_backend_retries_total", "Số lần retry request backend", ["backend", "op"])
+
+# timings (ms) của pipeline -> nhãn stage; bước không chạy ở request này thì không ghi
+_STAGES = (("title_ms", "title"), ("bm25_ms", "bm25"), ("vector_ms", "vector"), ("merge_ms", "merge"),
+           ("context_ms", "context"), ("llm_ms", "llm"), ("ttft_ms", "ttft"), ("total_ms", "total"))
+_STAGE_CHILDREN = {key: STAGE_SECONDS.labels(stage) for key, stage in _STAGES}
+_REF_LOOKUP = STAGE_SECONDS.labels("ref_lookup")
+
+def record_request(mode: str, timings: Optional[Dict] = None, llm_ran: bool = True):
+    """Ghi một câu hỏi đã trả lời: counter mode, kết quả nhánh vector, histogram từng bước đã chạy."""
+    if not METRICS_ENABLED:
+        return
+    REQUESTS.labels(mode).inc()
+    tm = timings or {}
+    vs = tm.get("vector_status")
+    if vs:
+        VECTOR_STATUS.labels(vs).inc()
+    retrieval_ran = tm.get("result_cache") == "miss"
+    for key, child in _STAGE_CHILDREN.items():
+        v = tm.get(key)
+        if v is None:
+            continue
+        if key in ("bm25_ms", "merge_ms") and not retrieval_ran:
+            continue
+        if key == "vector_ms" and vs not in ("ok", "timeout", "error"):
+            continue
+        if key == "llm_ms" and (not llm_ran or mode == "direct-cite"):
+            continue
+        child.observe(float(v) / 1000.0)
+    if vs == "ref" and tm.get("retrieval_ms") is not None:
+        _REF_LOOKUP.observe(float(tm["retrieval_ms"]) / 1000.0)
+
+def record_error(endpoint: str):
+    if METRICS_ENABLED:
+        REQUEST_ERRORS.labels(endpoint).inc()
+
+def backend_retry(backend: str, op: str):
+    if METRICS_ENABLED:
+        BACKEND_RETRIES.labels(backend, op).inc()
+
+def backend_error(backend: str, op: str):
+    if METRICS_ENABLED:
+        BACKEND_ERRORS.labels(backend, op).inc()
+
+class track_in_flight:
+    """`with track_in_flight():` tăng/giảm gauge số câu hỏi đang xử lý."""
+    __slots__ = ()
+
+    def __enter__(self):
+        if METRICS_ENABLED:
+            IN_FLIGHT.inc()
+        return self
+
+    def __exit__(self, *exc):
+        if METRICS_ENABLED:
+            IN_FLIGHT.dec()
+        return False
+
+def _cache_values() -> Dict[tuple, float]:
+    from core import result_cache
+    from core.retrieval.vector_jsonl import embed_cache_stats
+    st = result_cache.stats()
+    caches = {"result": st["hits"], "answer": st["answers"], "query_embed": embed_cache_stats()}
+    out = {}
+    for name, s in caches.items():
+        out[(name, "hit")] = s["hits"]
+        out[(name, "miss")] = s["misses"]
+    return out
+
+def _index_values() -> Dict[tuple, float]:
+    from core import pipeline
+    st = pipeline.index_status()
+    return {("units",): st["units"], ("vector_units",): st["vector_units"], ("version",): st["version"]}
+
+def _pool_values() -> Dict[tuple, float]:
+    from core.llm_client import pool_stats
+    st = pool_stats()
+    return {(k,): st[k] for k in ("requests", "connections_opened", "open_connections", "idle_connections", "async_waiting")}
+
+REGISTRY.callback("aura_cache_requests_total", "Số lần tra cache theo cache và kết quả", "counter",
+                  ["cache", "result"], _cache_values)
+REGISTRY.callback("aura_index_info", "Kích thước index đang phục vụ (units, vector_units, version)", "gauge",
+                  ["field"], _index_values)
+REGISTRY.callback("aura_http_pool", "Connection pool tới Ollama/OpenAI-compatible", "gauge",
+                  ["field"], _pool_values)
+REGISTRY.callback("aura_process_start_time_seconds", "Thời điểm process khởi động (unix)", "gauge",
+                  [], lambda t=time.time(): {(): t})
+
+def render() -> str:
+    return REGISTRY.render()
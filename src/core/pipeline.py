@@ -1,24 +1,54 @@
 from __future__ import annotations
-from typing import List, Dict
-import os, re, time, pathlib
+from typing import Iterable, Iterator, List, Dict, Optional
+import os, re, time, pathlib, asyncio, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
 
 # BM25
 from core.retrieval.bm25_json import (
-    load_index as bm25_load_index,
-    reload_index as bm25_reload_index,
-    search as bm25_search,
+    JsonBM25,
+    build_index as bm25_build_index,
+    install as bm25_install,
     available_units,
 )
 # Vector JSONL
-from core.retrieval.vector_jsonl import load_vector_store, vector_search
+from core.retrieval.vector_jsonl import (
+    VectorStore,
+    open_vector_store,
+    install_store,
+    embed_query,
+    embed_queries,
+    aembed_query,
+    embed_cache_stats,
+)
+from core.retrieval.refs import RefIndex
+from core.context_packer import CONTEXT_PACKER, pack_context, budget_tokens, estimate_tokens
 
 from core.settings import Settings
-from core.llm_client import chat
-from core.utils import Heartbeat, lap_timer, print_step_timing, print_timing_info, check_internet_connection, print_status_info
+from core import result_cache
+from core.llm_client import chat, achat
+from core.eventlog import say
+from core.utils import Heartbeat, lap_timer, print_step_timing, print_timing_info, is_online as connectivity_online, print_status_info
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 PROMPT_PATH = ROOT / "prompts" / "final_answer.txt"
 
+# Hai nhánh retrieval (BM25, vector) chạy song song, mỗi nhánh có deadline riêng.
+# Hai pool tách biệt: nhánh vector (chờ HTTP embedding, có thể treo tới EMBED_READ_TIMEOUT x số lần retry)
+# chiếm worker của VECTOR_WORKERS, không làm nhánh BM25 (CPU, ~ms) phải xếp hàng sau nó.
+RETRIEVAL_WORKERS  = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+VECTOR_WORKERS     = int(os.getenv("VECTOR_WORKERS", str(RETRIEVAL_WORKERS)))
+BM25_TIMEOUT_SEC   = float(os.getenv("BM25_TIMEOUT_SEC", "5"))
+VECTOR_TIMEOUT_SEC = float(os.getenv("VECTOR_TIMEOUT_SEC", "10"))
+_RETRIEVAL_POOL = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+_VECTOR_POOL = ThreadPoolExecutor(max_workers=VECTOR_WORKERS, thread_name_prefix="vector")
+# Câu hỏi nêu đích danh "Điều X khoản Y ..." -> tra thẳng RefIndex, không chạy BM25/embedding
+REF_LOOKUP = os.getenv("REF_LOOKUP", "true").lower() == "true"
+# answer_batch(): số câu retrieval cùng lúc (một request embedding + một lượt quét ma trận) và số LLM song song
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "32"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
 # ---- Heuristics rút gọn để thu hẹp phạm vi theo từ khóa ----
 # NOTE: Đây là ví dụ cho dữ liệu mẫu pháp luật Việt Nam
 # Nếu bạn dùng dữ liệu riêng, hãy tùy chỉnh hoặc comment lại phần này
@@ -45,7 +75,10 @@ def _pick_titles(question: str, data_dir: str) -> List[str]:
     chosen: List[str] = [name for (rg, name) in _KEY2TITLE if rg.search(question or "") and name in titles]
     return list(dict.fromkeys(chosen))[:2]
 
-def _format_context(hits: List[Dict], max_chars: int) -> str:
+def _format_context(hits: List[Dict], max_chars: int, max_tokens: int = 0) -> str:
+    if CONTEXT_PACKER:
+        return pack_context(hits, budget_tokens(max_tokens, max_chars))[0]
+    # định dạng cũ (CONTEXT_PACKER=false): mỗi hit một khối kèm SOURCE, cắt theo số ký tự
     buf, total = [], 0
     for h in hits:
         head = f"[{h['title']} | Điều {h['article']}" + (f", Khoản {h.get('clause')}]" if h.get('clause') else "]")
@@ -68,7 +101,7 @@ def _direct_cite(hits: List[Dict]) -> Dict:
     )
     return {"mode": "direct-cite", "answer": answer, "citations": hits, "used_context": True}
 
-def _rag_answer(question: str, ctx: str, settings: Settings) -> str:
+def _rag_messages(question: str, ctx: str) -> List[Dict]:
     try:
         sys_prompt = PROMPT_PATH.read_text(encoding="utf-8")
     except Exception:
@@ -80,180 +113,640 @@ def _rag_answer(question: str, ctx: str, settings: Settings) -> str:
             "Nếu thiếu thông tin, ghi 'Cần tham khảo thêm' và nêu rõ cần gì. "
             "Dùng markdown có cấu trúc rõ ràng."
         )
-    messages = [
+    return [
         {"role": "system", "content": sys_prompt},
         {"role": "user", "content": f"CONTEXT:\n{ctx}\n\nCÂU HỎI: {question}"},
     ]
-    model       = getattr(settings, "llm_model",  os.getenv("LLM_MODEL", "qwen2.5:3b-instruct"))
-    max_tokens  = getattr(settings, "max_tokens", int(os.getenv("MAX_TOKENS", "512")))
-    temperature = getattr(settings, "temperature", 0.0)
 
+def _llm_params(settings: Settings) -> Dict:
+    return {
+        "model":       getattr(settings, "llm_model",  os.getenv("LLM_MODEL", "qwen2.5:3b-instruct")),
+        "max_tokens":  getattr(settings, "max_tokens", int(os.getenv("MAX_TOKENS", "512"))),
+        "temperature": getattr(settings, "temperature", 0.0),
+    }
+
+def _answer_key(question: str, ctx: str, settings: Settings) -> str:
+    params = _llm_params(settings)
+    return result_cache.answer_key(question, ctx, params["model"], PROMPT_PATH,
+                                   max_tokens=params["max_tokens"], temperature=params["temperature"])
+
+def _rag_answer(question: str, ctx: str, settings: Settings) -> str:
+    messages = _rag_messages(question, ctx)
     hb_sec = float(os.getenv("HEARTBEAT_SEC", "60"))
     with Heartbeat("Đang gọi LLM", every=hb_sec):
-        return chat(messages, model=model, max_tokens=max_tokens, temperature=temperature)
-
-def _rrf_merge(bm25_hits: List[Dict], vec_hits: List[Dict], top_k: int = 6, k: float = 60.0) -> List[Dict]:
-    pool: Dict[tuple, Dict] = {}
-    for rank, h in enumerate(bm25_hits, 1):
-        key = (h["title"], h["article"], h.get("clause"), h["source"])
-        pool.setdefault(key, {"item": h.copy(), "rrf": 0.0, "bm_r": rank, "ve_r": 10**9})
-        pool[key]["rrf"] += 1.0 / (k + rank)
-    for rank, h in enumerate(vec_hits, 1):
-        key = (h["title"], h["article"], h.get("clause"), h["source"])
-        pool.setdefault(key, {"item": h.copy(), "rrf": 0.0, "bm_r": 10**9, "ve_r": rank})
-        pool[key]["rrf"] += 1.0 / (k + rank)
-        if "score" not in pool[key]["item"] and h.get("vscore") is not None:
-            pool[key]["item"]["score"] = h["vscore"]
-    merged = sorted(pool.values(), key=lambda x: (-x["rrf"], x["bm_r"], x["ve_r"]))
+        return chat(messages, **_llm_params(settings))
+
+def stream_rag_answer(question: str, ctx: str, settings: Settings):
+    """Generator token của câu trả lời LLM (Ollama, streaming); raise nếu stream đứt trước khi hoàn tất."""
+    return chat(_rag_messages(question, ctx), stream=True, **_llm_params(settings))
+
+def _rrf_merge(bm25_hits: List[tuple], vec_hits: List[tuple], corpus, top_k: int = 6, k: float = 60.0) -> List[Dict]:
+    """
+    Hợp nhất RRF trên unit ID: `bm25_hits`/`vec_hits` là [(uid, score)] theo thứ tự hạng.
+    Chỉ dựng dict metadata cho top_k kết quả cuối.
+    """
+    pool: Dict[int, list] = {}  # uid -> [rrf, hạng bm25, hạng vector, điểm bm25, điểm vector]
+    for rank, (uid, sc) in enumerate(bm25_hits, 1):
+        pool[uid] = [1.0 / (k + rank), rank, 10**9, sc, None]
+    for rank, (uid, sc) in enumerate(vec_hits, 1):
+        ent = pool.get(uid)
+        if ent is None:
+            pool[uid] = [1.0 / (k + rank), 10**9, rank, None, sc]
+        else:
+            ent[0] += 1.0 / (k + rank)
+            ent[2], ent[4] = rank, sc
+    merged = sorted(pool.items(), key=lambda x: (-x[1][0], x[1][1], x[1][2]))
     out = []
-    for x in merged[:top_k]:
-        it = x["item"]
-        it["rrf"] = round(x["rrf"], 6)
+    for uid, (rrf, _, _, bm_sc, ve_sc) in merged[:top_k]:
+        it = corpus.meta(uid)
+        # điểm BM25 nếu có, không thì cosine của nhánh vector
+        it["score"] = round(bm_sc, 4) if bm_sc is not None else float(ve_sc)
+        it["rrf"] = round(rrf, 6)
         out.append(it)
     return out
 
-def load_index(data_dir: str) -> int:
-    n = bm25_load_index(data_dir)
-    if os.getenv("EMBEDDINGS_ENABLED", "true").lower() == "true":
+def _bm25_leg(ix: "_IndexSet", question: str, top_k: int, allow_titles: Optional[List[str]]):
+    t0 = time.perf_counter()
+    hits = ix.bm25.search_ids(question, top_k=top_k, allow_titles=allow_titles)
+    return hits, (time.perf_counter() - t0) * 1000.0
+
+def _vector_leg(ix: "_IndexSet", question: str, top_k: int, allow_titles: Optional[List[str]]):
+    t0 = time.perf_counter()
+    qv, hit = embed_query(question, embed_model=os.getenv("EMBED_MODEL", "nomic-embed-text"))
+    hits = ix.search_vectors(qv, top_k, allow_titles)
+    return hits, hit, (time.perf_counter() - t0) * 1000.0
+
+def _use_vectors(ix: "_IndexSet", question: str) -> bool:
+    return bool(os.getenv("EMBEDDINGS_ENABLED", "true").lower() == "true" and len(ix.vectors) and question.strip())
+
+def _retrieve(question: str, chosen_titles: List[str], settings: Settings) -> Dict:
+    """
+    Chạy BM25 và vector song song: request embedding câu hỏi bắt đầu ngay,
+    BM25 chạy trong lúc chờ. Nhánh vector quá VECTOR_TIMEOUT_SEC (hoặc lỗi) -> chỉ dùng BM25.
+    """
+    ix = _ACTIVE  # cả request dùng một phiên bản index, kể cả khi reload xảy ra giữa chừng
+    allow = chosen_titles or None
+    t0 = time.perf_counter()
+    use_vec = _use_vectors(ix, question)
+    vec_fut = _VECTOR_POOL.submit(_vector_leg, ix, question, settings.top_k, allow) if use_vec else None
+    bm_fut = _RETRIEVAL_POOL.submit(_bm25_leg, ix, question, settings.top_k, allow)
+
+    out = {"bm": [], "vc": [], "bm25_ms": 0.0, "vector_ms": 0.0, "embed_hit": None,
+           "vector_status": "off" if not use_vec else "ok", "corpus": ix.corpus}
+    try:
+        out["bm"], out["bm25_ms"] = bm_fut.result(timeout=BM25_TIMEOUT_SEC)
+    except FutureTimeout:
+        say(f"⚠️ BM25 quá {BM25_TIMEOUT_SEC}s - bỏ qua nhánh BM25", level="warning", event="bm25_timeout")
+        out["bm25_ms"] = (time.perf_counter() - t0) * 1000.0
+    if vec_fut is not None:
+        remaining = max(0.0, VECTOR_TIMEOUT_SEC - (time.perf_counter() - t0))
         try:
-            index_path = os.getenv("INDEX_PATH", "index/index.jsonl")
-            m = load_vector_store(index_path)
-            print(f"[vector] loaded {m} units from {index_path}")
+            out["vc"], out["embed_hit"], out["vector_ms"] = vec_fut.result(timeout=remaining)
+        except FutureTimeout:
+            # chưa kịp chạy (pool vector đầy) -> hủy để không dồn việc cũ; đang chạy thì chạy tiếp trong nền,
+            # embedding vẫn được ghi vào cache cho lần sau
+            vec_fut.cancel()
+            out["vector_status"] = "timeout"
+            out["vector_ms"] = (time.perf_counter() - t0) * 1000.0
+            say(f"⚠️ Vector search quá {VECTOR_TIMEOUT_SEC}s - dùng BM25-only", level="warning", event="vector_timeout")
         except Exception as e:
-            print(f"[vector] skip: {e}")
-    return n
+            out["vector_status"] = "error"
+            out["vector_ms"] = (time.perf_counter() - t0) * 1000.0
+            say(f"⚠️ Vector search lỗi ({e}) - dùng BM25-only", level="warning", event="vector_error", error=str(e))
+    out["retrieval_ms"] = (time.perf_counter() - t0) * 1000.0
+    # thời gian tiết kiệm được nhờ chạy chồng hai nhánh so với chạy tuần tự
+    out["overlap_saved_ms"] = (
+        max(0.0, out["bm25_ms"] + out["vector_ms"] - out["retrieval_ms"]) if out["vector_status"] == "ok" else 0.0
+    )
+    return out
+
+async def _aretrieve(question: str, chosen_titles: List[str], settings: Settings) -> Dict:
+    """Bản async của _retrieve(): embedding qua AsyncClient, phần CPU (BM25, chấm điểm vector) chạy trên hai pool riêng."""
+    loop = asyncio.get_running_loop()
+    ix = _ACTIVE
+    allow = chosen_titles or None
+    t0 = time.perf_counter()
+    use_vec = _use_vectors(ix, question)
+
+    async def vector_leg():
+        t_v0 = time.perf_counter()
+        qv, hit = await aembed_query(question, embed_model=os.getenv("EMBED_MODEL", "nomic-embed-text"))
+        hits = await loop.run_in_executor(_VECTOR_POOL, ix.search_vectors, qv, settings.top_k, allow)
+        return hits, hit, (time.perf_counter() - t_v0) * 1000.0
+
+    vec_task = asyncio.ensure_future(vector_leg()) if use_vec else None
+    bm_fut = loop.run_in_executor(_RETRIEVAL_POOL, _bm25_leg, ix, question, settings.top_k, allow)
 
-def reload_index(data_dir: str) -> int:
-    n = bm25_reload_index(data_dir)
-    if os.getenv("EMBEDDINGS_ENABLED", "true").lower() == "true":
+    out = {"bm": [], "vc": [], "bm25_ms": 0.0, "vector_ms": 0.0, "embed_hit": None,
+           "vector_status": "off" if not use_vec else "ok", "corpus": ix.corpus}
+    try:
+        out["bm"], out["bm25_ms"] = await asyncio.wait_for(bm_fut, BM25_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        say(f"⚠️ BM25 quá {BM25_TIMEOUT_SEC}s - bỏ qua nhánh BM25", level="warning", event="bm25_timeout")
+        out["bm25_ms"] = (time.perf_counter() - t0) * 1000.0
+    if vec_task is not None:
+        remaining = max(0.0, VECTOR_TIMEOUT_SEC - (time.perf_counter() - t0))
         try:
-            index_path = os.getenv("INDEX_PATH", "index/index.jsonl")
-            m = load_vector_store(index_path)
-            print(f"[vector] reloaded {m} units from {index_path}")
+            # shield: quá hạn thì vẫn để embedding chạy xong và ghi vào cache
+            out["vc"], out["embed_hit"], out["vector_ms"] = await asyncio.wait_for(asyncio.shield(vec_task), remaining)
+        except asyncio.TimeoutError:
+            out["vector_status"] = "timeout"
+            out["vector_ms"] = (time.perf_counter() - t0) * 1000.0
+            say(f"⚠️ Vector search quá {VECTOR_TIMEOUT_SEC}s - dùng BM25-only", level="warning", event="vector_timeout")
         except Exception as e:
-            print(f"[vector] skip reload: {e}")
-    return n
+            out["vector_status"] = "error"
+            out["vector_ms"] = (time.perf_counter() - t0) * 1000.0
+            say(f"⚠️ Vector search lỗi ({e}) - dùng BM25-only", level="warning", event="vector_error", error=str(e))
+    out["retrieval_ms"] = (time.perf_counter() - t0) * 1000.0
+    out["overlap_saved_ms"] = (
+        max(0.0, out["bm25_ms"] + out["vector_ms"] - out["retrieval_ms"]) if out["vector_status"] == "ok" else 0.0
+    )
+    return out
 
-def answer_question(question: str, settings: Settings) -> Dict:
-    t_all = time.perf_counter()
-    
-    # Kiểm tra kết nối internet
-    is_online = check_internet_connection()
-    ai_type = "gemini" if is_online and os.getenv("GOOGLE_API_KEY", "").strip() else "ollama"
-    model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash") if ai_type == "gemini" else os.getenv("LLM_MODEL", "qwen2.5:3b-instruct")
-    
-    # In thông tin trạng thái
-    print_status_info(is_online, ai_type, model_name, question[:50], "")
-    
-    # Chọn titles
-    print("🔍 Đang chọn phạm vi luật phù hợp...")
+def _cached_retrieval(hits: List[Dict]) -> Dict:
+    # hits lấy từ cache tầng 1: không chạy BM25/vector
+    return {"hits": hits, "bm": [], "vc": [], "bm25_ms": 0.0, "vector_ms": 0.0, "retrieval_ms": 0.0,
+            "overlap_saved_ms": 0.0, "embed_hit": None, "vector_status": "cached"}
+
+def _ref_retrieval(ix: "_IndexSet", question: str, chosen_titles: List[str]) -> Optional[Dict]:
+    """Tra trích dẫn điều/khoản/điểm trong câu hỏi; None nếu không có hoặc không phân giải được."""
+    if not REF_LOOKUP:
+        return None
+    t0 = time.perf_counter()
+    uids = ix.refs.resolve(question, chosen_titles)
+    if not uids:
+        return None
+    hits = []
+    for uid in uids:
+        it = ix.corpus.meta(uid)
+        it["score"] = 1.0
+        hits.append(it)
+    return {"hits": hits, "ref": True, "bm": [], "vc": [], "bm25_ms": 0.0, "vector_ms": 0.0,
+            "retrieval_ms": (time.perf_counter() - t0) * 1000.0, "overlap_saved_ms": 0.0,
+            "embed_hit": None, "vector_status": "ref"}
+
+def _retrieval_timings(r: Dict) -> Dict:
+    cache_st = embed_cache_stats()
+    return {
+        "result_cache": "skip" if r.get("ref") else ("hit" if "hits" in r else "miss"),
+        "bm25_ms": round(r["bm25_ms"], 2),
+        "vector_ms": round(r["vector_ms"], 2),
+        "retrieval_ms": round(r["retrieval_ms"], 2),
+        "overlap_saved_ms": round(r["overlap_saved_ms"], 2),
+        "vector_status": r["vector_status"],
+        "embed_cache": None if r["embed_hit"] is None else ("hit" if r["embed_hit"] else "miss"),
+        "embed_cache_hits": cache_st["hits"],
+        "embed_cache_misses": cache_st["misses"],
+    }
+
+class _IndexSet:
+    """
+    Một phiên bản index được phục vụ cùng nhau: BM25 + vector store + corpus (+ ánh xạ hàng vector -> unit ID).
+    Không sửa sau khi dựng. Reload dựng bản mới bên cạnh rồi thay `_ACTIVE` bằng một phép gán;
+    request đang chạy giữ tham chiếu tới bản cũ nên không bao giờ thấy index nửa cũ nửa mới.
+    """
+    def __init__(self, bm25: JsonBM25, vectors: VectorStore, version: int = 0, index_sig=None):
+        self.bm25 = bm25
+        self.vectors = vectors
+        self.corpus = bm25.corpus
+        self.refs = RefIndex(self.corpus)
+        self.vec_uids = vectors.uids_for(self.corpus) if len(vectors) else np.zeros(0, dtype=np.int32)
+        self.version = version
+        self.index_sig = index_sig
+        self.loaded_at = time.time()
+
+    def search_vectors(self, qv, top_k: int, allow_titles: Optional[List[str]] = None):
+        return self.vectors.search_ids(qv, top_k, allow_titles, uids=self.vec_uids)
+
+    def search_vectors_batch(self, qvs, top_k: int, allow_list: List[Optional[List[str]]]):
+        return self.vectors.search_ids_batch(qvs, top_k, allow_list, uids=self.vec_uids)
+
+_EMPTY_VECTORS = VectorStore(np.zeros((0, 0), dtype=np.float32), [])
+_ACTIVE = _IndexSet(JsonBM25(), _EMPTY_VECTORS)
+_RELOAD_LOCK = threading.Lock()
+_LAST_RELOAD: Dict = {}
+
+def _index_path() -> str:
+    return os.getenv("INDEX_PATH", "index/index.jsonl")
+
+def index_signature(index_path: Optional[str] = None) -> tuple:
+    """
+    (tên, mtime, size) các file của index vector - khác bản đang phục vụ nghĩa là cần nạp lại vector store.
+    Có index nhị phân: chỉ manifest.json + ivf.json (builder ghi cuối cùng, bằng os.replace), nên index.jsonl
+    bị xoá/ghi lại dần trong lúc build không kích hoạt reload. Chỉ có JSONL: theo chính file index.jsonl.
+    """
+    index_path = index_path or _index_path()
+    d = os.path.dirname(os.path.abspath(index_path))
+    if os.path.exists(os.path.join(d, "manifest.json")):
+        names = ("ivf.json", "manifest.json")
+    else:
+        names = (os.path.basename(index_path),)
+    sig = []
+    for name in names:
+        try:
+            st = os.stat(os.path.join(d, name))
+        except OSError:
+            continue
+        sig.append((name, st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+def _open_vectors(reloading: bool = False) -> Optional[VectorStore]:
+    if os.getenv("EMBEDDINGS_ENABLED", "true").lower() != "true":
+        return _EMPTY_VECTORS
+    index_path = _index_path()
+    try:
+        store = open_vector_store(index_path)
+        say(f"[vector] {'reloaded' if reloading else 'loaded'} {len(store)} units from {index_path}", level="info",
+            event="vector_loaded", units=len(store), path=index_path)
+        return store
+    except Exception as e:
+        say(f"[vector] skip{' reload' if reloading else ''}: {e}", level="warning", event="vector_skip", error=str(e))
+        return None
+
+def _install(ix: _IndexSet):
+    global _ACTIVE
+    _ACTIVE = ix
+    # các hàm cấp module (bm25_json.search, vector_jsonl.search_by_vector...) cũng trỏ sang bản mới
+    bm25_install(ix.bm25)
+    install_store(ix.vectors)
+
+def load_index(data_dir: str) -> int:
+    with _RELOAD_LOCK:
+        sig = index_signature()
+        ix = _IndexSet(bm25_build_index(data_dir), _open_vectors() or _EMPTY_VECTORS, 1, sig)
+        _install(ix)
+        return ix.bm25.total_units
+
+def reload_index(data_dir: str, force_vectors: bool = False) -> int:
+    """
+    Reload không chặn query: BM25 chỉ parse lại file luật đã đổi (xem bm25_json.build_index),
+    vector store chỉ nạp lại khi file index thay đổi; dựng xong mới thay phiên bản đang phục vụ.
+    """
+    with _RELOAD_LOCK:
+        t0 = time.perf_counter()
+        old = _ACTIVE
+        bm25 = bm25_build_index(data_dir, incremental=True)
+        sig = index_signature()
+        vectors = old.vectors
+        if force_vectors or sig != old.index_sig:
+            # nạp vector lỗi -> giữ store cũ
+            vectors = _open_vectors(reloading=True) or old.vectors
+        ix = _IndexSet(bm25, vectors, old.version + 1, sig)
+        _install(ix)
+        result_cache.invalidate()
+        _LAST_RELOAD.update({
+            "version": ix.version,
+            "duration_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+            "reparsed_files": list(bm25.reparsed),
+            "vectors_reloaded": vectors is not old.vectors,
+            "finished_at": time.time(),
+        })
+        return ix.bm25.total_units
+
+def index_status() -> Dict:
+    ix = _ACTIVE
+    return {
+        "version": ix.version,
+        "loaded_at": ix.loaded_at,
+        "units": ix.bm25.total_units,
+        "vector_units": len(ix.vectors),
+        "last_reload": dict(_LAST_RELOAD),
+    }
+
+_DIRECT_KW = re.compile(r"\b(điều\s+\d+|khoản\s+\d+|trích|khái\s*niệm|định\s*nghĩa|mức\s*phạt|xử\s*phạt|phạt)\b", re.I)
+
+def retrieve_context(question: str, settings: Settings) -> Dict:
+    """
+    Phần retrieval của answer_question(): chọn phạm vi luật, BM25 + vector song song,
+    hợp nhất RRF và định dạng context. Không gọi LLM.
+    """
+    say("🔍 Đang chọn phạm vi luật phù hợp...")
     t_title0 = time.perf_counter()
     chosen_titles = _pick_titles(question, settings.data_dir)
     t_title = (time.perf_counter() - t_title0) * 1000.0
     print_step_timing("Chọn phạm vi luật", t_title)
-    
-    # BM25 search
-    print("📝 Đang tìm kiếm từ khóa (BM25)...")
-    t_bm0 = time.perf_counter()
-    bm = bm25_search(question, top_k=settings.top_k, allow_titles=chosen_titles or None)
-    t_bm = (time.perf_counter() - t_bm0) * 1000.0
-    print_step_timing("Tìm kiếm BM25", t_bm)
-
-    # Vector search
-    vc: List[Dict] = []
-    t_vec = 0.0
-    if os.getenv("EMBEDDINGS_ENABLED", "true").lower() == "true":
-        print("🎯 Đang tìm kiếm ngữ nghĩa (Vector)...")
-        t_v0 = time.perf_counter()
-        try:
-            vc = vector_search(
-                question,
-                top_k=settings.top_k,
-                allow_titles=chosen_titles or None,
-                embed_model=os.getenv("EMBED_MODEL", "nomic-embed-text"),
-            )
-        finally:
-            t_vec = (time.perf_counter() - t_v0) * 1000.0
-            print_step_timing("Tìm kiếm Vector", t_vec)
-
-    # Merge results  
-    print("🔄 Đang hợp nhất kết quả tìm kiếm...")
+
+    key = result_cache.hits_key(question, chosen_titles, settings.top_k, settings.data_dir)
+    r = _ref_retrieval(_ACTIVE, question, chosen_titles)
+    cached = result_cache.get_hits(key) if r is None else None
+    if r is not None:
+        say(f"📌 Tra trực tiếp theo điều/khoản: {len(r['hits'])} unit")
+        print_step_timing("Tra cứu điều/khoản", r["retrieval_ms"])
+    elif cached is not None:
+        say("♻️ Dùng kết quả retrieval trong cache")
+        r = _cached_retrieval(cached)
+    else:
+        # BM25 + Vector search (song song)
+        say("📝🎯 Đang tìm kiếm từ khóa (BM25) và ngữ nghĩa (Vector) song song...")
+        r = _retrieve(question, chosen_titles, settings)
+        print_step_timing("Tìm kiếm BM25", r["bm25_ms"])
+        if r["vector_status"] != "off":
+            print_step_timing("Tìm kiếm Vector" + (" (cache)" if r["embed_hit"] else ""), r["vector_ms"])
+        print_step_timing(f"Retrieval song song (tiết kiệm {r['overlap_saved_ms']:.0f}ms)", r["retrieval_ms"])
+
+    # Merge results + format context
+    say("🔄 Đang hợp nhất kết quả tìm kiếm và định dạng ngữ cảnh...")
+    retrieved = _finish_context(question, chosen_titles, r, t_title, settings, key)
+    print_step_timing("Hợp nhất kết quả", retrieved["timings"]["merge_ms"])
+    print_step_timing("Định dạng ngữ cảnh", retrieved["timings"]["context_ms"])
+    return retrieved
+
+async def aretrieve_context(question: str, settings: Settings) -> Dict:
+    """Bản async của retrieve_context() (không in từng bước)."""
+    t_title0 = time.perf_counter()
+    chosen_titles = _pick_titles(question, settings.data_dir)
+    t_title = (time.perf_counter() - t_title0) * 1000.0
+    key = result_cache.hits_key(question, chosen_titles, settings.top_k, settings.data_dir)
+    r = _ref_retrieval(_ACTIVE, question, chosen_titles)
+    if r is None:
+        cached = result_cache.get_hits(key)
+        r = _cached_retrieval(cached) if cached is not None else await _aretrieve(question, chosen_titles, settings)
+    return _finish_context(question, chosen_titles, r, t_title, settings, key)
+
+def _finish_context(question: str, chosen_titles: List[str], r: Dict, t_title: float,
+                    settings: Settings, cache_key: str) -> Dict:
     t_merge0 = time.perf_counter()
-    hits = _rrf_merge(bm, vc, top_k=settings.top_k)
+    if "hits" in r:
+        hits = r["hits"]
+    else:
+        hits = _rrf_merge(r["bm"], r["vc"], r["corpus"], top_k=settings.top_k)
+        # kết quả thiếu nhánh vector (timeout/lỗi) không được cache
+        if r["vector_status"] in ("ok", "off"):
+            result_cache.put_hits(cache_key, hits)
     t_merge = (time.perf_counter() - t_merge0) * 1000.0
-    print_step_timing("Hợp nhất kết quả", t_merge)
-    # Format context
-    print("📄 Đang định dạng ngữ cảnh...")
     t_ctx0 = time.perf_counter()
-    ctx = _format_context(hits, settings.max_context_chars)
+    ctx = _format_context(hits, settings.max_context_chars, settings.max_context_tokens)
     t_ctx = (time.perf_counter() - t_ctx0) * 1000.0
-    print_step_timing("Định dạng ngữ cảnh", t_ctx)
-    
-    # In thông tin context sau khi có
-    if ctx:
-        print_status_info(is_online, ai_type, model_name, question[:50], ctx[:50])
 
     # router direct-cite?
-    direct_kw = re.compile(r"\b(điều\s+\d+|khoản\s+\d+|trích|khái\s*niệm|định\s*nghĩa|mức\s*phạt|xử\s*phạt|phạt)\b", re.I)
-    use_direct = settings.direct_cite_first and (direct_kw.search(question) or not settings.llm_enabled)
+    use_direct = settings.direct_cite_first and (_DIRECT_KW.search(question) or not settings.llm_enabled)
+    direct = bool(use_direct or not ctx.strip() or not settings.llm_enabled)
 
-    # Nếu không enable LLM hoặc không có context -> direct cite
-    if use_direct or not ctx.strip() or not settings.llm_enabled:
-        total = (time.perf_counter() - t_all) * 1000.0
-        if not settings.llm_enabled:
-            print("⚠️  LLM disabled - Chỉ trả về trích dẫn trực tiếp")
-        else:
-            print("✅ Sử dụng chế độ trích dẫn trực tiếp")
-        out = _direct_cite(hits)
-        
-        timing_data = {
-            "bm25_ms": round(t_bm, 2),
-            "vector_ms": round(t_vec, 2),
-            "llm_ms": 0.0,
-            "total_ms": round(total, 2),
-        }
-        print_timing_info(timing_data)
-        
-        out.update({
-            "chosen_titles": chosen_titles,
-            "available_units": available_units(),
-            "latency_ms": int(total),
-            "timings": timing_data,
-            "question_head": (question or "")[:50],
-            "context_head": (ctx or "")[:50],
-            "model": model_name,
-            "ai": ai_type,
-        })
-        return out
+    return {
+        "chosen_titles": chosen_titles,
+        "hits": hits,
+        "ctx": ctx,
+        "direct": direct,
+        "cached": "hits" in r and not r.get("ref"),
+        "timings": {
+            "title_ms": round(t_title, 2),
+            **_retrieval_timings(r),
+            "merge_ms": round(t_merge, 2),
+            "context_ms": round(t_ctx, 2),
+            "context_tokens": estimate_tokens(ctx),
+        },
+    }
 
-    # LLM Processing
-    print(f"🤖 Đang gửi yêu cầu đến AI ({ai_type.upper()})...")
-    t_llm0 = time.perf_counter()
-    content = _rag_answer(question, ctx, settings)
-    t_llm = (time.perf_counter() - t_llm0) * 1000.0
-    print_step_timing(f"Xử lý AI ({ai_type.upper()})", t_llm)
-    
+def stream_answer(question: str, retrieved: Dict, settings: Settings):
+    """
+    Generator token cho câu trả lời offline dựa trên kết quả retrieve_context():
+    direct-cite trả về một khối, còn lại stream token từ Ollama.
+    """
+    if retrieved["direct"]:
+        yield _direct_cite(retrieved["hits"])["answer"]
+        return
+    key = _answer_key(question, retrieved["ctx"], settings)
+    cached = result_cache.get_answer(key)
+    if cached is not None:
+        retrieved["answer_cached"] = True
+        yield cached
+        return
+    buf = []
+    for tok in stream_rag_answer(question, retrieved["ctx"], settings):
+        buf.append(tok)
+        yield tok
+    # chỉ tới được đây khi backend báo xong ([DONE]/finish_reason): lỗi giữa chừng -> stream_rag_answer raise,
+    # client ngắt -> generator đóng trước dòng này; câu trả lời cụt không bao giờ vào cache
+    result_cache.put_answer(key, "".join(buf))
+
+def _ai_target():
+    is_online = connectivity_online()
+    ai_type = "gemini" if is_online and os.getenv("GOOGLE_API_KEY", "").strip() else "ollama"
+    model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash") if ai_type == "gemini" else os.getenv("LLM_MODEL", "qwen2.5:3b-instruct")
+    return is_online, ai_type, model_name
+
+def _result(question: str, retrieved: Dict, mode: str, answer: str, llm_ms: float,
+            t_all: float, ai_type: str, model_name: str, verbose: bool = True,
+            answer_cached: bool = False) -> Dict:
     total = (time.perf_counter() - t_all) * 1000.0
-    
     timing_data = {
-        "bm25_ms": round(t_bm, 2),
-        "vector_ms": round(t_vec, 2),
-        "llm_ms": round(t_llm, 2),
+        **retrieved["timings"],
+        "llm_ms": round(llm_ms, 2),
         "total_ms": round(total, 2),
     }
-    print_timing_info(timing_data)
-
+    if verbose:
+        print_timing_info(timing_data)
     return {
-        "mode": "rag+llm",
-        "answer": content,
-        "citations": hits,
+        "mode": mode,
+        "answer": answer,
+        "citations": retrieved["hits"],
         "used_context": True,
-        "chosen_titles": chosen_titles,
+        "chosen_titles": retrieved["chosen_titles"],
         "available_units": available_units(),
         "latency_ms": int(total),
         "timings": timing_data,
         "question_head": (question or "")[:50],
-        "context_head": (ctx or "")[:50],
+        "context_head": (retrieved["ctx"] or "")[:50],
         "model": model_name,
         "ai": ai_type,
+        "cached": {"retrieval": retrieved["cached"], "answer": answer_cached},
     }
+
+def answer_question(question: str, settings: Settings) -> Dict:
+    t_all = time.perf_counter()
+    
+    # Kiểm tra kết nối internet
+    is_online, ai_type, model_name = _ai_target()
+    
+    # In thông tin trạng thái
+    print_status_info(is_online, ai_type, model_name, question[:50], "")
+    
+    retrieved = retrieve_context(question, settings)
+    hits, ctx = retrieved["hits"], retrieved["ctx"]
+
+    # In thông tin context sau khi có
+    if ctx:
+        print_status_info(is_online, ai_type, model_name, question[:50], ctx[:50])
+
+    # Nếu không enable LLM hoặc không có context -> direct cite
+    if retrieved["direct"]:
+        if not settings.llm_enabled:
+            say("⚠️  LLM disabled - Chỉ trả về trích dẫn trực tiếp")
+        else:
+            say("✅ Sử dụng chế độ trích dẫn trực tiếp")
+        return _result(question, retrieved, "direct-cite", _direct_cite(hits)["answer"], 0.0, t_all, ai_type, model_name)
+
+    key = _answer_key(question, ctx, settings)
+    content = result_cache.get_answer(key)
+    if content is not None:
+        say("♻️ Dùng câu trả lời trong cache")
+        return _result(question, retrieved, "rag+llm", content, 0.0, t_all, ai_type, model_name, answer_cached=True)
+
+    # LLM Processing
+    say(f"🤖 Đang gửi yêu cầu đến AI ({ai_type.upper()})...")
+    t_llm0 = time.perf_counter()
+    content = _rag_answer(question, ctx, settings)
+    t_llm = (time.perf_counter() - t_llm0) * 1000.0
+    print_step_timing(f"Xử lý AI ({ai_type.upper()})", t_llm)
+    result_cache.put_answer(key, content)
+    return _result(question, retrieved, "rag+llm", content, t_llm, t_all, ai_type, model_name)
+
+async def answer_question_async(question: str, settings: Settings) -> Dict:
+    """
+    Bản async của answer_question(): cùng kết quả, nhưng chờ Ollama/embedding qua
+    httpx.AsyncClient và đẩy phần CPU sang thread pool, nên một process giữ được
+    nhiều request đang chờ LLM cùng lúc.
+    """
+    t_all = time.perf_counter()
+    _, ai_type, model_name = _ai_target()
+    retrieved = await aretrieve_context(question, settings)
+    if retrieved["direct"]:
+        return _result(question, retrieved, "direct-cite", _direct_cite(retrieved["hits"])["answer"],
+                       0.0, t_all, ai_type, model_name, verbose=False)
+    key = _answer_key(question, retrieved["ctx"], settings)
+    content = result_cache.get_answer(key)
+    if content is not None:
+        return _result(question, retrieved, "rag+llm", content, 0.0, t_all, ai_type, model_name,
+                       verbose=False, answer_cached=True)
+    t_llm0 = time.perf_counter()
+    content = await achat(_rag_messages(question, retrieved["ctx"]), **_llm_params(settings))
+    t_llm = (time.perf_counter() - t_llm0) * 1000.0
+    result_cache.put_answer(key, content)
+    return _result(question, retrieved, "rag+llm", content, t_llm, t_all, ai_type, model_name, verbose=False)
+
+def retrieve_batch(questions: List[str], settings: Settings) -> List[Dict]:
+    """
+    retrieve_context() cho nhiều câu hỏi (không in từng bước): embedding các câu chưa có trong cache
+    bằng một request, vector search một lượt nhân ma trận cho cả lô; BM25 từng câu chạy trên pool BM25
+    (không dùng chung với nhánh vector của các request khác) trong lúc chờ embedding. Câu có trích dẫn điều/khoản hoặc trúng cache kết quả bỏ qua cả hai nhánh.
+    """
+    ix = _ACTIVE
+    n = len(questions)
+    titles, t_titles, keys, rs = [], [], [], []
+    for q in questions:
+        t0 = time.perf_counter()
+        chosen = _pick_titles(q, settings.data_dir)
+        t_titles.append((time.perf_counter() - t0) * 1000.0)
+        titles.append(chosen)
+        keys.append(result_cache.hits_key(q, chosen, settings.top_k, settings.data_dir))
+        r = _ref_retrieval(ix, q, chosen)
+        if r is None:
+            cached = result_cache.get_hits(keys[-1])
+            r = _cached_retrieval(cached) if cached is not None else None
+        rs.append(r)
+    todo = [i for i in range(n) if rs[i] is None]
+    if not todo:
+        return [_finish_context(questions[i], titles[i], rs[i], t_titles[i], settings, keys[i]) for i in range(n)]
+
+    t0 = time.perf_counter()
+    bm_futs = {i: _RETRIEVAL_POOL.submit(_bm25_leg, ix, questions[i], settings.top_k, titles[i] or None) for i in todo}
+    vec = [i for i in todo if _use_vectors(ix, questions[i])]
+    vc, hits, vec_status = {}, {}, "ok"
+    if vec:
+        try:
+            qvs, cache_hits = embed_queries([questions[i] for i in vec], embed_model=os.getenv("EMBED_MODEL", "nomic-embed-text"))
+            found = ix.search_vectors_batch(qvs, settings.top_k, [titles[i] or None for i in vec])
+            vc, hits = dict(zip(vec, found)), dict(zip(vec, cache_hits))
+        except Exception as e:
+            vec_status = "error"
+            say(f"⚠️ Vector search lỗi ({e}) - dùng BM25-only", level="warning", event="vector_error", error=str(e))
+    vector_ms = (time.perf_counter() - t0) * 1000.0
+
+    for i in todo:
+        use_vec = i in vc or (i in vec and vec_status != "ok")
+        r = {"bm": [], "vc": vc.get(i, []), "bm25_ms": 0.0, "vector_ms": vector_ms if use_vec else 0.0,
+             "embed_hit": hits.get(i), "corpus": ix.corpus,
+             "vector_status": vec_status if use_vec else "off"}
+        try:
+            remaining = max(0.0, BM25_TIMEOUT_SEC - (time.perf_counter() - t0))
+            r["bm"], r["bm25_ms"] = bm_futs[i].result(timeout=remaining)
+        except FutureTimeout:
+            say(f"⚠️ BM25 quá {BM25_TIMEOUT_SEC}s - bỏ qua nhánh BM25", level="warning", event="bm25_timeout")
+            r["bm25_ms"] = (time.perf_counter() - t0) * 1000.0
+        r["retrieval_ms"] = (time.perf_counter() - t0) * 1000.0
+        r["overlap_saved_ms"] = (
+            max(0.0, r["bm25_ms"] + r["vector_ms"] - r["retrieval_ms"]) if r["vector_status"] == "ok" else 0.0
+        )
+        rs[i] = r
+    return [_finish_context(questions[i], titles[i], rs[i], t_titles[i], settings, keys[i]) for i in range(n)]
+
+def _batch_answer(item: Dict, retrieved: Dict, settings: Settings, t_all: float, ai_type: str, model_name: str) -> Dict:
+    """Phần LLM của một câu trong lô (như answer_question, không in); lỗi chỉ hỏng câu đó."""
+    question = item["question"]
+    try:
+        if retrieved["direct"]:
+            out = _result(question, retrieved, "direct-cite", _direct_cite(retrieved["hits"])["answer"],
+                          0.0, t_all, ai_type, model_name, verbose=False)
+        else:
+            key = _answer_key(question, retrieved["ctx"], settings)
+            content = result_cache.get_answer(key)
+            if content is not None:
+                out = _result(question, retrieved, "rag+llm", content, 0.0, t_all, ai_type, model_name,
+                              verbose=False, answer_cached=True)
+            else:
+                t_llm0 = time.perf_counter()
+                content = _rag_answer(question, retrieved["ctx"], settings)
+                t_llm = (time.perf_counter() - t_llm0) * 1000.0
+                result_cache.put_answer(key, content)
+                out = _result(question, retrieved, "rag+llm", content, t_llm, t_all, ai_type, model_name, verbose=False)
+        out["status"] = "success"
+    except Exception as e:
+        out = {"status": "error", "error": str(e),
+               "timings": {**retrieved["timings"], "total_ms": round((time.perf_counter() - t_all) * 1000.0, 2)}}
+    return {"index": item["index"], **({"id": item["id"]} if "id" in item else {}), "question": question, **out}
+
+def _batch_items(questions: Iterable) -> Iterator[Dict]:
+    for i, q in enumerate(questions):
+        if isinstance(q, dict):
+            item = {"index": i, "question": str(q.get("question") or "").strip()}
+            if "id" in q:
+                item["id"] = q["id"]
+            yield item
+        else:
+            yield {"index": i, "question": str(q or "").strip()}
+
+def answer_batch(questions: Iterable, settings: Settings, concurrency: Optional[int] = None,
+                 batch_size: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Trả lời nhiều câu hỏi (chuỗi hoặc dict {"id", "question"}), yield kết quả ĐÚNG thứ tự đầu vào.
+    `questions` được đọc lười theo lô `batch_size` (retrieve_batch); LLM chạy tối đa `concurrency`
+    câu song song. Chỉ giữ trong RAM một lô đang retrieval + cửa sổ kết quả chờ trả theo thứ tự,
+    nên lô hàng nghìn câu không tích luỹ kết quả.
+    Chỉ dùng pipeline offline (Ollama); timings từng câu tính từ lúc lô của câu đó bắt đầu.
+    """
+    conc = max(1, int(concurrency or BATCH_LLM_CONCURRENCY))
+    bs = max(1, int(batch_size or BATCH_SIZE))
+    ai_type, model_name = "ollama", os.getenv("LLM_MODEL", "qwen2.5:3b-instruct")
+    pool = ThreadPoolExecutor(max_workers=conc, thread_name_prefix="batch-llm")
+    window = deque()
+    chunk: List[Dict] = []
+
+    def run_chunk():
+        t_all = time.perf_counter()
+        todo = [it for it in chunk if it["question"]]
+        retrieved = dict(zip((it["index"] for it in todo), retrieve_batch([it["question"] for it in todo], settings)))
+        for it in chunk:
+            if it["index"] in retrieved:
+                window.append(pool.submit(_batch_answer, it, retrieved[it["index"]], settings, t_all, ai_type, model_name))
+            else:
+                window.append({"index": it["index"], **({"id": it["id"]} if "id" in it else {}),
+                               "question": "", "status": "error", "error": "Vui lòng nhập câu hỏi"})
+        chunk.clear()
+
+    def ready(limit: int):
+        while len(window) > limit:
+            head = window.popleft()
+            yield head if isinstance(head, dict) else head.result()
+
+    try:
+        for item in _batch_items(questions):
+            chunk.append(item)
+            if len(chunk) >= bs:
+                run_chunk()
+                # lô sau được retrieval trong lúc LLM của lô trước còn chạy
+                yield from ready(bs + conc)
+        if chunk:
+            run_chunk()
+        yield from ready(0)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,150 @@
+"""
+Hot reload index: thread nền theo dõi data/*.json và thư mục index, reload khi có thay đổi.
+
+Reload chạy trên thread riêng (mỗi lúc tối đa một lần); query vẫn được phục vụ bằng
+phiên bản cũ cho tới khi bản mới dựng xong và được thay vào (xem pipeline.reload_index).
+"""
+import os, time, threading
+from typing import Dict, Optional, Tuple
+
+from core import pipeline
+from core.eventlog import say
+from core.retrieval.bm25_json import prime_file_cache
+from core.retrieval.corpus import data_files
+
+INDEX_WATCH_SEC = float(os.getenv("INDEX_WATCH_SEC", "10"))  # 0 = không tự theo dõi, chỉ reload qua admin
+
+def _data_signature(data_dir: str) -> Dict[str, Tuple[int, int]]:
+    out = {}
+    try:
+        names = data_files(data_dir)
+    except OSError:
+        return out
+    for name in names:
+        try:
+            st = os.stat(os.path.join(data_dir, name))
+        except OSError:
+            continue
+        out[name] = (st.st_mtime_ns, st.st_size)
+    return out
+
+class IndexWatcher:
+    """
+    Poll stat các file data + file index mỗi `interval` giây; thấy khác thì reload (single flight).
+    `trigger()` cho phép reload thủ công (endpoint admin); `status()` báo trạng thái lần reload gần nhất.
+    """
+    def __init__(self, data_dir: str, interval: float = None):
+        self.data_dir = data_dir
+        self.interval = INDEX_WATCH_SEC if interval is None else float(interval)
+        self.state = "idle"  # idle | running | failed
+        self.reloads = 0
+        self.last_reload_at = None
+        self.last_duration_ms = None
+        self.last_changed: list = []
+        self.last_error: Optional[str] = None
+        self._data_sig = _data_signature(data_dir)
+        self._index_sig = pipeline.index_signature()
+        self._index_pending = None  # chữ ký index mới thấy ở vòng poll trước, chờ đứng yên
+        self._stop = threading.Event()
+        self._t = None
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _changed_files(self) -> list:
+        data_sig = _data_signature(self.data_dir)
+        changed = sorted(n for n in set(data_sig) | set(self._data_sig) if data_sig.get(n) != self._data_sig.get(n))
+        index_sig = pipeline.index_signature()
+        if index_sig != self._index_sig:
+            # chỉ reload khi chữ ký đứng yên qua một chu kỳ poll (index chỉ có JSONL đang được ghi dở -> chờ)
+            if index_sig == self._index_pending:
+                changed.append("<index>")
+            self._index_pending = index_sig
+        return changed
+
+    def _reload(self, changed: list):
+        t0 = time.perf_counter()
+        # chụp chữ ký trước khi build: file đổi trong lúc build sẽ được thấy ở vòng poll sau
+        data_sig, index_sig = _data_signature(self.data_dir), pipeline.index_signature()
+        try:
+            n = pipeline.reload_index(self.data_dir)
+        except Exception as e:
+            with self._lock:
+                self.state, self.last_error = "failed", str(e)
+                self.last_duration_ms = round((time.perf_counter() - t0) * 1000.0, 2)
+            say(f"❌ Reload index lỗi (vẫn phục vụ bản cũ): {e}", level="error", event="reload_error")
+            return
+        with self._lock:
+            self._data_sig, self._index_sig = data_sig, index_sig
+            self.state, self.last_error = "idle", None
+            self.reloads += 1
+            self.last_reload_at = time.time()
+            self.last_duration_ms = round((time.perf_counter() - t0) * 1000.0, 2)
+            self.last_changed = changed
+        say(f"🔄 Reload index xong: {n} units, {self.last_duration_ms} ms ({', '.join(changed) or 'thủ công'})", level="info", event="reload_done")
+
+    def trigger(self, wait: bool = False, changed: Optional[list] = None) -> bool:
+        """Bắt đầu reload nếu chưa có reload nào đang chạy. Trả về False nếu đang chạy rồi."""
+        with self._lock:
+            if self._worker and self._worker.is_alive():
+                started = False
+            else:
+                self.state = "running"
+                self._worker = threading.Thread(target=self._reload, args=(changed or [],),
+                                                name="index-reload", daemon=True)
+                self._worker.start()
+                started = True
+            worker = self._worker
+        if wait:
+            worker.join()
+        return started
+
+    def _run(self):
+        # parse + tokenize sẵn từng file để lần reload đầu tiên cũng chỉ làm lại file đã đổi
+        try:
+            prime_file_cache(self.data_dir)
+        except Exception as e:
+            say(f"⚠️ Không chuẩn bị được cache reload: {e}", level="warning", event="reload_prepare_error")
+        while not self._stop.wait(self.interval):
+            changed = self._changed_files()
+            if changed:
+                self.trigger(changed=changed)
+
+    def start(self):
+        """Chạy thread theo dõi (idempotent). interval <= 0: không theo dõi."""
+        if self.interval <= 0:
+            return self
+        with self._lock:
+            if not (self._t and self._t.is_alive()):
+                self._stop.clear()
+                self._t = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+                self._t.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            st = {
+                "state": self.state,
+                "watching": bool(self._t and self._t.is_alive()),
+                "interval_sec": self.interval,
+                "reloads": self.reloads,
+                "last_reload_at": self.last_reload_at,
+                "duration_ms": self.last_duration_ms,
+                "changed": list(self.last_changed),
+                "error": self.last_error,
+            }
+        st["index"] = pipeline.index_status()
+        return st
+
+_WATCHER = None
+_WATCHER_LOCK = threading.Lock()
+
+def get_index_watcher(data_dir: str = None) -> IndexWatcher:
+    global _WATCHER
+    if _WATCHER is None:
+        with _WATCHER_LOCK:
+            if _WATCHER is None:
+                _WATCHER = IndexWatcher(data_dir or os.getenv("DATA_DIR", "data"))
+    return _WATCHER
@@ -0,0 +1,105 @@
+# core/result_cache.py
+"""
+Cache kết quả hai tầng cho pipeline:
+  - tầng 1 (hits):    câu hỏi chuẩn hoá + titles đã chọn + tham số retrieval -> hits đã hợp nhất RRF
+  - tầng 2 (answers): câu hỏi + hash context + model + hash file prompt -> câu trả lời cuối
+Khoá có kèm "phiên bản corpus" (fingerprint các file data/*.json và index), nên
+dữ liệu/prompt đổi là khoá cũ không còn khớp; reload_index() xoá hẳn cả hai tầng.
+"""
+import os, hashlib, threading
+from typing import Dict, List, Optional, Sequence
+from core.cache import LRUCache, normalize_text, make_key
+
+_PATH = os.getenv("RESULT_CACHE_PATH", "").strip() or None
+
+_HITS = LRUCache(
+    maxsize=int(os.getenv("RESULT_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RESULT_CACHE_TTL", "3600")),
+    path=_PATH,
+    name="retrieval_hits",
+)
+_ANSWERS = LRUCache(
+    maxsize=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+    path=_PATH,
+    name="answers",
+)
+
+_FILE_HASH: Dict[str, tuple] = {}  # path -> ((mtime_ns, size), sha1 nội dung)
+_LOCK = threading.Lock()
+
+def _stat_sig(path: str):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+def file_hash(path) -> str:
+    """sha1 nội dung file (file prompt); chỉ đọc lại khi mtime/size đổi."""
+    path = str(path)
+    sig = _stat_sig(path)
+    if sig is None:
+        return "-"
+    with _LOCK:
+        got = _FILE_HASH.get(path)
+        if got and got[0] == sig:
+            return got[1]
+    with open(path, "rb") as f:
+        h = hashlib.sha1(f.read()).hexdigest()
+    with _LOCK:
+        _FILE_HASH[path] = (sig, h)
+    return h
+
+def corpus_version(data_dir: str) -> str:
+    """
+    Fingerprint (tên, mtime, size) của data/*.json và index vector - chỉ stat, không đọc nội dung.
+    Phần index lấy đúng pipeline.index_signature() (manifest.json + ivf.json với index nhị phân), tức cùng
+    tín hiệu mà hot reload dùng để nạp lại vector store.
+    """
+    from core.pipeline import index_signature  # import muộn: pipeline import module này
+    parts = []
+    try:
+        names = sorted(n for n in os.listdir(data_dir) if n.lower().endswith(".json"))
+    except OSError:
+        names = []
+    for n in names:
+        parts.append((n, _stat_sig(os.path.join(data_dir, n))))
+    parts.append(("index", index_signature()))
+    return make_key(*parts)
+
+def _copy_hits(hits: List[Dict]) -> List[Dict]:
+    return [dict(h) for h in hits]
+
+def hits_key(question: str, titles: Sequence[str], top_k: int, data_dir: str) -> str:
+    embed = os.getenv("EMBED_MODEL", "nomic-embed-text") if os.getenv("EMBEDDINGS_ENABLED", "true").lower() == "true" else "-"
+    return make_key("hits", normalize_text(question), ",".join(titles), top_k, embed, corpus_version(data_dir))
+
+def get_hits(key: str) -> Optional[List[Dict]]:
+    hits = _HITS.get(key)
+    return _copy_hits(hits) if hits is not None else None
+
+def put_hits(key: str, hits: List[Dict]):
+    _HITS.set(key, _copy_hits(hits))
+
+def answer_key(question: str, ctx: str, model: str, prompt_path, **params) -> str:
+    ctx_hash = hashlib.sha1((ctx or "").encode("utf-8")).hexdigest()
+    extra = ",".join(f"{k}={params[k]}" for k in sorted(params))
+    return make_key("answer", normalize_text(question), ctx_hash, model, file_hash(prompt_path), extra)
+
+def get_answer(key: str) -> Optional[str]:
+    return _ANSWERS.get(key)
+
+def put_answer(key: str, answer: str):
+    if answer and answer.strip():
+        _ANSWERS.set(key, answer)
+
+def invalidate():
+    """Xoá cả hai tầng (gọi khi reload index)."""
+    _HITS.clear()
+    _ANSWERS.clear()
+    with _LOCK:
+        _FILE_HASH.clear()
+
+def stats() -> dict:
+    return {"hits": _HITS.stats(), "answers": _ANSWERS.stats()}
@@ -0,0 +1,206 @@
+"""
+BM25 (Okapi, cùng công thức với rank_bm25.BM25Okapi) trên inverted index.
+
+Khi build: tính sẵn IDF, độ dài tài liệu và trọng số BM25 của từng posting
+    w(t, d) = idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * |d| / avgdl))
+Khi query: chỉ cộng trọng số trên posting list của các term trong câu hỏi
+(theo đúng thứ tự term như BM25Okapi.get_scores) nên điểm trùng khớp bản cũ,
+rồi chọn top-k bằng heap thay vì sort toàn bộ corpus.
+"""
+import math, heapq
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+def merge_scores(a: Tuple[np.ndarray, np.ndarray], b: Tuple[np.ndarray, np.ndarray],
+                 weight: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+    """(ids, điểm) a + weight * (ids, điểm) b trên hợp các doc id (tăng dần)."""
+    if not b[0].size:
+        return a
+    ids = np.union1d(a[0], b[0])
+    acc = np.zeros(ids.shape[0], dtype=np.float64)
+    acc[np.searchsorted(ids, a[0])] += a[1]
+    acc[np.searchsorted(ids, b[0])] += weight * b[1]
+    return ids, acc
+
+class PackedPostings:
+    """
+    Posting list đóng gói: ids/weights của mọi term nối liền thành hai mảng,
+    term thứ j nằm ở [offsets[j], offsets[j+1]). Dùng khi nạp snapshot - mảng có thể
+    là memmap, `get()` trả về view nên không copy và không dựng dict lớn lúc khởi động.
+    """
+    def __init__(self, vocab: Dict[str, int], offsets: np.ndarray, ids: np.ndarray, weights: np.ndarray):
+        self.vocab, self.offsets, self.ids, self.weights = vocab, offsets, ids, weights
+
+    def get(self, term: str, default=None):
+        j = self.vocab.get(term)
+        if j is None:
+            return default
+        lo, hi = int(self.offsets[j]), int(self.offsets[j + 1])
+        return self.ids[lo:hi], self.weights[lo:hi]
+
+    def __len__(self):
+        return len(self.vocab)
+
+class InvertedBM25:
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.corpus_size = 0
+        self.avgdl = 0.0
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.idf: Dict[str, float] = {}
+        # term -> (doc ids tăng dần int32, trọng số BM25 float64), đóng gói theo PackedPostings
+        self.postings = PackedPostings({}, np.zeros(1, dtype=np.int64),
+                                       np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64))
+
+    def build(self, docs_tokens: Sequence[Sequence[str]]) -> "InvertedBM25":
+        # gom (term, doc, tf) thành mảng phẳng rồi tính trọng số một lần cho mọi posting
+        # (trước đây mỗi term một lần gọi NumPy - chậm khi vocab lớn, vd. index bigram)
+        vocab: Dict[str, int] = {}
+        t_ids: List[int] = []
+        d_ids: List[int] = []
+        tfs: List[int] = []
+        doc_len = []
+        for i, toks in enumerate(docs_tokens):
+            doc_len.append(len(toks))
+            freqs: Dict[str, int] = {}
+            for t in toks:
+                freqs[t] = freqs.get(t, 0) + 1
+            for t, f in freqs.items():
+                j = vocab.get(t)
+                if j is None:
+                    j = vocab[t] = len(vocab)
+                t_ids.append(j)
+                d_ids.append(i)
+                tfs.append(f)
+
+        self.corpus_size = len(doc_len)
+        self.doc_len = np.asarray(doc_len, dtype=np.int64)
+        self.avgdl = (sum(doc_len) / self.corpus_size) if self.corpus_size else 0.0
+        term = np.asarray(t_ids, dtype=np.int64)
+        df = np.bincount(term, minlength=len(vocab))
+        self.idf = self._calc_idf(dict(zip(vocab, df.tolist())))
+
+        # sort ổn định theo term: doc id trong mỗi posting list vẫn tăng dần
+        order = np.argsort(term, kind="stable")
+        ids = np.asarray(d_ids, dtype=np.int32)[order]
+        tf = np.asarray(tfs, dtype=np.int64)[order]
+        idf = np.fromiter(self.idf.values(), dtype=np.float64, count=len(vocab))
+        k1, b = self.k1, self.b
+        weights = idf[term[order]] * (tf * (k1 + 1) / (tf + k1 * (1 - b + b * self.doc_len[ids] / self.avgdl)))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+        self.postings = PackedPostings(vocab, offsets, ids, weights)
+        return self
+
+    def to_arrays(self) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """(vocab, mảng) để ghi snapshot - xem PackedPostings."""
+        p = self.postings
+        vocab = sorted(p.vocab, key=p.vocab.get)
+        return vocab, {"offsets": np.asarray(p.offsets), "ids": np.asarray(p.ids),
+                       "weights": np.asarray(p.weights), "doc_len": np.asarray(self.doc_len)}
+
+    @classmethod
+    def from_arrays(cls, vocab: List[str], arrays: Dict[str, np.ndarray], k1: float, b: float,
+                    epsilon: float, avgdl: float) -> "InvertedBM25":
+        """Dựng lại index từ snapshot mà không tokenize/tính lại trọng số."""
+        self = cls(k1=k1, b=b, epsilon=epsilon)
+        self.doc_len = arrays["doc_len"]
+        self.corpus_size = int(self.doc_len.shape[0])
+        self.avgdl = avgdl
+        self.postings = PackedPostings({t: j for j, t in enumerate(vocab)},
+                                       arrays["offsets"], arrays["ids"], arrays["weights"])
+        return self
+
+    def _calc_idf(self, nd: Dict[str, int]) -> Dict[str, float]:
+        # Giống BM25Okapi: idf âm (term có trong > nửa số tài liệu) được thay bằng epsilon * idf trung bình
+        idf, idf_sum, negative = {}, 0.0, []
+        for word, freq in nd.items():
+            v = math.log(self.corpus_size - freq + 0.5) - math.log(freq + 0.5)
+            idf[word] = v
+            idf_sum += v
+            if v < 0:
+                negative.append(word)
+        if idf:
+            eps = self.epsilon * (idf_sum / len(idf))
+            for word in negative:
+                idf[word] = eps
+        return idf
+
+    def _restrict(self, ids: np.ndarray, w: np.ndarray, ranges: List[Tuple[int, int]]):
+        """Cắt posting list (ids tăng dần) theo các khoảng doc id - O(log n) mỗi khoảng."""
+        cuts = [np.searchsorted(ids, r) for r in ranges]
+        cuts = [(lo, hi) for lo, hi in cuts if hi > lo]
+        if len(cuts) == 1:
+            lo, hi = cuts[0]
+            return ids[lo:hi], w[lo:hi]
+        if not cuts:
+            return ids[:0], w[:0]
+        return (np.concatenate([ids[lo:hi] for lo, hi in cuts]),
+                np.concatenate([w[lo:hi] for lo, hi in cuts]))
+
+    def score_candidates(self, query_tokens: Sequence[str],
+                         ranges: Optional[List[Tuple[int, int]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Điểm BM25 của các tài liệu chứa ít nhất một term của query.
+        `ranges`: các khoảng doc id [start, end) được phép (phân vùng theo title);
+        chỉ phần posting nằm trong các khoảng này được đọc. Trả về (doc ids tăng dần, điểm).
+        IDF/avgdl vẫn là thống kê toàn corpus nên điểm không đổi khi lọc.
+        """
+        plist = []
+        for t in query_tokens:
+            p = self.postings.get(t)
+            if p is None:
+                continue
+            if ranges is not None:
+                p = self._restrict(p[0], p[1], ranges)
+                if not p[0].size:
+                    continue
+            plist.append(p)
+        if not plist:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+        cand = np.unique(np.concatenate([ids for ids, _ in plist]))
+        acc = np.zeros(cand.shape[0], dtype=np.float64)
+        # cộng lần lượt từng term theo thứ tự query -> cùng thứ tự phép cộng với BM25Okapi
+        for ids, w in plist:
+            pos = np.searchsorted(cand, ids)
+            pos_c = np.minimum(pos, cand.shape[0] - 1)
+            hit = cand[pos_c] == ids
+            acc[pos_c[hit]] += w[hit]
+        return cand, acc
+
+    def top_k(self, query_tokens: Sequence[str], k: int,
+              ranges: Optional[List[Tuple[int, int]]] = None,
+              boost: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> List[Tuple[int, float]]:
+        """
+        Top-k (doc id, score) - cùng thứ tự với sort(get_scores) ổn định của bản cũ:
+        điểm giảm dần, hoà điểm thì doc id nhỏ trước; thiếu thì bù tài liệu điểm 0 theo thứ tự id.
+        `boost` = (doc ids, điểm) cộng thêm (vd. điểm cụm từ từ index bigram).
+        """
+        if k <= 0 or not self.corpus_size:
+            return []
+        cand, acc = self.score_candidates(query_tokens, ranges)
+        if boost is not None:
+            cand, acc = merge_scores((cand, acc), boost)
+        pos = acc > 0
+        ranked = heapq.nsmallest(k, zip((-acc[pos]).tolist(), cand[pos].tolist()))
+        out = [(int(i), -s) for s, i in ranked]
+        if len(out) < k:
+            out += self._fill_zero(cand, acc, k - len(out), ranges)
+        return out
+
+    def _fill_zero(self, cand: np.ndarray, acc: np.ndarray, need: int,
+                   ranges: Optional[List[Tuple[int, int]]]) -> List[Tuple[int, float]]:
+        nonzero = set(cand[acc != 0].tolist())
+        out = []
+        rows = (i for s, e in ranges for i in range(s, e)) if ranges is not None else range(self.corpus_size)
+        for i in rows:
+            if i not in nonzero:
+                out.append((i, 0.0))
+                if len(out) >= need:
+                    break
+        if len(out) < need:
+            # điểm âm (chỉ xảy ra khi idf trung bình âm - corpus rất nhỏ) xếp sau cùng
+            neg = sorted(((float(s), int(i)) for i, s in zip(cand.tolist(), acc.tolist()) if s < 0),
+                         key=lambda x: -x[0])
+            out += [(i, s) for s, i in neg[:need - len(out)]]
+        return out
@@ -1,119 +1,157 @@
-import os, json, re
-from typing import List, Dict, Optional
-from rank_bm25 import BM25Okapi
+import os, re, threading
+from typing import List, Dict, Optional, Tuple
+from core.eventlog import say
+from core.retrieval.bm25_index import InvertedBM25
+from core.retrieval.partitions import title_ranges, ranges_for
+from core.retrieval.bm25_snapshot import load_snapshot, save_snapshot, data_fingerprint
+from core.retrieval import corpus as corpus_mod
+from core.retrieval.corpus import Corpus, data_files, iter_file_units
 
 _TOKEN_RE = re.compile(r"[a-zA-Z0-9_À-ỹ]+")
 
+# Thuật ngữ pháp lý là cụm nhiều âm tiết ("quyền sử dụng đất"): index thêm bigram âm tiết liền kề,
+# điểm cụm từ = BM25 trên bigram (x BM25_PHRASE_WEIGHT) cộng vào điểm BM25 âm tiết
+PHRASE_ENABLED = os.getenv("BM25_PHRASE", "true").lower() == "true"
+PHRASE_WEIGHT = float(os.getenv("BM25_PHRASE_WEIGHT", "1.0"))
+
 def _tokenize(s: str) -> List[str]:
     return _TOKEN_RE.findall((s or "").lower())
 
+def _bigrams(tokens: List[str]) -> List[str]:
+    # khoảng trắng không thể có trong token nên "a b" không trùng term âm tiết nào
+    return [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
 class JsonBM25:
     def __init__(self):
-        self.docs_tokens: List[List[str]] = []
-        self.docs_meta: List[Dict] = []
-        self.bm25: Optional[BM25Okapi] = None
+        self.reparsed: List[str] = []  # file phải parse lại ở lần build gần nhất
+        # doc id BM25 = unit ID của corpus
+        self.corpus: Corpus = Corpus()
+        self.bm25: Optional[InvertedBM25] = None
+        self.phrase: Optional[InvertedBM25] = None  # index bigram (BM25_PHRASE)
+        # title -> các khoảng doc id liên tiếp (mỗi file luật được nạp liền một mạch)
+        self.partitions: Dict[str, List[tuple]] = {}
         self.total_units: int = 0
 
-    def load_dir(self, data_dir: str) -> int:
-        docs, metas = [], []
-        for name in os.listdir(data_dir):
-            if not name.lower().endswith(".json"):
-                continue
-            title = os.path.splitext(name)[0]
-            path = os.path.join(data_dir, name)
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            for art, obj in data.items():
-                heading = obj.get("tiêu_đề", "")
-
-                if isinstance(obj.get("khoản"), dict) and obj["khoản"]:
-                    for k, v in obj["khoản"].items():
-                        if isinstance(v, dict) and isinstance(v.get("điểm"), dict) and v["điểm"]:
-                            for d, text in v["điểm"].items():
-                                text = f"{heading}\n{text}".strip()
-                                if text:
-                                    docs.append(_tokenize(text))
-                                    metas.append({
-                                        "title": title,
-                                        "article": str(art),
-                                        "clause": f"{k}.{d}",
-                                        "text": text[:800],
-                                        "source": f"file://{os.path.abspath(path)}",
-                                    })
-                        else:
-                            text = f"{heading}\n{v}".strip()
-                            if text:
-                                docs.append(_tokenize(text))
-                                metas.append({
-                                    "title": title,
-                                    "article": str(art),
-                                    "clause": str(k),
-                                    "text": text,
-                                    "source": f"file://{os.path.abspath(path)}",
-                                })
-                elif isinstance(obj.get("điểm"), dict) and obj["điểm"]:
-                    for d, text in obj["điểm"].items():
-                        text = f"{heading}\n{text}".strip()
-                        if text:
-                            docs.append(_tokenize(text))
-                            metas.append({
-                                "title": title,
-                                "article": str(art),
-                                "clause": str(d),
-                                "text": text[:800],
-                                "source": f"file://{os.path.abspath(path)}",
-                            })
-                else:
-                    text = (obj.get("toàn_văn") or heading or "").strip()
-                    if text:
-                        docs.append(_tokenize(text))
-                        metas.append({
-                            "title": title,
-                            "article": str(art),
-                            "clause": None,
-                            "text": text[:800],
-                            "source": f"file://{os.path.abspath(path)}",
-                        })
-
-        self.docs_tokens, self.docs_meta = docs, metas
-        self.bm25 = BM25Okapi(self.docs_tokens) if self.docs_tokens else None
-        self.total_units = len(self.docs_meta)
+    def load_dir(self, data_dir: str, file_cache: Optional[Dict[str, tuple]] = None) -> int:
+        """Nạp snapshot nếu còn khớp dữ liệu, ngược lại build từ data/ rồi ghi snapshot mới."""
+        use_snapshot = os.getenv("BM25_SNAPSHOT", "true").lower() == "true"
+        if use_snapshot:
+            snap = load_snapshot(data_dir, phrase=PHRASE_ENABLED)
+            if snap is not None:
+                bm25, corpus, phrase = snap
+                say(f"[bm25] snapshot {len(corpus)} units" + (" (+bigram)" if phrase is not None else ""), level="info", event="bm25_snapshot_loaded")
+                return self._set(bm25, corpus, phrase if PHRASE_ENABLED else None)
+        # fingerprint lấy trước khi đọc: file đổi trong lúc build -> snapshot bị coi là cũ lần sau
+        fingerprint = data_fingerprint(data_dir) if use_snapshot else None
+        n = self.build_dir(data_dir, file_cache)
+        if use_snapshot and self.bm25 is not None:
+            try:
+                save_snapshot(self.bm25, self.corpus, data_dir, fingerprint=fingerprint, phrase=self.phrase)
+            except OSError as e:
+                say(f"[bm25] không ghi được snapshot: {e}", level="warning", event="bm25_snapshot_write_error")
+        return n
+
+    def _set(self, bm25: Optional[InvertedBM25], corpus: Corpus, phrase: Optional[InvertedBM25] = None) -> int:
+        self.corpus = corpus
+        self.bm25 = bm25
+        self.phrase = phrase
+        self.partitions = title_ranges(corpus.titles)
+        self.total_units = len(corpus)
         return self.total_units
 
-    def search(self, query: str, top_k: int = 5, allow_titles: Optional[List[str]] = None) -> List[Dict]:
+    def build_dir(self, data_dir: str, file_cache: Optional[Dict[str, tuple]] = None) -> int:
+        """
+        Đọc + tokenize data/*.json (một lượt qua corpus) và build inverted index.
+        `file_cache` (tên file -> ((size, mtime), units, tokens)): file không đổi được lấy từ cache,
+        chỉ file mới/đã sửa mới phải parse + tokenize lại. IDF/avgdl là thống kê toàn corpus nên
+        bước dựng posting vẫn chạy trên toàn bộ.
+        """
+        corpus, docs = Corpus(), []
+        self.reparsed = []
+        names = data_files(data_dir)
+        for name in names:
+            path = os.path.join(data_dir, name)
+            st = os.stat(path)
+            sig = (st.st_size, st.st_mtime_ns)
+            ent = file_cache.get(name) if file_cache is not None else None
+            if ent is None or ent[0] != sig:
+                units = list(iter_file_units(path))
+                ent = (sig, units, [_tokenize(u.text) for u in units])
+                self.reparsed.append(name)
+                if file_cache is not None:
+                    file_cache[name] = ent
+            for u in ent[1]:
+                corpus.add(u)
+            docs.extend(ent[2])
+        if file_cache is not None:
+            for name in set(file_cache) - set(names):
+                del file_cache[name]
+        if not docs:
+            return self._set(None, corpus)
+        phrase = InvertedBM25().build([_bigrams(d) for d in docs]) if PHRASE_ENABLED else None
+        return self._set(InvertedBM25().build(docs), corpus, phrase)
+
+    def search_ids(self, query: str, top_k: int = 5, allow_titles: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+        """Top-k (unit ID, điểm BM25)."""
         if not self.bm25 or not (query or "").strip():
             return []
-        qtok = _tokenize(query)
-        scores = self.bm25.get_scores(qtok)
-
-        ranked = sorted(
-            [
-                (i, float(scores[i]))
-                for i in range(len(scores))
-                if not allow_titles or self.docs_meta[i]["title"] in allow_titles
-            ],
-            key=lambda x: x[1],
-            reverse=True,
-        )[:top_k]
+        ranges = ranges_for(self.partitions, allow_titles)
+        if ranges is not None and not ranges:
+            return []
+        tokens = _tokenize(query)
+        boost = None
+        if self.phrase is not None and PHRASE_WEIGHT > 0 and len(tokens) > 1:
+            boost = self.phrase.score_candidates(_bigrams(tokens), ranges)
+            boost = (boost[0], PHRASE_WEIGHT * boost[1])
+        return self.bm25.top_k(tokens, top_k, ranges=ranges, boost=boost)
 
+    def search(self, query: str, top_k: int = 5, allow_titles: Optional[List[str]] = None) -> List[Dict]:
         out = []
-        for i, sc in ranked:
-            m = self.docs_meta[i].copy()
+        for i, sc in self.search_ids(query, top_k, allow_titles):
+            m = self.corpus.meta(i)
             m["score"] = round(sc, 4)
             out.append(m)
         return out
 
 _INDEX = JsonBM25()
+# Cache parse/tokenize theo file cho reload tăng dần (chỉ có sau lần reload đầu tiên)
+_FILE_CACHE: Dict[str, tuple] = {}
+_BUILD_LOCK = threading.Lock()
+
+def build_index(data_dir: str, incremental: bool = False) -> JsonBM25:
+    """Dựng index mới bên cạnh index đang phục vụ (chưa thay)."""
+    with _BUILD_LOCK:
+        idx = JsonBM25()
+        idx.load_dir(data_dir, _FILE_CACHE if incremental else None)
+        return idx
+
+def prime_file_cache(data_dir: str) -> int:
+    """Parse + tokenize sẵn mọi file vào cache (chạy nền) để reload đầu tiên cũng chỉ làm phần đã đổi."""
+    with _BUILD_LOCK:
+        JsonBM25().build_dir(data_dir, _FILE_CACHE)
+        return len(_FILE_CACHE)
+
+def install(idx: JsonBM25) -> int:
+    """Thay index đang phục vụ bằng một phép gán; query đang chạy vẫn dùng index cũ."""
+    global _INDEX
+    _INDEX = idx
+    corpus_mod.set_current(idx.corpus)
+    return idx.total_units
+
+def current_index() -> JsonBM25:
+    return _INDEX
 
 def load_index(data_dir: str) -> int:
-    return _INDEX.load_dir(data_dir)
+    return install(build_index(data_dir))
 
 def reload_index(data_dir: str) -> int:
-    return _INDEX.load_dir(data_dir)
+    return install(build_index(data_dir, incremental=True))
 
 def search(query: str, top_k: int = 5, allow_titles: Optional[List[str]] = None) -> List[Dict]:
     return _INDEX.search(query, top_k=top_k, allow_titles=allow_titles)
 
+def search_ids(query: str, top_k: int = 5, allow_titles: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+    return _INDEX.search_ids(query, top_k=top_k, allow_titles=allow_titles)
+
 def available_units() -> int:
     return _INDEX.total_units
@@ -0,0 +1,161 @@
+"""
+Snapshot BM25 trên đĩa - bỏ qua bước đọc JSON + tokenize + tính trọng số khi khởi động.
+
+Cấu trúc thư mục (mặc định index/bm25/):
+    manifest.json   - tham số BM25, avgdl, số unit, fingerprint từng file data
+    vocab.json      - danh sách term (term thứ j <-> offsets[j])
+    offsets.npy, ids.npy, weights.npy, doc_len.npy - posting list đóng gói (mmap khi nạp)
+    phrase_*        - (tuỳ chọn) index bigram âm tiết, cùng cấu trúc vocab + 4 mảng trên
+    corpus.json     - bảng unit của corpus (dạng cột), chỉ số = unit ID = doc id
+
+Fingerprint mỗi file data = (size, mtime, sha1). Khi nạp chỉ stat file; sha1 chỉ được
+tính lại nếu size/mtime khác (vd. file bị touch/copy lại mà nội dung không đổi).
+"""
+import os, json, hashlib
+from typing import Dict, Optional, Tuple
+import numpy as np
+from core.eventlog import say
+from core.retrieval.bm25_index import InvertedBM25
+from core.retrieval.corpus import Corpus, data_files, TEXT_CHARS
+
+MANIFEST_NAME = "manifest.json"
+FORMAT_NAME = "aura-bm25-snapshot"
+FORMAT_VERSION = 3
+_ARRAYS = ("offsets", "ids", "weights", "doc_len")
+
+def snapshot_dir() -> str:
+    return os.getenv("BM25_SNAPSHOT_DIR", "index/bm25")
+
+def _sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def data_fingerprint(data_dir: str, previous: Optional[Dict] = None) -> Dict[str, Dict]:
+    """
+    {tên file: {size, mtime, sha1}}. Nếu `previous` có cùng size/mtime thì dùng lại sha1 cũ
+    (không đọc file) - nạp snapshot khi dữ liệu không đổi chỉ tốn vài lệnh stat.
+    """
+    previous = previous or {}
+    out = {}
+    for name in data_files(data_dir):
+        path = os.path.join(data_dir, name)
+        st = os.stat(path)
+        old = previous.get(name)
+        if old and old.get("size") == st.st_size and old.get("mtime") == st.st_mtime_ns:
+            sha = old["sha1"]
+        else:
+            sha = _sha1(path)
+        out[name] = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha1": sha}
+    return out
+
+def _same_content(a: Dict[str, Dict], b: Dict[str, Dict]) -> bool:
+    return a.keys() == b.keys() and all(a[n]["sha1"] == b[n]["sha1"] for n in a)
+
+def read_manifest(out_dir: str) -> Optional[Dict]:
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            m = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if m.get("format") != FORMAT_NAME or m.get("version") != FORMAT_VERSION:
+        return None
+    return m
+
+def save_snapshot(bm25: InvertedBM25, corpus: Corpus, data_dir: str, out_dir: Optional[str] = None,
+                  fingerprint: Optional[Dict] = None, phrase: Optional[InvertedBM25] = None) -> Dict:
+    """Ghi snapshot (từng file .tmp rồi os.replace; manifest ghi cuối cùng)."""
+    out_dir = out_dir or snapshot_dir()
+    os.makedirs(out_dir, exist_ok=True)
+
+    def _replace(name, write):
+        tmp = os.path.join(out_dir, name + ".tmp")
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, os.path.join(out_dir, name))
+
+    # manifest cũ bị xoá trước để bản ghi dở dang không bao giờ được coi là hợp lệ
+    try:
+        os.remove(os.path.join(out_dir, MANIFEST_NAME))
+    except FileNotFoundError:
+        pass
+
+    def _write_index(index: InvertedBM25, prefix: str) -> int:
+        vocab, arrays = index.to_arrays()
+        for name in _ARRAYS:
+            _replace(f"{prefix}{name}.npy", lambda f, a=arrays[name]: np.save(f, a))
+        _replace(f"{prefix}vocab.json", lambda f: f.write(json.dumps(vocab, ensure_ascii=False).encode("utf-8")))
+        return len(vocab)
+
+    terms = _write_index(bm25, "")
+    phrase_meta = None
+    if phrase is not None:
+        phrase_meta = {"terms": _write_index(phrase, "phrase_"), "avgdl": phrase.avgdl}
+    _replace("corpus.json", lambda f: f.write(json.dumps(corpus.columns(), ensure_ascii=False).encode("utf-8")))
+
+    manifest = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "units": len(corpus),
+        "text_chars": TEXT_CHARS,
+        "terms": terms,
+        "k1": bm25.k1, "b": bm25.b, "epsilon": bm25.epsilon,
+        "avgdl": bm25.avgdl,
+        "phrase": phrase_meta,
+        "files": fingerprint or data_fingerprint(data_dir),
+    }
+    _replace(MANIFEST_NAME, lambda f: f.write(json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")))
+    return manifest
+
+def _read_index(out_dir: str, prefix: str, manifest: Dict, avgdl: float) -> Tuple[InvertedBM25, int]:
+    arrays = {name: np.load(os.path.join(out_dir, f"{prefix}{name}.npy"), mmap_mode="r") for name in _ARRAYS}
+    with open(os.path.join(out_dir, f"{prefix}vocab.json"), "r", encoding="utf-8") as f:
+        vocab = json.load(f)
+    index = InvertedBM25.from_arrays(vocab, arrays, manifest["k1"], manifest["b"], manifest["epsilon"], avgdl)
+    return index, len(vocab)
+
+def load_snapshot(data_dir: str, out_dir: Optional[str] = None,
+                  phrase: bool = False) -> Optional[Tuple[InvertedBM25, Corpus, Optional[InvertedBM25]]]:
+    """
+    (bm25, corpus, index bigram hoặc None) nếu snapshot còn khớp dữ liệu; None nếu chưa có/đã cũ/hỏng,
+    hoặc `phrase=True` mà snapshot không có index bigram.
+    """
+    out_dir = out_dir or snapshot_dir()
+    manifest = read_manifest(out_dir)
+    if manifest is None or manifest.get("text_chars") != TEXT_CHARS:
+        return None
+    if phrase and not manifest.get("phrase"):
+        return None
+    files = data_fingerprint(data_dir, manifest.get("files"))
+    if not _same_content(manifest.get("files", {}), files):
+        return None
+    try:
+        bm25, terms = _read_index(out_dir, "", manifest, manifest["avgdl"])
+        phrase_idx, phrase_terms = None, None
+        if phrase:
+            phrase_idx, phrase_terms = _read_index(out_dir, "phrase_", manifest, manifest["phrase"]["avgdl"])
+        with open(os.path.join(out_dir, "corpus.json"), "r", encoding="utf-8") as f:
+            corpus = Corpus(json.load(f))
+    except (OSError, ValueError) as e:
+        say(f"[bm25] snapshot hỏng ({e}) - build lại", level="warning", event="bm25_snapshot_corrupt")
+        return None
+    if len(corpus) != manifest["units"] or terms != manifest["terms"]:
+        return None
+    if phrase and phrase_terms != manifest["phrase"]["terms"]:
+        return None
+    if files != manifest["files"]:
+        # nội dung không đổi, chỉ mtime khác -> cập nhật manifest để lần sau khỏi hash lại
+        manifest["files"] = files
+        try:
+            tmp = os.path.join(out_dir, MANIFEST_NAME + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, os.path.join(out_dir, MANIFEST_NAME))
+        except OSError:
+            pass
+    return bm25, corpus, phrase_idx
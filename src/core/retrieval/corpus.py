@@ -0,0 +1,127 @@
+"""
+Corpus dùng chung cho mọi index: đọc data/*.json một lần, làm phẳng điều/khoản/điểm
+thành các unit và gán ID nguyên ổn định.
+
+ID của unit = thứ tự khi duyệt file theo tên (sắp xếp) rồi theo thứ tự điều trong file,
+nên cùng một thư mục data luôn cho cùng ID. BM25 dùng thẳng ID làm doc id; vector store
+ánh xạ hàng -> ID qua (title, article, clause). RRF, khử trùng và tra metadata vì vậy
+chỉ thao tác trên số nguyên; dict metadata chỉ được dựng cho top-k cuối cùng.
+"""
+import os, json
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# Độ dài text lưu trong metadata (hiển thị/trích dẫn/context); BM25 vẫn tokenize toàn văn
+TEXT_CHARS = int(os.getenv("UNIT_TEXT_CHARS", "800"))
+
+_FIELDS = ("title", "article", "clause", "text", "source")
+
+class Unit(NamedTuple):
+    title: str
+    article: str
+    clause: Optional[str]
+    text: str       # toàn văn (tiêu đề điều + nội dung)
+    source: str
+
+def data_files(data_dir: str) -> List[str]:
+    return sorted(n for n in os.listdir(data_dir) if n.lower().endswith(".json"))
+
+def iter_units(data_dir: str, on_warn: Optional[Callable[[str, str, str], None]] = None) -> Iterator[Unit]:
+    """
+    Duyệt mọi unit của data_dir theo thứ tự ID. `on_warn(file, article, msg)` được gọi
+    cho điều thiếu tiêu_đề hoặc không có khoản/điểm/toàn_văn.
+    """
+    for name in data_files(data_dir):
+        yield from iter_file_units(os.path.join(data_dir, name), on_warn)
+
+def iter_file_units(path: str, on_warn: Optional[Callable[[str, str, str], None]] = None) -> Iterator[Unit]:
+    """Các unit của một file luật (title = tên file bỏ đuôi)."""
+    name = os.path.basename(path)
+    title = os.path.splitext(name)[0]
+    source = f"file://{os.path.abspath(path)}"
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    for art, obj in data.items():
+        art = str(art)
+        if on_warn and "tiêu_đề" not in obj:
+            on_warn(name, art, "Thiếu tiêu_đề")
+        heading = obj.get("tiêu_đề", "")
+        if isinstance(obj.get("khoản"), dict) and obj["khoản"]:
+            for k, v in obj["khoản"].items():
+                if isinstance(v, dict) and isinstance(v.get("điểm"), dict) and v["điểm"]:
+                    for d, text in v["điểm"].items():
+                        text = f"{heading}\n{text}".strip()
+                        if text:
+                            yield Unit(title, art, f"{k}.{d}", text, source)
+                else:
+                    text = f"{heading}\n{v}".strip()
+                    if text:
+                        yield Unit(title, art, str(k), text, source)
+        elif isinstance(obj.get("điểm"), dict) and obj["điểm"]:
+            for d, text in obj["điểm"].items():
+                text = f"{heading}\n{text}".strip()
+                if text:
+                    yield Unit(title, art, str(d), text, source)
+        else:
+            if on_warn and not (isinstance(obj.get("toàn_văn"), str) and obj["toàn_văn"].strip()):
+                on_warn(name, art, "thiếu 'khoản'/'điểm'/'toàn_văn'")
+            text = (obj.get("toàn_văn") or heading or "").strip()
+            if text:
+                yield Unit(title, art, None, text, source)
+
+def unit_key(title: str, article, clause) -> Tuple[str, str, Optional[str]]:
+    return (title, str(article), None if clause is None else str(clause))
+
+class Corpus:
+    """Bảng unit dạng cột (list theo từng trường), chỉ số = unit ID."""
+    def __init__(self, columns: Optional[Dict[str, List]] = None):
+        columns = columns or {f: [] for f in _FIELDS}
+        self.titles: List[str] = columns["title"]
+        self.articles: List[str] = columns["article"]
+        self.clauses: List[Optional[str]] = columns["clause"]
+        self.texts: List[str] = columns["text"]
+        self.sources: List[str] = columns["source"]
+        self._by_key: Optional[Dict[tuple, int]] = None
+
+    def add(self, u: Unit) -> int:
+        uid = len(self.titles)
+        self.titles.append(u.title)
+        self.articles.append(u.article)
+        self.clauses.append(u.clause)
+        self.texts.append(u.text[:TEXT_CHARS])
+        self.sources.append(u.source)
+        self._by_key = None
+        return uid
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def meta(self, uid: int) -> Dict:
+        """Dict metadata (bản mới) của một unit - dạng hit mà API trả về."""
+        return {
+            "title": self.titles[uid],
+            "article": self.articles[uid],
+            "clause": self.clauses[uid],
+            "text": self.texts[uid],
+            "source": self.sources[uid],
+        }
+
+    def uid_for(self, title: str, article, clause) -> Optional[int]:
+        if self._by_key is None:
+            self._by_key = {unit_key(t, a, c): i for i, (t, a, c)
+                            in enumerate(zip(self.titles, self.articles, self.clauses))}
+        return self._by_key.get(unit_key(title, article, clause))
+
+    def columns(self) -> Dict[str, List]:
+        return {"title": self.titles, "article": self.articles, "clause": self.clauses,
+                "text": self.texts, "source": self.sources}
+
+# Corpus đang phục vụ (đặt khi nạp/reload index; dùng để tra metadata theo unit ID)
+_CURRENT = Corpus()
+
+def set_current(corpus: Corpus):
+    global _CURRENT
+    _CURRENT = corpus
+
+def current() -> Corpus:
+    return _CURRENT
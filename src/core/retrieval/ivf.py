@@ -0,0 +1,162 @@
+"""
+Index ANN dạng IVF (inverted file) viết bằng NumPy cho corpus lớn.
+
+Huấn luyện: k-means cầu (cosine) trên một mẫu các hàng -> `nlist` centroid; mỗi hàng của
+ma trận embedding được gán vào centroid gần nhất. Truy vấn: chấm điểm centroid, lấy
+`nprobe` danh sách gần nhất rồi chỉ chấm điểm chính xác các hàng trong đó.
+nprobe càng lớn recall càng cao, càng chậm (nprobe = nlist tương đương quét toàn bộ).
+
+File (cạnh vectors.f32, trong thư mục index/):
+    ivf.json              - nlist, count, dim, fingerprint file vectors
+    ivf_centroids.npy     - nlist x dim (float32, đã chuẩn hoá)
+    ivf_offsets.npy       - nlist + 1; hàng của danh sách j = ids[offsets[j]:offsets[j+1]]
+    ivf_ids.npy           - chỉ số hàng, gom theo danh sách (tăng dần trong mỗi danh sách)
+"""
+import os, json, time
+from typing import Dict, Optional, Sequence, Tuple
+import numpy as np
+from core.eventlog import say
+
+MANIFEST_NAME = "ivf.json"
+FORMAT_NAME = "aura-ivf"
+FORMAT_VERSION = 1
+_ARRAYS = ("centroids", "offsets", "ids")
+_BLOCK = 65536
+
+def default_nlist(n: int) -> int:
+    return max(1, int(round(np.sqrt(n))))
+
+def _rows_f32(matrix: np.ndarray, start: int, end: int) -> np.ndarray:
+    return np.array(matrix[start:end], dtype=np.float32)  # bản sao ghi được (memmap chỉ đọc)
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    m /= (np.linalg.norm(m, axis=1, keepdims=True) + 1e-8)
+    return m
+
+def _assign(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.argmax(x @ centroids.T, axis=1)
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    def __len__(self) -> int:
+        return self.ids.shape[0]
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, nlist: Optional[int] = None, iters: int = 10,
+              sample: Optional[int] = None, seed: int = 0, verbose: bool = False) -> "IVFIndex":
+        """K-means cầu trên mẫu `sample` hàng (mặc định 40 hàng/centroid), rồi gán toàn bộ ma trận."""
+        n = matrix.shape[0]
+        nlist = min(n, nlist or default_nlist(n))
+        rng = np.random.default_rng(seed)
+        sample = min(n, sample or max(nlist * 40, 10000))
+        t0 = time.perf_counter()
+        pick = np.sort(rng.choice(n, size=sample, replace=False))
+        x = _normalize(np.asarray(matrix[pick], dtype=np.float32))
+        centroids = x[rng.choice(sample, size=nlist, replace=False)].copy()
+
+        for it in range(iters):
+            assign = np.concatenate([_assign(x[s:s + _BLOCK], centroids) for s in range(0, sample, _BLOCK)])
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=nlist)
+            nonempty = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+            centroids[nonempty] = np.add.reduceat(x[order], starts, axis=0)
+            empty = np.flatnonzero(counts == 0)
+            if empty.size:
+                # cụm rỗng -> khởi tạo lại bằng điểm ngẫu nhiên của mẫu
+                centroids[empty] = x[rng.choice(sample, size=empty.size, replace=False)]
+            _normalize(centroids)
+            if verbose:
+                print(f"  k-means {it + 1}/{iters}: {empty.size} cụm rỗng")
+
+        assign = np.concatenate([_assign(_normalize(_rows_f32(matrix, s, s + _BLOCK)), centroids)
+                                 for s in range(0, n, _BLOCK)])
+        ids = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+        if verbose:
+            print(f"  IVF: {n} hàng, nlist={nlist}, mẫu {sample}, {time.perf_counter() - t0:.1f}s")
+        return cls(centroids.astype(np.float32), offsets, ids)
+
+    def candidates(self, q: np.ndarray, nprobe: int, min_count: int = 1,
+                   ranges: Optional[Sequence[Tuple[int, int]]] = None) -> np.ndarray:
+        """
+        Các hàng trong `nprobe` danh sách gần q nhất (đã sắp xếp tăng dần), lọc theo `ranges`
+        nếu có. Không đủ `min_count` hàng (vd. lọc title quá hẹp) -> nhân đôi nprobe.
+        """
+        cs = self.centroids @ q
+        nprobe = max(1, min(nprobe, self.nlist))
+        starts = ends = None
+        if ranges is not None:
+            starts = np.fromiter((r[0] for r in ranges), dtype=np.int64, count=len(ranges))
+            ends = np.fromiter((r[1] for r in ranges), dtype=np.int64, count=len(ranges))
+        order = np.argsort(-cs, kind="stable")
+        taken, parts, count = 0, [], 0
+        while True:
+            for j in order[taken:nprobe].tolist():
+                rows = self.ids[self.offsets[j]:self.offsets[j + 1]]
+                if starts is not None and rows.size:
+                    pos = np.searchsorted(starts, rows, side="right") - 1
+                    rows = rows[(pos >= 0) & (rows < ends[np.maximum(pos, 0)])]
+                parts.append(rows)
+                count += rows.size
+            taken = nprobe
+            if count >= min_count or nprobe >= self.nlist:
+                break
+            nprobe = min(self.nlist, nprobe * 2)
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        out = np.concatenate(parts).astype(np.int64)
+        out.sort()  # đọc memmap theo thứ tự tăng dần
+        return out
+
+    def save(self, out_dir: str, vectors_path: str) -> Dict:
+        os.makedirs(out_dir, exist_ok=True)
+        for name in _ARRAYS:
+            tmp = os.path.join(out_dir, f"ivf_{name}.npy.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, getattr(self, name))
+            os.replace(tmp, os.path.join(out_dir, f"ivf_{name}.npy"))
+        manifest = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "nlist": self.nlist,
+            "count": len(self),
+            "dim": int(self.centroids.shape[1]),
+            "vectors": _file_info(vectors_path),
+        }
+        tmp = os.path.join(out_dir, MANIFEST_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, os.path.join(out_dir, MANIFEST_NAME))
+        return manifest
+
+def _file_info(path: str) -> Dict:
+    st = os.stat(path)
+    return {"path": os.path.basename(path), "size": st.st_size, "mtime": st.st_mtime_ns}
+
+def load_ivf(index_dir: str, vectors_path: str, count: int) -> Optional[IVFIndex]:
+    """IVF đi kèm `vectors_path` nếu có và còn khớp (cùng số hàng, file vectors không đổi)."""
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            man = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if man.get("format") != FORMAT_NAME or man.get("version") != FORMAT_VERSION:
+        return None
+    if man.get("count") != count or man.get("vectors") != _file_info(vectors_path):
+        say(f"[vector] IVF cũ hơn {os.path.basename(vectors_path)} - bỏ qua (build lại bằng --ann ivf)", level="warning", event="ivf_stale")
+        return None
+    arrays = {name: np.load(os.path.join(index_dir, f"ivf_{name}.npy"), mmap_mode="r") for name in _ARRAYS}
+    return IVFIndex(np.ascontiguousarray(arrays["centroids"]), arrays["offsets"], arrays["ids"])
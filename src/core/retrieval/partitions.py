@@ -0,0 +1,27 @@
+"""
+Phân vùng index theo title (luật): các unit của cùng một title nằm liền nhau
+nên có thể mô tả bằng các khoảng hàng [start, end). Lọc allow_titles trở thành
+cắt khoảng trước khi chấm điểm thay vì chấm toàn corpus rồi lọc sau.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+Range = Tuple[int, int]
+
+def title_ranges(titles: Sequence[str]) -> Dict[str, List[Range]]:
+    """Gom các đoạn liên tiếp cùng title. Index build từng file một nên thường mỗi title chỉ có một đoạn."""
+    out: Dict[str, List[Range]] = {}
+    start = 0
+    for i in range(1, len(titles) + 1):
+        if i == len(titles) or titles[i] != titles[start]:
+            out.setdefault(titles[start], []).append((start, i))
+            start = i
+    return out
+
+def ranges_for(partitions: Dict[str, List[Range]], allow_titles: Optional[Sequence[str]]) -> Optional[List[Range]]:
+    """Các khoảng hàng (đã sắp xếp) của những title được phép; None = không lọc."""
+    if not allow_titles:
+        return None
+    rs: List[Range] = []
+    for t in dict.fromkeys(allow_titles):
+        rs.extend(partitions.get(t, ()))
+    return sorted(rs)
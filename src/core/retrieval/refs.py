@@ -0,0 +1,181 @@
+"""
+Tra cứu trực tiếp theo trích dẫn điều/khoản/điểm ("Điều 20 khoản 2 luật đất đai").
+
+- `parse_refs(question, titles)`: parser biểu thức trích dẫn tiếng Việt, hỗ trợ cả hai thứ tự
+  ("Điều 20 khoản 2 điểm a" / "điểm a khoản 2 Điều 20"), khoảng ("Điều 3 đến Điều 5", "khoản 1-3")
+  và danh sách ("khoản 1, 2 và 3"). Title chỉ lấy từ tên luật nêu rõ ("luật/bộ luật <tên file data>", bỏ dấu,
+  "_" -> khoảng trắng): ngay sau trích dẫn, hoặc ở bất kỳ đâu trong câu; `default_titles` (đoán của router)
+  chỉ dùng khi câu hỏi không nêu văn bản nào. Trích dẫn văn bản ngoài corpus ("Nghị định 100/2019",
+  "Hiến pháp", luật không có trong data) -> không tra cả câu.
+- `RefIndex`: dict (title, article, clause, point) -> unit ID dựng một lần khi nạp index; khoá
+  thiếu clause/point trỏ tới mọi unit bên dưới (cả điều / cả khoản), nên mỗi trích dẫn là một lần tra dict.
+Không phân giải được (không có tên luật, điều không tồn tại...) -> trả về rỗng, pipeline dùng retrieval thường.
+"""
+import os, re, unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+REF_MAX_UNITS = int(os.getenv("REF_MAX_UNITS", "20"))  # trần số unit trả về cho một câu hỏi
+_MAX_SPAN = 50  # khoảng "Điều 1 đến Điều 9999" chỉ mở rộng tối đa chừng này phần tử
+
+# thứ tự chữ cái đánh điểm trong văn bản luật (không có f, j, w, z; có đ)
+_POINT_ORDER = "abcdđeghiklmnopqrstuvxy"
+
+_SEP = r"\s*(?:,|;|và|hoặc|-|–|đến|tới)\s*"
+_ART = r"\d+[a-zđ]?(?![\wÀ-ỹ])"
+_NUM = r"\d+(?![\wÀ-ỹ])"
+_PT = r"[a-zđ](?![\wÀ-ỹ])"
+
+def _list(kw: str, item: str) -> str:
+    return rf"{kw}\s+({item}(?:{_SEP}(?:{kw}\s+)?{item})*)"
+
+_REF_RE = re.compile(
+    rf"(?:{_list('điểm', _PT)}\s*,?\s*)?"
+    rf"(?:{_list('khoản', _NUM)}\s*,?\s*(?:của\s+)?)?"
+    rf"{_list('điều', _ART)}"
+    rf"(?:\s*,?\s*{_list('khoản', _NUM)})?"
+    rf"(?:\s*,?\s*{_list('điểm', _PT)})?",
+    re.I,
+)
+_ITEM_RE = re.compile(rf"(?<![\wÀ-ỹ])({_ART}|{_PT})|(-|–|đến|tới)", re.I)
+
+# trên chuỗi đã bỏ dấu: tên văn bản, và phần nối giữa trích dẫn với tên văn bản ("Điều 8 của Luật ...")
+_DOC_RE = re.compile(r"(?<!phap )\b(?:bo\s+)?(?:luat|nghi\s+dinh|thong\s+tu|hien\s+phap|quyet\s+dinh|nghi\s+quyet"
+                     r"|phap\s+lenh|chi\s+thi)\b")
+_LEAD_RE = re.compile(r"[\s,.:;()\"'-]*(?:(?:cua|thuoc|trong|theo|tai)\s+)?")
+
+class Ref(NamedTuple):
+    title: str
+    article: str
+    clause: Optional[str]
+    point: Optional[str]
+
+def _fold(s: str) -> str:
+    """Bỏ dấu, giữ nguyên độ dài chuỗi (vị trí ký tự khớp với chuỗi gốc)."""
+    return "".join("d" if c in "đĐ" else unicodedata.normalize("NFD", c)[0] for c in s.lower())
+
+def _expand(raw: Optional[str], points: bool = False) -> List[str]:
+    """'1, 2 và 5-7' -> ['1', '2', '5', '6', '7'] (khoảng chỉ mở rộng khi hai đầu là số/chữ điểm)."""
+    if not raw:
+        return []
+    out: List[str] = []
+    pending = False
+    for m in _ITEM_RE.finditer(raw.lower()):
+        if m.group(2):
+            pending = bool(out)
+            continue
+        item = m.group(1)
+        if pending:
+            pending = False
+            lo, hi = out[-1], item
+            if points and lo in _POINT_ORDER and hi in _POINT_ORDER:
+                span = list(_POINT_ORDER[_POINT_ORDER.index(lo) + 1:_POINT_ORDER.index(hi) + 1])
+            elif lo.isdigit() and hi.isdigit() and int(lo) < int(hi):
+                span = [str(i) for i in range(int(lo) + 1, min(int(hi), int(lo) + _MAX_SPAN) + 1)]
+            else:
+                span = [hi]
+            out.extend(span)
+        else:
+            out.append(item)
+    return list(dict.fromkeys(out))
+
+def _title_patterns(titles: Iterable[str]) -> List[Tuple[re.Pattern, str]]:
+    # "luật/bộ luật [về] <tên>"; tên dài khớp trước ("giao thong duong bo" trước "giao thong" nếu có cả hai)
+    return [(re.compile(rf"\b(?:bo\s+)?luat\s+(?:ve\s+)?{re.escape(t.replace('_', ' '))}\b"), t)
+            for t in sorted(titles, key=len, reverse=True)]
+
+def _title_in(folded: str, patterns) -> Optional[str]:
+    for rg, title in patterns:
+        if rg.search(folded):
+            return title
+    return None
+
+def _title_at(folded: str, pos: int, patterns) -> Optional[str]:
+    for rg, title in patterns:
+        if rg.match(folded, pos):
+            return title
+    return None
+
+def parse_refs(question: str, titles: Iterable[str], default_titles: Sequence[str] = ()) -> List[Ref]:
+    """
+    Các trích dẫn trong câu hỏi. Title của mỗi trích dẫn: "luật <tên>" ngay sau nó, rồi "luật <tên>" bất kỳ
+    trong câu, rồi `default_titles` nếu chỉ có đúng một và câu không nêu văn bản nào. Không xác định được -> bỏ qua;
+    câu nêu văn bản ngoài corpus mà trích dẫn không gắn rõ với một luật trong corpus -> [] (retrieval thường).
+    """
+    return _parse(question, _title_patterns(titles), default_titles)
+
+def _parse(question: str, patterns, default_titles: Sequence[str]) -> List[Ref]:
+    q = unicodedata.normalize("NFC", question or "")
+    matches = list(_REF_RE.finditer(q))
+    if not matches:
+        return []
+    folded = _fold(q)
+    docs = [d.start() for d in _DOC_RE.finditer(folded)]
+    # văn bản không có trong corpus (nghị định, hiến pháp, luật khác...): tên luật ở chỗ khác trong câu
+    # không đủ tin cậy để gán cho trích dẫn
+    foreign = any(_title_at(folded, p, patterns) is None for p in docs)
+    whole = None if foreign else _title_in(folded, patterns)
+    if whole is None and not docs and len(default_titles) == 1:
+        whole = default_titles[0]
+    out: List[Ref] = []
+    for m in matches:
+        lead = _LEAD_RE.match(folded, m.end()).end()
+        title = _title_at(folded, lead, patterns)
+        if title is None:
+            if foreign:
+                return []
+            title = whole
+        if title is None:
+            continue
+        pre_pt, pre_cl, arts, post_cl, post_pt = m.groups()
+        clauses = _expand(pre_cl or post_cl) or [None]
+        points = _expand(pre_pt or post_pt, points=True) or [None]
+        for art in _expand(arts):
+            for cl in clauses:
+                for pt in points:
+                    out.append(Ref(title, art, cl, pt))
+    return list(dict.fromkeys(out))
+
+def _split_clause(clause: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    # corpus: "k" (khoản), "k.d" (điểm của khoản), "d" (điểm trực tiếp dưới điều), None (cả điều)
+    if clause is None:
+        return None, None
+    if "." in clause:
+        k, d = clause.split(".", 1)
+        return k, d
+    return (clause, None) if clause.isdigit() else (None, clause)
+
+class RefIndex:
+    """(title, article, clause, point) -> [unit ID]; dựng một lần cho mỗi phiên bản corpus."""
+    def __init__(self, corpus):
+        by_key: Dict[tuple, List[int]] = {}
+        for uid, (t, a, c) in enumerate(zip(corpus.titles, corpus.articles, corpus.clauses)):
+            k, d = _split_clause(c)
+            a = str(a).lower()
+            keys = {(t, a, None, None), (t, a, k, None), (t, a, k, d)}
+            if k is not None and d is not None:
+                keys.add((t, a, None, d))  # "điểm a Điều 20" không nêu khoản
+            for key in keys:
+                by_key.setdefault(key, []).append(uid)
+        self._by_key = by_key
+        self.titles = sorted(set(corpus.titles))
+        self._patterns = _title_patterns(self.titles)
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def lookup(self, refs: Sequence[Ref], limit: int = REF_MAX_UNITS) -> List[int]:
+        """Unit ID theo thứ tự trích dẫn (không trùng, tối đa `limit`); điều/khoản không tồn tại bị bỏ qua."""
+        out: Dict[int, None] = {}
+        for r in refs:
+            key = (r.title, r.article.lower(), r.clause, r.point)
+            if key not in self._by_key and r.point is not None:
+                # data không tách điểm (điểm nằm trong text của khoản) -> trả về khoản chứa nó
+                key = key[:3] + (None,)
+            for uid in self._by_key.get(key, ()):
+                out[uid] = None
+                if len(out) >= limit:
+                    return list(out)
+        return list(out)
+
+    def resolve(self, question: str, default_titles: Sequence[str] = (), limit: int = REF_MAX_UNITS) -> List[int]:
+        return self.lookup(_parse(question, self._patterns, default_titles), limit)
@@ -0,0 +1,187 @@
+"""
+Định dạng vector index nhị phân (memory-mapped).
+
+Cấu trúc thư mục index/:
+    manifest.json   - dim, count, dtype, model, tên file, thông tin file nguồn
+    vectors.f32     - khối embedding thô (count x dim, row-major, đã chuẩn hoá L2)
+                      (vectors.f16 nếu dtype=float16, vectors.i8 nếu dtype=int8)
+    scales.f32      - (int8) hệ số mỗi hàng: vector ~= vectors.i8[i] * scales[i]
+    rescore.f32     - (float16/int8, tuỳ chọn) bản float32 đầy đủ để chấm lại vài ứng viên cuối
+    meta.jsonl      - metadata từng unit (title/article/clause/text/source), cùng thứ tự hàng
+
+Loader dùng np.memmap nên khởi động gần như tức thời và page cache của OS
+được chia sẻ giữa các process cùng đọc một index.
+"""
+import os, json
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from core.eventlog import say
+
+MANIFEST_NAME = "manifest.json"
+META_NAME = "meta.jsonl"
+FORMAT_NAME = "aura-vector-bin"
+FORMAT_VERSION = 1
+_DTYPES = {"float32": ("f32", np.float32), "float16": ("f16", np.float16), "int8": ("i8", np.int8)}
+SCALES_NAME = "scales.f32"
+RESCORE_NAME = "rescore.f32"
+
+def _source_info(path: str) -> Optional[Dict]:
+    if not path or not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return {"path": os.path.basename(path), "size": st.st_size, "mtime": int(st.st_mtime)}
+
+def quantize_int8(v: np.ndarray) -> Tuple[np.ndarray, np.float32]:
+    """Lượng tử đối xứng theo từng vector: v ~= q * scale, q trong [-127, 127]."""
+    scale = np.float32(max(float(np.abs(v).max()), 1e-12) / 127.0)
+    return np.clip(np.rint(v / scale), -127, 127).astype(np.int8), scale
+
+def quantize_rows_int8(m: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """quantize_int8() cho cả ma trận (mỗi hàng một scale)."""
+    scales = (np.maximum(np.abs(m).max(axis=1), 1e-12) / 127.0).astype(np.float32)
+    return np.clip(np.rint(m / scales[:, None]), -127, 127).astype(np.int8), scales
+
+def convert_jsonl(index_path: str, out_dir: Optional[str] = None, dtype: str = "float32",
+                  model: Optional[str] = None, rescore: Optional[bool] = None) -> Dict:
+    """
+    Chuyển index.jsonl (embedding dạng list float) sang định dạng nhị phân.
+    Đọc từng dòng và ghi thẳng ra file nên bộ nhớ không phụ thuộc kích thước index.
+    `rescore` (mặc định: bật khi dtype khác float32) ghi thêm rescore.f32 để chấm lại chính xác.
+    """
+    if dtype not in _DTYPES:
+        raise ValueError(f"dtype không hỗ trợ: {dtype} (chọn {', '.join(_DTYPES)})")
+    ext, np_dtype = _DTYPES[dtype]
+    out_dir = out_dir or os.path.dirname(os.path.abspath(index_path))
+    os.makedirs(out_dir, exist_ok=True)
+
+    if rescore is None:
+        rescore = dtype != "float32"
+    rescore = rescore and dtype != "float32"
+
+    vec_name = f"vectors.{ext}"
+    vec_tmp = os.path.join(out_dir, vec_name + ".tmp")
+    meta_tmp = os.path.join(out_dir, META_NAME + ".tmp")
+    extra = ([SCALES_NAME] if dtype == "int8" else []) + ([RESCORE_NAME] if rescore else [])
+    extra_f = {name: open(os.path.join(out_dir, name + ".tmp"), "wb") for name in extra}
+
+    dim, count = 0, 0
+    with open(index_path, "r", encoding="utf-8") as fin, \
+         open(vec_tmp, "wb") as fvec, \
+         open(meta_tmp, "w", encoding="utf-8") as fmeta:
+        for line in fin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError:
+                # dòng cuối bị cắt dở (build bị ngắt) -> bỏ qua
+                continue
+            emb = obj.pop("embedding", None)
+            if not isinstance(emb, list) or not emb or not isinstance(emb[0], (int, float)):
+                continue
+            if not dim:
+                dim = len(emb)
+            elif len(emb) != dim:
+                raise RuntimeError(f"Embedding lệch chiều ở dòng {count + 1}: {len(emb)} != {dim}")
+            v = np.asarray(emb, dtype=np.float32)
+            v /= (np.linalg.norm(v) + 1e-8)
+            if dtype == "int8":
+                q, scale = quantize_int8(v)
+                fvec.write(q.tobytes())
+                extra_f[SCALES_NAME].write(scale.tobytes())
+            else:
+                fvec.write(v.astype(np_dtype).tobytes())
+            if rescore:
+                extra_f[RESCORE_NAME].write(v.tobytes())
+            fmeta.write(json.dumps(obj, ensure_ascii=False) + "\n")
+            count += 1
+
+    manifest = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "dim": dim,
+        "count": count,
+        "dtype": dtype,
+        "normalized": True,
+        "model": model or os.getenv("EMBED_MODEL", "nomic-embed-text"),
+        "vectors": vec_name,
+        "scales": SCALES_NAME if dtype == "int8" else None,
+        "rescore": RESCORE_NAME if rescore else None,
+        "meta": META_NAME,
+        "source": _source_info(index_path),
+    }
+    for name, f in extra_f.items():
+        f.close()
+        os.replace(os.path.join(out_dir, name + ".tmp"), os.path.join(out_dir, name))
+    if not rescore and os.path.exists(os.path.join(out_dir, RESCORE_NAME)):
+        os.remove(os.path.join(out_dir, RESCORE_NAME))
+    os.replace(vec_tmp, os.path.join(out_dir, vec_name))
+    os.replace(meta_tmp, os.path.join(out_dir, META_NAME))
+    man_tmp = os.path.join(out_dir, MANIFEST_NAME + ".tmp")
+    with open(man_tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(man_tmp, os.path.join(out_dir, MANIFEST_NAME))
+    return manifest
+
+def read_manifest(index_dir: str) -> Optional[Dict]:
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        man = json.load(f)
+    if man.get("format") != FORMAT_NAME:
+        return None
+    return man
+
+def find_binary_index(index_path: str) -> Optional[str]:
+    """
+    Trả về thư mục chứa index nhị phân dùng được cho `index_path`
+    (file index.jsonl hoặc chính thư mục index), None nếu không có.
+    index.jsonl khác bản đã chuyển đổi (thường là đang được build lại) không làm mất index nhị phân:
+    vẫn dùng bản nhị phân (hoàn chỉnh) thay vì đọc JSONL có thể đang ghi dở.
+    """
+    index_dir = index_path if os.path.isdir(index_path) else os.path.dirname(os.path.abspath(index_path))
+    man = read_manifest(index_dir)
+    if not man:
+        return None
+    src = man.get("source") or {}
+    jsonl = os.path.join(index_dir, src.get("path") or "index.jsonl")
+    cur = _source_info(jsonl)
+    if cur and src and cur["size"] != src.get("size"):
+        say(f"[vector] {jsonl} khác bản đã chuyển sang nhị phân (đang build lại?) - vẫn dùng binary index",
+            level="warning", event="vector_bin_stale")
+    return index_dir
+
+def open_binary_index(index_dir: str) -> Tuple[np.ndarray, List[Dict], Dict]:
+    """Memory-map khối embedding và đọc metadata sidecar."""
+    man = read_manifest(index_dir)
+    if not man:
+        raise FileNotFoundError(f"Không có {MANIFEST_NAME} hợp lệ trong {index_dir}")
+    np_dtype = _DTYPES[man["dtype"]][1]
+    count, dim = int(man["count"]), int(man["dim"])
+    vec_path = os.path.join(index_dir, man["vectors"])
+    if count and dim:
+        matrix = np.memmap(vec_path, dtype=np_dtype, mode="r", shape=(count, dim))
+    else:
+        matrix = np.zeros((0, 0), dtype=np_dtype)
+
+    metas: List[Dict] = []
+    with open(os.path.join(index_dir, man["meta"]), "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                metas.append(json.loads(line))
+    if len(metas) != count:
+        raise RuntimeError(f"meta.jsonl có {len(metas)} dòng, manifest ghi {count}")
+    return matrix, metas, man
+
+def open_rescore(index_dir: str, man: Dict) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """(scales, ma trận float32 để chấm lại) theo manifest; None nếu index không có."""
+    count, dim = int(man["count"]), int(man["dim"])
+    scales = full = None
+    if man.get("scales") and count:
+        scales = np.fromfile(os.path.join(index_dir, man["scales"]), dtype=np.float32, count=count)
+    if man.get("rescore") and count and dim:
+        full = np.memmap(os.path.join(index_dir, man["rescore"]), dtype=np.float32, mode="r", shape=(count, dim))
+    return scales, full
@@ -1,42 +1,398 @@
-import os, json, math
-from typing import List, Dict, Optional
-from core.llm_client import embed_ollama
+import os, json
+from typing import List, Dict, Optional, Sequence, Tuple
+import numpy as np
+from core.eventlog import say
+from core.llm_client import embed_ollama, aembed_ollama
+from core.cache import LRUCache, normalize_text, make_key
+from core.retrieval.vector_bin import find_binary_index, open_binary_index, open_rescore
+from core.retrieval.ivf import IVFIndex, load_ivf
+from core.retrieval.partitions import title_ranges, ranges_for
+from core.retrieval import corpus as corpus_mod
+from core.retrieval.corpus import Corpus
 
-_STORE: List[Dict] = []
+# số hàng mỗi khối khi upcast float16/int8 -> float32 (khối nhỏ nằm gọn trong cache CPU)
+_SCORE_BLOCK = 2048
+# ANN (IVF): chỉ dùng khi có index IVF đi kèm và số hàng cần quét >= ANN_MIN_ROWS (ít hơn thì quét chính xác)
+ANN_ENABLED  = os.getenv("VECTOR_ANN", "true").lower() == "true"
+ANN_NPROBE   = int(os.getenv("VECTOR_NPROBE", "16"))
+ANN_MIN_ROWS = int(os.getenv("VECTOR_ANN_MIN_ROWS", "50000"))
+# Ma trận lượng tử (float16/int8) có bản float32 đi kèm: lấy top (k x hệ số) rồi chấm lại chính xác
+RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
 
-def load_vector_store(index_path: str = "index/index.jsonl") -> int:
+class VectorStore:
+    """
+    Ma trận embedding (N x D, đã chuẩn hoá L2) + metadata song song theo hàng.
+    Với index nhị phân, `matrix` là np.memmap chỉ đọc (float32, float16 hoặc int8 + `scales`);
+    `full` (nếu có) là bản float32 trên đĩa, chỉ đọc các hàng ứng viên khi chấm lại.
+    Không sửa sau khi dựng: reload tạo store mới rồi thay tham chiếu, query đang chạy
+    vẫn đọc store cũ đến hết.
+    """
+    def __init__(self, matrix: np.ndarray, metas: List[Dict], ann: Optional[IVFIndex] = None,
+                 scales: Optional[np.ndarray] = None, full: Optional[np.ndarray] = None):
+        self.matrix = matrix
+        self.meta = metas
+        self.ann = ann
+        self.scales = scales
+        self.full = full
+        self.partitions: Dict[str, List[tuple]] = title_ranges([it.get("title") for it in metas])
+        # (corpus, hàng -> unit ID) của lần ánh xạ gần nhất, xem uids_for()
+        self._uids: Tuple[Optional[Corpus], np.ndarray] = (None, np.zeros(0, dtype=np.int32))
+        self._orphans: Tuple[Optional[np.ndarray], int] = (None, 0)  # (ánh xạ uids, số hàng -1), xem _orphan_count()
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    def map_uids(self, corpus: Corpus) -> np.ndarray:
+        """hàng -> unit ID trong `corpus` (-1: unit không còn trong data/, vd. index cũ)."""
+        uids = np.full(len(self.meta), -1, dtype=np.int32)
+        for i, it in enumerate(self.meta):
+            u = corpus.uid_for(it["title"], it["article"], it.get("clause"))
+            if u is not None:
+                uids[i] = u
+        missing = int((uids < 0).sum())
+        if missing:
+            say(f"[vector] {missing}/{len(self.meta)} hàng không còn trong corpus (index cũ?) - bị bỏ qua khi tìm kiếm", level="warning", event="vector_orphan_rows")
+        return uids
+
+    def uids_for(self, corpus: Corpus) -> np.ndarray:
+        cached_corpus, uids = self._uids
+        if cached_corpus is not corpus:
+            uids = self.map_uids(corpus)
+            self._uids = (corpus, uids)
+        return uids
+
+    def _orphan_count(self, uids: np.ndarray) -> int:
+        """Số hàng -1 trong `uids` (cache theo đúng mảng ánh xạ, mảng đó không bị sửa sau khi dựng)."""
+        cached, n = self._orphans
+        if cached is not uids:
+            n = int(np.count_nonzero(uids < 0))
+            self._orphans = (uids, n)
+        return n
+
+    def nbytes(self) -> Dict[str, int]:
+        """Dung lượng ma trận quét (luôn được đọc) và bản chấm lại (chỉ đọc vài hàng mỗi câu hỏi)."""
+        scan = self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        return {"scan": int(scan), "rescore": int(self.full.nbytes) if self.full is not None else 0}
+
+    def _scores(self, rows, q: np.ndarray) -> np.ndarray:
+        """Cosine của q với self.matrix[rows] (rows = slice hoặc mảng chỉ số)."""
+        return _matvec(self.matrix[rows], q, None if self.scales is None else self.scales[rows])
+
+    def search_rows(self, qv, top_k: int, allow_titles: Optional[List[str]] = None,
+                    nprobe: Optional[int] = None, exact: bool = False,
+                    rescore: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k (chỉ số hàng, cosine) trên ma trận. Có IVF và phạm vi cần quét đủ lớn thì chỉ chấm
+        điểm các hàng trong `nprobe` cụm gần nhất (xấp xỉ); `exact=True` luôn quét chính xác.
+        Ma trận lượng tử có bản float32 -> lấy top (k x RESCORE_FACTOR) rồi chấm lại bằng float32.
+        """
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if not self.meta:
+            return empty
+        q = np.asarray(qv, dtype=np.float32)
+        q = q / (np.linalg.norm(q) + 1e-8)
+        if not (rescore and self.full is not None):
+            return self._coarse(q, top_k, allow_titles, nprobe, exact)
+        rows, _ = self._coarse(q, top_k * max(1, RESCORE_FACTOR), allow_titles, nprobe, exact)
+        order = np.argsort(rows)  # đọc memmap theo thứ tự tăng dần
+        rows = rows[order]
+        sc = self.full[rows] @ q
+        sel = _topk_indices(sc, top_k)
+        return rows[sel], sc[sel]
+
+    def _coarse(self, q: np.ndarray, top_k: int, allow_titles: Optional[List[str]],
+                nprobe: Optional[int], exact: bool) -> Tuple[np.ndarray, np.ndarray]:
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        ranges = ranges_for(self.partitions, allow_titles)
+        if ranges is not None and not ranges:
+            return empty
+        if self.ann is not None and ANN_ENABLED and not exact:
+            scope = len(self.meta) if ranges is None else sum(e - s for s, e in ranges)
+            if scope >= ANN_MIN_ROWS:
+                # lọc title giữ lại khoảng scope/N số hàng mỗi cụm -> dò nhiều cụm hơn theo tỉ lệ đó
+                nprobe = -(-(nprobe or ANN_NPROBE) * len(self.meta) // max(scope, 1))
+                rows = self.ann.candidates(q, nprobe, min_count=top_k, ranges=ranges)
+                sc = self._scores(rows, q)
+                sel = _topk_indices(sc, top_k)
+                return rows[sel], sc[sel]
+        if ranges is None:
+            scores = self._scores(slice(None), q)
+            picked = _topk_indices(scores, top_k)
+            return picked, scores[picked]
+        # chỉ chấm điểm các khoảng hàng của title được phép (slice = view, không copy ma trận)
+        cand_idx, cand_sc = [], []
+        for start, end in ranges:
+            sc = self._scores(slice(start, end), q)
+            sel = _topk_indices(sc, top_k)
+            cand_idx.append(sel + start)
+            cand_sc.append(sc[sel])
+        idx, sc = np.concatenate(cand_idx), np.concatenate(cand_sc)
+        sel = _topk_indices(sc, top_k)
+        return idx[sel], sc[sel]
+
+    def search_rows_batch(self, qvs, top_k: int, allow_list: Sequence[Optional[List[str]]]
+                          ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        search_rows() cho nhiều câu hỏi. Các câu cùng phạm vi title được chấm điểm chung: mỗi khối hàng
+        nhân với cả ma trận câu hỏi (khối x B) nên ma trận chỉ được quét một lần cho cả nhóm.
+        Nhóm đi qua IVF (phạm vi >= ANN_MIN_ROWS) thì mỗi câu dò cụm riêng như search_rows().
+        """
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        out: List[Tuple[np.ndarray, np.ndarray]] = [empty] * len(allow_list)
+        if not self.meta or not len(allow_list):
+            return out
+        Q = np.asarray(qvs, dtype=np.float32)
+        Q = Q / (np.linalg.norm(Q, axis=1, keepdims=True) + 1e-8)
+        groups: Dict[Optional[tuple], List[int]] = {}
+        for i, allow in enumerate(allow_list):
+            groups.setdefault(tuple(allow) if allow else None, []).append(i)
+        rescore = self.full is not None
+        k = top_k * max(1, RESCORE_FACTOR) if rescore else top_k
+        for key, idx in groups.items():
+            allow = list(key) if key else None
+            ranges = ranges_for(self.partitions, allow)
+            if ranges is not None and not ranges:
+                continue
+            scope = len(self.meta) if ranges is None else sum(e - s for s, e in ranges)
+            if self.ann is not None and ANN_ENABLED and scope >= ANN_MIN_ROWS:
+                for i in idx:
+                    out[i] = self.search_rows(Q[i], top_k, allow)
+                continue
+            rows, scores = self._coarse_batch(Q[idx], k, [(0, len(self.meta))] if ranges is None else ranges)
+            for j, i in enumerate(idx):
+                sel = _topk_indices(scores[:, j], k)
+                r, sc = rows[sel, j], scores[sel, j]
+                if rescore:
+                    r = np.sort(r)  # đọc memmap theo thứ tự tăng dần
+                    sc = self.full[r] @ Q[i]
+                    sel = _topk_indices(sc, top_k)
+                    r, sc = r[sel], sc[sel]
+                out[i] = (r, sc)
+        return out
+
+    def _coarse_batch(self, Q: np.ndarray, k: int, ranges: List[tuple]) -> Tuple[np.ndarray, np.ndarray]:
+        """Ứng viên top-k theo từng cột của matrix[ranges] @ Q.T: (chỉ số hàng, điểm), cùng shape (M x B)."""
+        cand_idx, cand_sc = [], []
+        for start, end in ranges:
+            for s in range(start, end, _SCORE_BLOCK):
+                e = min(end, s + _SCORE_BLOCK)
+                S = _matmat(self.matrix[s:e], Q, None if self.scales is None else self.scales[s:e])
+                kk = min(k, e - s)
+                part = np.argpartition(-S, kk - 1, axis=0)[:kk] if kk < e - s else \
+                    np.broadcast_to(np.arange(e - s)[:, None], S.shape)
+                cand_idx.append(part + s)
+                cand_sc.append(np.take_along_axis(S, part, axis=0))
+        return np.concatenate(cand_idx, axis=0), np.concatenate(cand_sc, axis=0)
+
+    def search_ids_batch(self, qvs, top_k: int, allow_list: Sequence[Optional[List[str]]],
+                         uids: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """search_ids() cho nhiều câu hỏi (xem search_rows_batch)."""
+        if not self.meta:
+            return [[] for _ in allow_list]
+        if uids is None:
+            uids = self.uids_for(corpus_mod.current())
+        fetch = top_k + self._orphan_count(uids)
+        return [[(u, s) for u, s in zip(uids[r].tolist(), sc.tolist()) if u >= 0][:top_k]
+                for r, sc in self.search_rows_batch(qvs, fetch, allow_list)]
+
+    def search_ids(self, qv, top_k: int, allow_titles: Optional[List[str]] = None,
+                   uids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Top-k (unit ID, cosine); `uids` = ánh xạ hàng -> ID (mặc định theo corpus hiện tại).
+        Hàng mồ côi (-1) bị bỏ: lấy dư đúng số hàng đó (cả đường IVF/chấm lại) rồi cắt về top_k,
+        nên vẫn đủ k kết quả khi index cũ còn hàng không có trong corpus.
+        """
+        if not self.meta:
+            return []
+        if uids is None:
+            uids = self.uids_for(corpus_mod.current())
+        picked, picked_scores = self.search_rows(qv, top_k + self._orphan_count(uids), allow_titles)
+        return [(u, s) for u, s in zip(uids[picked].tolist(), picked_scores.tolist()) if u >= 0][:top_k]
+
+_STORE = VectorStore(np.zeros((0, 0), dtype=np.float32), [])
+
+# Cache embedding của câu hỏi: khoá = câu hỏi đã chuẩn hoá + model embedding
+_QCACHE = LRUCache(
+    maxsize=int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("QUERY_EMBED_CACHE_TTL", "86400")),
+    path=os.getenv("QUERY_EMBED_CACHE_PATH", "").strip() or None,
+    name="query_embed",
+)
+
+def _normalize_rows(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms += 1e-8
+    m /= norms
+    return m
+
+def _make_store(matrix: np.ndarray, metas: List[Dict], normalized: bool = False,
+                ann: Optional[IVFIndex] = None, scales: Optional[np.ndarray] = None,
+                full: Optional[np.ndarray] = None) -> VectorStore:
+    """Store mới từ ma trận + metadata cùng thứ tự. `normalized=True` giữ nguyên ma trận (memmap)."""
+    if normalized:
+        m = matrix
+    else:
+        m = np.ascontiguousarray(matrix, dtype=np.float32)
+        if m.size:
+            m = _normalize_rows(m)
+    return VectorStore(m, metas, ann, scales, full)
+
+def _set_store(matrix: np.ndarray, metas: List[Dict], normalized: bool = False,
+               ann: Optional[IVFIndex] = None) -> int:
+    return install_store(_make_store(matrix, metas, normalized, ann))
+
+def install_store(store: VectorStore) -> int:
+    """Thay store đang phục vụ bằng một phép gán tham chiếu."""
     global _STORE
-    _STORE = []
+    _STORE = store
+    return len(store)
+
+def current_store() -> VectorStore:
+    return _STORE
+
+def open_vector_store(index_path: str = "index/index.jsonl") -> VectorStore:
+    """Đọc index (ưu tiên bản nhị phân mmap) thành store mới - không đụng store đang phục vụ."""
+    bin_dir = find_binary_index(index_path)
+    if bin_dir:
+        matrix, metas, man = open_binary_index(bin_dir)
+        ann = load_ivf(bin_dir, os.path.join(bin_dir, man["vectors"]), len(metas)) if ANN_ENABLED else None
+        scales, full = open_rescore(bin_dir, man)
+        store = _make_store(matrix, metas, normalized=True, ann=ann, scales=scales, full=full)
+        mb = store.nbytes()
+        say(f"[vector] mmap {len(store)} units ({man['dtype']}, dim={man['dim']}, model={man.get('model')}) from {bin_dir}"
+            f" - quét {mb['scan'] / 2**20:.1f} MB"
+            + (f", chấm lại float32 x{RESCORE_FACTOR}" if full is not None else "")
+            + (f", IVF nlist={ann.nlist} nprobe={ANN_NPROBE}" if ann is not None else ""),
+            level="info", event="vector_loaded", units=len(store), path=bin_dir)
+        return store
+
+    rows: List[List[float]] = []
+    metas: List[Dict] = []
     with open(index_path, "r", encoding="utf-8") as f:
         for line in f:
-            obj = json.loads(line.strip())
-            emb = obj.get("embedding", [])
+            line = line.strip()
+            if not line:
+                continue
+            obj = json.loads(line)
+            emb = obj.pop("embedding", [])
             if isinstance(emb, list) and emb and isinstance(emb[0], (int, float)):
-                _STORE.append(obj)
-    print(f"[vector] loaded {len(_STORE)} units from {index_path}")
-    return len(_STORE)
+                rows.append(emb)
+                metas.append(obj)
+    matrix = np.asarray(rows, dtype=np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+    return _make_store(matrix, metas)
 
-def _cos(a, b):
-    dot = sum(x*y for x,y in zip(a,b))
-    na = math.sqrt(sum(x*x for x in a)) + 1e-8
-    nb = math.sqrt(sum(y*y for y in b)) + 1e-8
-    return dot/(na*nb)
+def load_vector_store(index_path: str = "index/index.jsonl") -> int:
+    return install_store(open_vector_store(index_path))
 
-def vector_search(query: str, top_k: int = 5, allow_titles: Optional[List[str]] = None, embed_model: Optional[str] = None):
-    if not _STORE or not query.strip():
-        return []
-    qv = embed_ollama([query], model=embed_model)[0]
-    scored = []
-    for it in _STORE:
-        if allow_titles and it.get("title") not in allow_titles:
-            continue
-        s = _cos(qv, it["embedding"])
-        scored.append((s, it))
-    scored.sort(key=lambda x: x[0], reverse=True)
+def _topk_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Chọn top-k bằng argpartition (O(N)) rồi chỉ sort k phần tử."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(scores.shape[0])
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+def _matvec(m: np.ndarray, q: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    m @ q (x scales theo hàng nếu có - int8); ma trận không phải float32 (float16/int8)
+    được nhân theo khối để tránh upcast cả ma trận.
+    """
+    if m.dtype == np.float32:
+        out = m @ q
+    else:
+        out = np.empty(m.shape[0], dtype=np.float32)
+        buf = np.empty((min(_SCORE_BLOCK, m.shape[0]), m.shape[1]), dtype=np.float32)
+        for s in range(0, m.shape[0], _SCORE_BLOCK):
+            blk = m[s:s + _SCORE_BLOCK]
+            b = buf[:blk.shape[0]]
+            b[...] = blk
+            np.dot(b, q, out=out[s:s + blk.shape[0]])
+    if scales is not None:
+        out *= scales
+    return out
+
+def _matmat(m: np.ndarray, Q: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """m @ Q.T (khối hàng x số câu hỏi); khối không phải float32 được upcast một lần cho cả B câu."""
+    out = (m if m.dtype == np.float32 else m.astype(np.float32)) @ Q.T
+    if scales is not None:
+        out *= scales[:, None]
+    return out
+
+def _search_vector(qv, top_k: int = 5, allow_titles: Optional[List[str]] = None) -> List[Dict]:
+    st = _STORE
+    picked, picked_scores = st.search_rows(qv, top_k, allow_titles)
     out = []
-    for s, it in scored[:top_k]:
+    for i, s in zip(picked.tolist(), picked_scores.tolist()):
+        it = st.meta[i]
         out.append({
             "title": it["title"], "article": it["article"], "clause": it["clause"],
             "text": it["text"], "source": it["source"], "score": float(s)
         })
     return out
+
+def embed_query(query: str, embed_model: Optional[str] = None) -> Tuple[List[float], bool]:
+    """Embedding của câu hỏi, có cache. Trả về (vector, cache_hit)."""
+    mdl = embed_model or os.getenv("EMBED_MODEL", "nomic-embed-text")
+    key = make_key(mdl, normalize_text(query))
+    qv = _QCACHE.get(key)
+    if qv is not None:
+        return qv, True
+    qv = embed_ollama([query], model=mdl)[0]
+    _QCACHE.set(key, qv)
+    return qv, False
+
+def embed_queries(queries: Sequence[str], embed_model: Optional[str] = None) -> Tuple[List[List[float]], List[bool]]:
+    """
+    embed_query() cho nhiều câu hỏi: tra cache từng câu, các câu còn thiếu (bỏ trùng) được embed
+    bằng một lần embed_ollama (batch thật). Trả về (vectors, cache_hit) theo thứ tự đầu vào.
+    """
+    mdl = embed_model or os.getenv("EMBED_MODEL", "nomic-embed-text")
+    keys = [make_key(mdl, normalize_text(q)) for q in queries]
+    vecs = [_QCACHE.get(k) for k in keys]
+    hits = [v is not None for v in vecs]
+    todo: Dict[str, str] = {}
+    for k, q, v in zip(keys, queries, vecs):
+        if v is None:
+            todo.setdefault(k, q)
+    if todo:
+        got = dict(zip(todo, embed_ollama(list(todo.values()), model=mdl)))
+        for k, v in got.items():
+            _QCACHE.set(k, v)
+        vecs = [v if v is not None else got[k] for k, v in zip(keys, vecs)]
+    return vecs, hits
+
+async def aembed_query(query: str, embed_model: Optional[str] = None) -> Tuple[List[float], bool]:
+    """Bản async của embed_query() (dùng AsyncClient, cùng cache)."""
+    mdl = embed_model or os.getenv("EMBED_MODEL", "nomic-embed-text")
+    key = make_key(mdl, normalize_text(query))
+    qv = _QCACHE.get(key)
+    if qv is not None:
+        return qv, True
+    qv = (await aembed_ollama([query], model=mdl))[0]
+    _QCACHE.set(key, qv)
+    return qv, False
+
+def vector_units() -> int:
+    return len(_STORE)
+
+def embed_cache_stats() -> dict:
+    return _QCACHE.stats()
+
+def search_ids_by_vector(qv, top_k: int = 5, allow_titles: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+    """Top-k (unit ID của corpus, cosine) trên store hiện tại - dùng cho hợp nhất RRF theo ID."""
+    return _STORE.search_ids(qv, top_k, allow_titles)
+
+def search_by_vector(qv, top_k: int = 5, allow_titles: Optional[List[str]] = None) -> List[Dict]:
+    """Tìm theo vector câu hỏi đã có sẵn (không gọi embedding)."""
+    if not _STORE.meta:
+        return []
+    return _search_vector(qv, top_k=top_k, allow_titles=allow_titles)
+
+def vector_search(query: str, top_k: int = 5, allow_titles: Optional[List[str]] = None, embed_model: Optional[str] = None):
+    if not _STORE.meta or not query.strip():
+        return []
+    qv, _ = embed_query(query, embed_model=embed_model)
+    return _search_vector(qv, top_k=top_k, allow_titles=allow_titles)
@@ -18,6 +18,8 @@ class Settings:
     # Retrieval - Tăng top_k và max_context để có thông tin đầy đủ hơn
     top_k: int = int(os.getenv("TOP_K", "8"))
     max_context_chars: int = int(os.getenv("MAX_CONTEXT_CHARS", "6000"))
+    # Ngân sách CONTEXT theo token ước lượng (0 = quy đổi từ MAX_CONTEXT_CHARS), xem core/context_packer.py
+    max_context_tokens: int = int(os.getenv("MAX_CONTEXT_TOKENS", "0"))
 
     # Gen length - Giảm max_tokens để tăng tốc độ phản hồi (offline mode)
     max_tokens: int = int(os.getenv("MAX_TOKENS", "512"))
@@ -1,11 +1,14 @@
 # core/utils.py
-import time, threading, requests
+import os, time, threading, requests
 from contextlib import contextmanager
 from rich.console import Console
 from rich.text import Text
 from rich.table import Table
 from rich import box
 import datetime
+from core import eventlog
+
+_CONSOLE = Console()  # dùng chung, không dựng Console mới mỗi lần in
 
 class Heartbeat:
     def __init__(self, label: str = "Đang xử lý", every: float = 60.0):
@@ -18,7 +21,8 @@ class Heartbeat:
         elapsed = 0.0
         while not self._stop.wait(self.every):
             elapsed += self.every
-            print(f"[⏳] {self.label}… {int(elapsed)}s", flush=True)
+            eventlog.say(f"[⏳] {self.label}… {int(elapsed)}s", level="info", event="heartbeat",
+                         label=self.label, elapsed_s=int(elapsed))
 
     def __enter__(self):
         self._t = threading.Thread(target=self._run, daemon=True)
@@ -46,17 +50,128 @@ def lap_timer(enabled: bool = True):
     finally:
         pass
 
-def check_internet_connection(timeout: float = 3.0) -> bool:
-    """Kiểm tra kết nối internet bằng cách ping Google."""
+CONNECTIVITY_PROBE_URL = os.getenv("CONNECTIVITY_PROBE_URL", "https://www.gstatic.com/generate_204")
+CONNECTIVITY_INTERVAL  = float(os.getenv("CONNECTIVITY_INTERVAL", "30"))
+CONNECTIVITY_MAX_BACKOFF = float(os.getenv("CONNECTIVITY_MAX_BACKOFF", "300"))
+CONNECTIVITY_TIMEOUT   = float(os.getenv("CONNECTIVITY_TIMEOUT", "3"))
+
+def check_internet_connection(timeout: float = 3.0, url: str = None) -> bool:
+    """Kiểm tra kết nối internet bằng một request thật (chặn tối đa `timeout` giây).
+    Trong request handler nên dùng is_online() (đọc trạng thái cache) thay vì hàm này."""
     try:
-        response = requests.get("https://www.gstatic.com/generate_204", timeout=timeout)
-        return response.status_code == 204
+        response = requests.get(url or CONNECTIVITY_PROBE_URL, timeout=timeout)
+        return 200 <= response.status_code < 300
     except Exception:
         return False
 
+class ConnectivityMonitor:
+    """
+    Thread nền probe kết nối theo chu kỳ và công bố trạng thái online/offline.
+    Khi offline, chu kỳ probe tăng gấp đôi (backoff) tới `max_backoff` giây.
+    Đọc trạng thái (`online`) là O(1); callback `on_change(fn)` được gọi khi trạng thái đổi.
+    """
+    def __init__(self, url: str = None, interval: float = None, max_backoff: float = None, timeout: float = None):
+        self.url = url or CONNECTIVITY_PROBE_URL
+        self.interval = max(1.0, float(interval or CONNECTIVITY_INTERVAL))
+        self.max_backoff = max(self.interval, float(max_backoff or CONNECTIVITY_MAX_BACKOFF))
+        self.timeout = float(timeout or CONNECTIVITY_TIMEOUT)
+        self.online = False
+        self.probes = 0
+        self.failures = 0
+        self.last_probe = None
+        self.last_change = None
+        self.next_delay = self.interval
+        self._listeners = []
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._t = None
+        self._lock = threading.Lock()
+
+    def on_change(self, fn):
+        """Đăng ký callback fn(online: bool) khi trạng thái thay đổi."""
+        self._listeners.append(fn)
+        return fn
+
+    def probe(self) -> bool:
+        ok = check_internet_connection(timeout=self.timeout, url=self.url)
+        with self._lock:
+            self.probes += 1
+            self.last_probe = time.time()
+            changed = ok != self.online or self.last_change is None
+            if not ok:
+                self.failures += 1
+                self.next_delay = min(self.max_backoff, self.next_delay * 2) if not self.online else self.interval
+            else:
+                self.next_delay = self.interval
+            if changed:
+                self.online = ok
+                self.last_change = self.last_probe
+        self._ready.set()
+        if changed:
+            for fn in list(self._listeners):
+                try:
+                    fn(ok)
+                except Exception as e:
+                    eventlog.say(f"⚠️ connectivity listener lỗi: {e}", level="warning", event="connectivity_listener_error")
+        return ok
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe()
+            if self._stop.wait(self.next_delay):
+                break
+
+    def start(self, wait: bool = False):
+        """Chạy thread nền (idempotent). `wait=True` đợi kết quả probe đầu tiên."""
+        with self._lock:
+            if not (self._t and self._t.is_alive()):
+                self._stop.clear()
+                self._t = threading.Thread(target=self._run, name="connectivity-monitor", daemon=True)
+                self._t.start()
+        if wait:
+            self._ready.wait(self.timeout + 1.0)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "online": self.online,
+                "probe_url": self.url,
+                "probes": self.probes,
+                "failures": self.failures,
+                "last_probe": self.last_probe,
+                "last_change": self.last_change,
+                "next_probe_in": self.next_delay,
+            }
+
+_MONITOR = None
+_MONITOR_LOCK = threading.Lock()
+
+def get_connectivity_monitor() -> ConnectivityMonitor:
+    global _MONITOR
+    if _MONITOR is None:
+        with _MONITOR_LOCK:
+            if _MONITOR is None:
+                _MONITOR = ConnectivityMonitor()
+    return _MONITOR
+
+def is_online() -> bool:
+    """
+    Trạng thái kết nối đã cache bởi monitor nền. Lần gọi đầu tự khởi động monitor và đợi probe đầu tiên
+    (tối đa CONNECTIVITY_TIMEOUT + 1 giây, một lần cho cả process) - không thì câu hỏi đầu luôn bị coi là offline;
+    các lần sau không chặn.
+    """
+    return get_connectivity_monitor().start(wait=True).online
+
 def print_status_info(is_online: bool, ai_type: str, model: str, question_head: str, context_head: str):
-    """In thông tin trạng thái và AI được sử dụng với giao diện đẹp."""
-    console = Console()
+    """In thông tin trạng thái và AI được sử dụng với giao diện đẹp (chế độ json: một sự kiện `status`)."""
+    if not eventlog.pretty():
+        eventlog.log("status", "debug", online=is_online, ai=ai_type, model=model)
+        return
+    console = _CONSOLE
     
     # Tạo bảng trạng thái
     status_table = Table(
@@ -94,8 +209,12 @@ def print_status_info(is_online: bool, ai_type: str, model: str, question_head:
     console.print()
 
 def print_timing_info(timing_data: dict):
-    """In thông tin thời gian thực hiện với giao diện đẹp."""
-    console = Console()
+    """In thông tin thời gian thực hiện với giao diện đẹp (chế độ json: một sự kiện `timing`)."""
+    if not eventlog.pretty():
+        eventlog.log("timing", "info", **{k: v for k, v in timing_data.items()
+                                          if isinstance(v, (int, float, str, bool)) or v is None})
+        return
+    console = _CONSOLE
     
     timing_table = Table(
         title="⏱️ Thời gian xử lý chi tiết",
@@ -114,8 +233,22 @@ def print_timing_info(timing_data: dict):
     if "vector_ms" in timing_data and timing_data["vector_ms"] is not None:
         timing_table.add_row("🎯 Vector Search", f"{timing_data['vector_ms']:.2f}", "Tìm kiếm ngữ nghĩa")
         
+    if timing_data.get("embed_cache"):
+        timing_table.add_row(
+            "🧠 Embed cache", timing_data["embed_cache"].upper(),
+            f"hits {timing_data.get('embed_cache_hits', 0)} / misses {timing_data.get('embed_cache_misses', 0)}",
+        )
+        
+    if timing_data.get("result_cache") == "hit":
+        timing_table.add_row("♻️ Result cache", "HIT", "Dùng lại hits đã hợp nhất, bỏ qua BM25/vector")
+
     if "retrieval_ms" in timing_data and timing_data["retrieval_ms"] is not None:
-        timing_table.add_row("📚 Retrieval", f"{timing_data['retrieval_ms']:.2f}", "Tổng thời gian truy xuất")
+        note = "Tổng thời gian truy xuất"
+        if timing_data.get("overlap_saved_ms"):
+            note += f" (song song, tiết kiệm {timing_data['overlap_saved_ms']:.0f}ms)"
+        if timing_data.get("vector_status") in ("timeout", "error"):
+            note += f" - vector {timing_data['vector_status']}, chỉ dùng BM25"
+        timing_table.add_row("📚 Retrieval", f"{timing_data['retrieval_ms']:.2f}", note)
     
     if "llm_ms" in timing_data and timing_data["llm_ms"] is not None:
         timing_table.add_row("🤖 AI Processing", f"{timing_data['llm_ms']:.2f}", "Xử lý AI và sinh câu trả lời")
@@ -127,8 +260,11 @@ def print_timing_info(timing_data: dict):
     console.print()
 
 def print_step_timing(step_name: str, duration_ms: float):
-    """In thời gian thực hiện từng bước một cách đẹp mắt."""
-    console = Console()
+    """In thời gian thực hiện từng bước một cách đẹp mắt (chế độ json: sự kiện `step`, mức debug)."""
+    if not eventlog.pretty():
+        eventlog.log("step", "debug", step=step_name, ms=round(duration_ms, 2))
+        return
+    console = _CONSOLE
     
     # Tạo text với màu sắc tùy theo thời gian
     if duration_ms < 100:
@@ -1,8 +1,9 @@
 # run_cli.py
-import os, sys
+import os, sys, json, time, argparse
 from core.settings import Settings
-from core.pipeline import load_index, answer_question
+from core.pipeline import load_index, answer_question, answer_batch
 from core.utils import print_timing_info
+from core import eventlog
 
 # pretty output
 from rich.console import Console
@@ -46,8 +47,57 @@ def _print_citations_table(cites, max_chars: int | None = None):
 
     console.print(table)
 
+def _read_questions(path: str):
+    """Đọc lười file JSONL: mỗi dòng {"id", "question"} (hoặc một chuỗi JSON / một dòng text)."""
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line
+
+def run_batch(path: str, out_path: str | None, concurrency: int | None) -> int:
+    """
+    Trả lời cả file câu hỏi với một lần load index: kết quả JSONL (đúng thứ tự đầu vào) ra `out_path`
+    hoặc stdout, ghi từng dòng ngay khi xong; log JSON ra stderr để không lẫn vào kết quả.
+    """
+    eventlog.configure("json", stream=sys.stderr)
+    settings = Settings()
+    load_index(settings.data_dir)
+    out = open(out_path, "w", encoding="utf-8") if out_path else sys.stdout
+    t0 = time.perf_counter()
+    n = errors = 0
+    try:
+        for r in answer_batch(_read_questions(path), settings, concurrency=concurrency):
+            out.write(json.dumps(r, ensure_ascii=False) + "\n")
+            out.flush()
+            n += 1
+            errors += r["status"] != "success"
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    dt = time.perf_counter() - t0
+    eventlog.log("batch_done", "info", questions=n, errors=errors, seconds=round(dt, 2),
+                 qps=round(n / dt, 2) if dt > 0 else None)
+    eventlog.flush()
+    return 1 if errors else 0
+
 def main():
-    q = " ".join(sys.argv[1:]).strip()
+    ap = argparse.ArgumentParser(description="AURA Legal CLI")
+    ap.add_argument("question", nargs="*", help="Câu hỏi (trống: đọc question/request.txt)")
+    ap.add_argument("--batch", metavar="FILE.jsonl", help="Trả lời cả file JSONL (- = stdin), kết quả JSONL")
+    ap.add_argument("--out", help="File kết quả của --batch (mặc định stdout)")
+    ap.add_argument("--concurrency", type=int, default=None, help="Số câu gọi LLM song song (mặc định BATCH_LLM_CONCURRENCY)")
+    args = ap.parse_args()
+    if args.batch:
+        sys.exit(run_batch(args.batch, args.out, args.concurrency))
+
+    eventlog.configure("rich")  # CLI tương tác: bảng Rich + dòng tiến trình (LOG_FORMAT=json để lấy log máy đọc)
+    q = " ".join(args.question).strip()
     if not q:
         q = open("question/request.txt", "r", encoding="utf-8").read().strip()
 
@@ -1,91 +1,39 @@
-import os, time, requests
-from pathlib import Path
-from flask import Flask, send_from_directory, request, jsonify
-import google.generativeai as genai
+import os, time
+from flask import Flask, Response, send_from_directory, request, jsonify, stream_with_context, g
 
 from core.pipeline import load_index, answer_question
 from core.settings import Settings
-from core.utils import print_status_info, print_step_timing, print_timing_info, check_internet_connection
-
-ROOT = Path(__file__).resolve().parents[1]  # project root
-APP_DIR = ROOT / "app"
-GEMINI_PROMPT_PATH = ROOT / "prompts" / "gemini_answer.txt"
+from core.llm_client import pool_stats
+from core import result_cache, metrics, eventlog
+from core.eventlog import say
+from core.reloader import get_index_watcher
+from core.utils import print_status_info, print_step_timing, print_timing_info, is_online, get_connectivity_monitor
+from core.api import (
+    APP_DIR, settings, gemini_enabled, citations_to_context, head, gemini_answer, gemini_key,
+    stream_events, batch_request, batch_events, admin_denied,
+)
 
 app = Flask(__name__, static_folder=str(APP_DIR), template_folder=str(APP_DIR))
 app.secret_key = os.getenv('SECRET_KEY', 'vn-legal-assistant-2024')
 
-settings = Settings()
-
-# -----------------------------
-# Helpers
-# -----------------------------
-def _online() -> bool:
-    return check_internet_connection()
-
-def _gemini_enabled() -> bool:
-    return bool(os.getenv("GOOGLE_API_KEY", "").strip())
-
-def _citations_to_context(citations) -> str:
-    buf = []
-    for c in citations or []:
-        title  = c.get("title","")
-        art    = c.get("article","")
-        clause = c.get("clause")
-        text   = (c.get("text") or "").strip()
-        src    = c.get("source","")
-        tag = f"[{title} | Điều {art}" + (f", Khoản {clause}]" if clause else "]")
-        buf.append(f"{tag}\n{text}\nSOURCE: {src}")
-    return "\n---\n".join(buf)
-
-def _head(s: str, n: int = 50) -> str:
-    s = (s or "").strip().replace("\n", " ")
-    return s[:n]
-
-def _gemini_answer(question: str, context: str) -> str | None:
-    key = os.getenv("GOOGLE_API_KEY", "").strip()
-    if not key:
-        return None
-    model_id = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
-    genai.configure(api_key=key)
-    
-    # Đọc system prompt từ file
-    try:
-        system_prompt = GEMINI_PROMPT_PATH.read_text(encoding="utf-8")
-    except Exception:
-        # Fallback prompt nếu file không tồn tại
-        system_prompt = (
-            "Bạn là Luật sư tư vấn pháp luật Việt Nam chuyên nghiệp. "
-            "Tư vấn dựa trên CONTEXT chính xác và thực tiễn. "
-            "CHỈ sử dụng thông tin có trong CONTEXT. "
-            "Mỗi kết luận phải có trích dẫn văn bản pháp luật đầy đủ (Luật/Nghị định | Điều X, Khoản Y). "
-            "Trả lời đầy đủ, chi tiết như luật sư chuyên nghiệp."
-        )
-    
-    prompt = f'''{system_prompt}
-
-CONTEXT:
-{context}
-
-CÂU HỎI:
-{question}
-'''
-    try:
-        model = genai.GenerativeModel(model_id)
-        res = model.generate_content(prompt)
-        return (res.text or "").strip()
-    except Exception:
-        # Fallback: thử model 1.5 nếu 2.0 không khả dụng
-        try:
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            res = model.generate_content(prompt)
-            return (res.text or "").strip()
-        except Exception as e2:
-            print("Gemini error:", e2)
-            return None
+# server: log JSON qua hàng đợi + thread ghi nền (LOG_FORMAT=rich để xem bảng Rich khi debug)
+eventlog.configure("json")
 
 # -----------------------------
 # Routes
 # -----------------------------
+@app.before_request
+def _bind_request_id():
+    g.t_req = time.perf_counter()
+    eventlog.new_request_id(request.headers.get("X-Request-ID"))
+
+@app.after_request
+def _log_request(resp):
+    resp.headers["X-Request-ID"] = eventlog.request_id() or ""
+    eventlog.log("request", "info", method=request.method, path=request.path, status=resp.status_code,
+                 ms=round((time.perf_counter() - g.get("t_req", time.perf_counter())) * 1000.0, 2))
+    return resp
+
 @app.route("/")
 def index():
     return send_from_directory(str(APP_DIR), "index.html")
@@ -96,16 +44,23 @@ def ask():
     question = (data.get("question") or "").strip()
     if not question:
         return jsonify({"status": "error", "error": "Vui lòng nhập câu hỏi"}), 400
+    with metrics.track_in_flight():
+        try:
+            return _ask(question)
+        except Exception:
+            metrics.record_error("ask")
+            raise
 
+def _ask(question: str):
     t_all0 = time.time()
 
     # ===== ONLINE BRANCH: Retrieval-only -> Gemini =====
-    if _online() and _gemini_enabled():
-        print("🌐 Sử dụng chế độ ONLINE với Gemini")
-        print_status_info(True, "gemini", os.getenv("GEMINI_MODEL", "gemini-2.0-flash"), _head(question), "")
+    if is_online() and gemini_enabled():
+        say("🌐 Sử dụng chế độ ONLINE với Gemini")
+        print_status_info(True, "gemini", os.getenv("GEMINI_MODEL", "gemini-2.0-flash"), head(question), "")
         
         # 1) Retrieval-only để lấy citations
-        print("📚 Đang thực hiện retrieval...")
+        say("📚 Đang thực hiện retrieval...")
         t_ret0 = time.time()
         retrieval_only = Settings()
         retrieval_only.llm_enabled = False  # không gọi LLM Ollama
@@ -114,14 +69,19 @@ def ask():
         print_step_timing("Retrieval hoàn thành", t_ret_ms)
 
         citations = rag.get("citations", [])
-        context = _citations_to_context(citations)
+        context = citations_to_context(citations)
 
-        # 2) Gọi Gemini
-        print("🚀 Đang gửi yêu cầu đến Gemini...")
+        # 2) Gọi Gemini (hoặc lấy câu trả lời đã cache)
+        key = gemini_key(question, context)
         t_llm0 = time.time()
-        ans = _gemini_answer(question, context)
+        ans = result_cache.get_answer(key)
+        answer_cached = ans is not None
+        if not answer_cached:
+            say("🚀 Đang gửi yêu cầu đến Gemini...")
+            ans = gemini_answer(question, context)
+            result_cache.put_answer(key, ans)
         t_llm_ms = round((time.time() - t_llm0) * 1000, 2)
-        print_step_timing("Gemini xử lý", t_llm_ms)
+        print_step_timing("Gemini xử lý" + (" (cache)" if answer_cached else ""), t_llm_ms)
 
         if ans:
             total_sec = round((time.time() - t_all0), 2)
@@ -131,7 +91,8 @@ def ask():
                 "total_ms": round(total_sec * 1000, 2),
             }
             print_timing_info(timing_data)
-            
+            metrics.record_request("gemini-online", {**rag["timings"], **timing_data}, llm_ran=not answer_cached)
+
             return jsonify({
                 "status": "success",
                 "mode": "gemini-online",
@@ -141,20 +102,21 @@ def ask():
                 # META
                 "ai": "gemini",
                 "model": os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
-                "question_head": _head(question),
-                "context_head": _head(context),
+                "question_head": head(question),
+                "context_head": head(context),
                 "timings": timing_data,
+                "cached": {"retrieval": rag["cached"]["retrieval"], "answer": answer_cached},
             })
 
     # ===== OFFLINE BRANCH: Ollama pipeline (giữ nguyên logic) =====
-    print("💻 Sử dụng chế độ OFFLINE với Ollama")
+    say("💻 Sử dụng chế độ OFFLINE với Ollama")
     t_pipe0 = time.time()
     rag = answer_question(question, settings=settings)
     t_total_ms = round((time.time() - t_pipe0) * 1000, 2)
 
     # cố gắng lấy context đầu nếu có
     citations = rag.get("citations", [])
-    context = _citations_to_context(citations)
+    context = citations_to_context(citations)
     
     # Sử dụng timing data từ pipeline nếu có
     timing_data = rag.get("timings", {
@@ -162,6 +124,8 @@ def ask():
         "llm_ms": None,
         "total_ms": t_total_ms,
     })
+    metrics.record_request(rag.get("mode", "rag+llm"), timing_data,
+                           llm_ran=not (rag.get("cached") or {}).get("answer"))
 
     return jsonify({
         "status": "success",
@@ -172,24 +136,87 @@ def ask():
         # META
         "ai": "ollama",
         "model": os.getenv("LLM_MODEL", "qwen2.5:3b-instruct"),
-        "question_head": _head(question),
-        "context_head": _head(context),
+        "question_head": head(question),
+        "context_head": head(context),
         "timings": timing_data,
+        "cached": rag.get("cached"),
     })
 
+@app.route("/ask/stream", methods=["POST"])
+def ask_stream():
+    """
+    Server-sent events: `citations` ngay khi retrieval xong, sau đó nhiều `token`,
+    cuối cùng `done` với bảng thời gian (gồm ttfb_ms, ttft_ms).
+    """
+    data = request.get_json() or {}
+    question = (data.get("question") or "").strip()
+    if not question:
+        return jsonify({"status": "error", "error": "Vui lòng nhập câu hỏi"}), 400
+
+    t0 = time.perf_counter()
+    return Response(
+        stream_with_context(stream_events(question, t0)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/ask_batch", methods=["POST"])
+def ask_batch():
+    """
+    Nhiều câu hỏi một request: embedding gộp, vector search theo lô, LLM song song có giới hạn.
+    Trả về application/x-ndjson - mỗi câu một dòng (index, id, answer, citations, timings) đúng thứ tự đầu vào.
+    """
+    items, conc = batch_request(request.get_data(), request.mimetype)
+    if not items:
+        return jsonify({"status": "error", "error": "Cần danh sách câu hỏi (JSON {\"questions\": [...]} hoặc JSONL)"}), 400
+    return Response(
+        stream_with_context(batch_events(items, conc)),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/admin/reload", methods=["GET", "POST"])
+def admin_reload():
+    """POST: bắt đầu reload index (không chặn query; ?wait=1 để đợi xong). GET: trạng thái reload."""
+    denied = admin_denied(request.headers.get("X-Admin-Token"), request.remote_addr)
+    if denied:
+        return jsonify({"status": "error", "error": "Unauthorized" if denied == 401 else "Forbidden"}), denied
+    watcher = get_index_watcher(settings.data_dir)
+    if request.method == "GET":
+        return jsonify(watcher.status())
+    started = watcher.trigger(wait=request.args.get("wait") in ("1", "true"))
+    return jsonify({"status": "started" if started else "already_running", **watcher.status()}), 202
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Metric dạng text Prometheus: histogram từng bước, counter mode/cache/lỗi backend, gauge in-flight/index."""
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"status": "error", "error": "METRICS_ENABLED=false"}), 404
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
 @app.route("/health")
 def health():
     return jsonify({
         "status": "healthy",
-        "internet": _online(),
-        "gemini_configured": _gemini_enabled(),
+        "internet": is_online(),
+        "connectivity": get_connectivity_monitor().status(),
+        "gemini_configured": gemini_enabled(),
         "ollama_configured": True,
+        "http_pool": pool_stats(),
+        "result_cache": result_cache.stats(),
+        "index": get_index_watcher(settings.data_dir).status(),
+        "log": eventlog.stats(),
         "timestamp": time.time()
     })
 
 if __name__ == "__main__":
-    print("🚀 Khởi động AURA Legal")
-    print("📚 Loading index…")
+    say("🚀 Khởi động AURA Legal", level="info", event="startup")
+    say("📚 Loading index…", level="info", event="startup")
     load_index(settings.data_dir)
-    print("✅ Ready at http://localhost:5000")
+    monitor = get_connectivity_monitor()
+    monitor.on_change(lambda ok: say("🌐 Kết nối internet: " + ("ONLINE" if ok else "OFFLINE"),
+                                     level="info", event="connectivity", online=ok))
+    monitor.start(wait=True)
+    get_index_watcher(settings.data_dir).start()
+    say("✅ Ready at http://localhost:5000", level="info", event="startup")
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
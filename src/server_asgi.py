@@ -0,0 +1,208 @@
+"""
+Server ASGI (FastAPI + uvicorn) cho AURA Legal - cùng API với server.py (Flask).
+
+Khác biệt: /ask chạy answer_question_async(), nên trong lúc chờ Ollama/embedding
+event loop vẫn nhận request khác; phần CPU (BM25, chấm điểm vector) chạy trên thread pool.
+Chạy: uvicorn server_asgi:app --app-dir src --host 0.0.0.0 --port 5000
+"""
+import os, time, asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+
+from core.pipeline import load_index, answer_question_async, aretrieve_context
+from core.llm_client import pool_stats, close_clients
+from core.utils import is_online, get_connectivity_monitor
+from core.reloader import get_index_watcher
+from core import result_cache, metrics, eventlog
+from core.eventlog import say
+from core.api import (
+    APP_DIR, settings, gemini_enabled, citations_to_context, head,
+    gemini_answer, gemini_key, stream_events, admin_denied, batch_request, batch_events,
+)
+
+app = FastAPI(title="AURA Legal")
+# giống server.py: log JSON qua hàng đợi + thread ghi nền (LOG_FORMAT=rich để xem bảng Rich)
+eventlog.configure("json")
+
+@app.middleware("http")
+async def _request_log(request: Request, call_next):
+    # request ID nằm trong ContextVar: asyncio task / to_thread của request này đều thấy cùng giá trị
+    t0 = time.perf_counter()
+    rid = eventlog.new_request_id(request.headers.get("x-request-id"))
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = rid
+    eventlog.log("request", "info", method=request.method, path=request.url.path, status=response.status_code,
+                 ms=round((time.perf_counter() - t0) * 1000.0, 2))
+    return response
+
+@app.on_event("startup")
+async def _startup():
+    say("📚 Loading index…", level="info", event="startup")
+    await asyncio.to_thread(load_index, settings.data_dir)
+    monitor = get_connectivity_monitor()
+    monitor.on_change(lambda ok: say("🌐 Kết nối internet: " + ("ONLINE" if ok else "OFFLINE"),
+                                     level="info", event="connectivity", online=ok))
+    # đợi probe đầu (trên thread) để request ngay sau khởi động không bị coi là offline
+    await asyncio.to_thread(monitor.start, True)
+    get_index_watcher(settings.data_dir).start()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    get_connectivity_monitor().stop()
+    get_index_watcher(settings.data_dir).stop()
+    close_clients()
+
+@app.get("/")
+async def index():
+    return FileResponse(str(APP_DIR / "index.html"))
+
+@app.post("/ask")
+async def ask(request: Request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    question = ((data or {}).get("question") or "").strip()
+    if not question:
+        return JSONResponse({"status": "error", "error": "Vui lòng nhập câu hỏi"}, status_code=400)
+    with metrics.track_in_flight():
+        try:
+            return await _ask(question)
+        except Exception:
+            metrics.record_error("ask")
+            raise
+
+async def _ask(question: str):
+    t_all0 = time.time()
+
+    # ===== ONLINE BRANCH: Retrieval-only -> Gemini =====
+    if is_online() and gemini_enabled():
+        t_ret0 = time.time()
+        retrieved = await aretrieve_context(question, settings)
+        t_ret_ms = round((time.time() - t_ret0) * 1000, 2)
+        citations = retrieved["hits"]
+        context = citations_to_context(citations)
+
+        key = gemini_key(question, context)
+        t_llm0 = time.time()
+        ans = result_cache.get_answer(key)
+        answer_cached = ans is not None
+        if not answer_cached:
+            # SDK Gemini là blocking -> chạy trên thread để không chặn event loop
+            ans = await asyncio.to_thread(gemini_answer, question, context)
+            result_cache.put_answer(key, ans)
+        t_llm_ms = round((time.time() - t_llm0) * 1000, 2)
+        if ans:
+            total_sec = round((time.time() - t_all0), 2)
+            timings = {"retrieval_ms": t_ret_ms, "llm_ms": t_llm_ms, "total_ms": round(total_sec * 1000, 2)}
+            metrics.record_request("gemini-online", {**retrieved["timings"], **timings}, llm_ran=not answer_cached)
+            return {
+                "status": "success",
+                "mode": "gemini-online",
+                "answer": ans,
+                "citations": citations,
+                "latency_sec": total_sec,
+                "ai": "gemini",
+                "model": os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
+                "question_head": head(question),
+                "context_head": head(context),
+                "timings": timings,
+                "cached": {"retrieval": retrieved["cached"], "answer": answer_cached},
+            }
+
+    # ===== OFFLINE BRANCH: Ollama pipeline =====
+    rag = await answer_question_async(question, settings)
+    citations = rag.get("citations", [])
+    metrics.record_request(rag["mode"], rag.get("timings"), llm_ran=not (rag.get("cached") or {}).get("answer"))
+    return {
+        "status": "success",
+        "mode": "ollama-offline",
+        "answer": rag.get("answer", ""),
+        "citations": citations,
+        "latency_sec": round((time.time() - t_all0), 2),
+        "ai": "ollama",
+        "model": os.getenv("LLM_MODEL", "qwen2.5:3b-instruct"),
+        "question_head": head(question),
+        "context_head": head(citations_to_context(citations)),
+        "timings": rag.get("timings", {}),
+        "cached": rag.get("cached"),
+    }
+
+@app.post("/ask/stream")
+async def ask_stream(request: Request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    question = ((data or {}).get("question") or "").strip()
+    if not question:
+        return JSONResponse({"status": "error", "error": "Vui lòng nhập câu hỏi"}, status_code=400)
+    # generator đồng bộ -> Starlette tự chạy từng bước trên threadpool
+    return StreamingResponse(
+        stream_events(question, time.perf_counter()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/ask_batch")
+async def ask_batch(request: Request):
+    items, conc = batch_request(await request.body(), request.headers.get("content-type", "").split(";")[0].strip())
+    if not items:
+        return JSONResponse({"status": "error", "error": "Cần danh sách câu hỏi (JSON {\"questions\": [...]} hoặc JSONL)"},
+                            status_code=400)
+    # generator đồng bộ (retrieval + LLM blocking) -> Starlette chạy từng bước trên threadpool
+    return StreamingResponse(
+        batch_events(items, conc),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _admin_denied(request: Request):
+    status = admin_denied(request.headers.get("X-Admin-Token"), request.client.host if request.client else None)
+    if status:
+        return JSONResponse({"status": "error", "error": "Unauthorized" if status == 401 else "Forbidden"},
+                            status_code=status)
+    return None
+
+@app.get("/admin/reload")
+async def admin_reload_status(request: Request):
+    denied = _admin_denied(request)
+    if denied:
+        return denied
+    return get_index_watcher(settings.data_dir).status()
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request, wait: bool = False):
+    """Bắt đầu reload index; query vẫn chạy trên bản cũ cho tới khi bản mới được thay vào."""
+    denied = _admin_denied(request)
+    if denied:
+        return denied
+    watcher = get_index_watcher(settings.data_dir)
+    started = await asyncio.to_thread(watcher.trigger, wait)
+    return JSONResponse({"status": "started" if started else "already_running", **watcher.status()}, status_code=202)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if not metrics.METRICS_ENABLED:
+        return JSONResponse({"status": "error", "error": "METRICS_ENABLED=false"}, status_code=404)
+    return PlainTextResponse(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "healthy",
+        "internet": is_online(),
+        "connectivity": get_connectivity_monitor().status(),
+        "gemini_configured": gemini_enabled(),
+        "ollama_configured": True,
+        "http_pool": pool_stats(),
+        "result_cache": result_cache.stats(),
+        "index": get_index_watcher(settings.data_dir).status(),
+        "log": eventlog.stats(),
+        "timestamp": time.time(),
+    }
+
+if __name__ == "__main__":
+    import uvicorn
+    say("🚀 Khởi động AURA Legal (ASGI)", level="info", event="startup")
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
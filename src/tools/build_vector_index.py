@@ -1,5 +1,7 @@
 # tools/build_vector_index.py
 import os, json, argparse, sys, pathlib, time, hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
@@ -7,125 +9,261 @@ if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 from core.llm_client import embed_ollama
+from core.retrieval.vector_bin import MANIFEST_NAME, convert_jsonl, open_binary_index
+from core.retrieval.ivf import IVFIndex, default_nlist
+from core.retrieval.corpus import iter_units as corpus_iter_units
+
+KEYS_SUFFIX = ".keys"
 
 def _unit_key(it: Dict) -> str:
     h = hashlib.md5((it.get("text") or "").encode("utf-8")).hexdigest()
     return f"{it.get('title')}|{it.get('article')}|{it.get('clause')}|{h}"
 
-def _load_existing_keys(index_path: str) -> set:
-    keys = set()
-    if not os.path.exists(index_path):
-        return keys
-    with open(index_path, "r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                obj = json.loads(line.strip())
+class Checkpoint:
+    """
+    File khoá đi kèm index.jsonl (index.jsonl.keys): mỗi unit đã ghi một dòng khoá, mỗi batch
+    kết thúc bằng dòng "@<offset>" = kích thước index.jsonl sau batch đó. Khi resume chỉ đọc file
+    này (không parse embedding), và index.jsonl được cắt về offset của checkpoint cuối cùng -
+    batch ghi dở khi bị ngắt (dòng cuối bị cắt, hoặc đã ghi jsonl mà chưa kịp ghi khoá) bị bỏ
+    và embed lại.
+    """
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.path = index_path + KEYS_SUFFIX
+        self.keys: set = set()
+        self.offset = 0
+
+    def load(self) -> "Checkpoint":
+        if not os.path.exists(self.index_path):
+            self.keys, self.offset = set(), 0
+            self._rewrite()
+        elif not os.path.exists(self.path):
+            self._rebuild_from_jsonl()
+        else:
+            self._read()
+        # bỏ phần đuôi chưa được checkpoint
+        with open(self.index_path, "ab") as f:
+            if f.tell() != self.offset:
+                print(f"✂️ Cắt {f.tell() - self.offset} byte chưa checkpoint ở cuối {self.index_path}")
+                f.truncate(self.offset)
+        return self
+
+    def _read(self):
+        keys, pending, offset, good = set(), [], 0, 0
+        with open(self.path, "rb") as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # dòng cuối ghi dở
+                line = raw.decode("utf-8").rstrip("\n")
+                if line.startswith("@"):
+                    keys.update(pending)
+                    pending.clear()
+                    offset = int(line[1:])
+                    good = f.tell()
+                else:
+                    pending.append(line)
+        self.keys, self.offset = keys, offset
+        with open(self.path, "ab") as f:
+            f.truncate(good)
+
+    def _rebuild_from_jsonl(self):
+        """Index cũ chưa có file khoá: quét index.jsonl một lần (chỉ lần đầu)."""
+        keys, offset = set(), 0
+        with open(self.index_path, "rb") as f:
+            for raw in f:
+                try:
+                    obj = json.loads(raw)
+                except ValueError:
+                    break
+                if not raw.endswith(b"\n"):
+                    break
                 keys.add(_unit_key(obj))
-            except Exception:
-                continue
-    return keys
+                offset += len(raw)
+        self.keys, self.offset = keys, offset
+        self._rewrite()
+
+    def _rewrite(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(k + "\n" for k in self.keys)
+            f.write(f"@{self.offset}\n")
+        os.replace(tmp, self.path)
+
+    def commit(self, fkeys, keys: List[str], offset: int):
+        fkeys.write("".join(k + "\n" for k in keys) + f"@{offset}\n")
+        fkeys.flush()
+        self.keys.update(keys)
+        self.offset = offset
+
+class BatchSizer:
+    """
+    Kích thước batch thích ứng: batch xong nhanh hơn nửa `target_sec` -> gấp đôi,
+    chậm hơn 1.5x `target_sec` hoặc lỗi -> giảm một nửa (trong [lo, hi]).
+    """
+    def __init__(self, initial: int, lo: int, hi: int, target_sec: float):
+        self.lo, self.hi = max(1, lo), max(lo, hi)
+        self.size = min(self.hi, max(self.lo, initial))
+        self.target_sec = target_sec
+
+    def record(self, n: int, sec: float, ok: bool = True):
+        if not ok or sec > self.target_sec * 1.5:
+            self.size = max(self.lo, self.size // 2)
+        elif sec < self.target_sec / 2 and n >= self.size:
+            self.size = min(self.hi, self.size * 2)
 
 def iter_units(data_dir):
-    for name in os.listdir(data_dir):
-        if not name.lower().endswith(".json"): continue
-        title = os.path.splitext(name)[0]
-        path = os.path.join(data_dir, name)
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        for art, obj in data.items():
-            heading = obj.get("tiêu_đề", "")
-            if isinstance(obj.get("khoản"), dict) and obj["khoản"]:
-                for k, v in obj["khoản"].items():
-                    if isinstance(v, dict) and isinstance(v.get("điểm"), dict) and v["điểm"]:
-                        for d, text in v["điểm"].items():
-                            txt = f"{heading}\n{text}".strip()
-                            if txt:
-                                yield {"title": title, "article": str(art), "clause": f"{k}.{d}",
-                                       "text": txt, "source": f"file://{os.path.abspath(path)}"}
-                    else:
-                        txt = f"{heading}\n{v}".strip()
-                        if txt:
-                            yield {"title": title, "article": str(art), "clause": str(k),
-                                   "text": txt, "source": f"file://{os.path.abspath(path)}"}
-            elif isinstance(obj.get("điểm"), dict) and obj["điểm"]:
-                for d, text in obj["điểm"].items():
-                    txt = f"{heading}\n{text}".strip()
-                    if txt:
-                        yield {"title": title, "article": str(art), "clause": str(d),
-                               "text": txt, "source": f"file://{os.path.abspath(path)}"}
-            else:
-                txt = (obj.get("toàn_văn") or heading or "").strip()
-                if txt:
-                    yield {"title": title, "article": str(art), "clause": None,
-                           "text": txt, "source": f"file://{os.path.abspath(path)}"}
+    """Unit của corpus dạng dict (kèm unit ID) - cùng thứ tự/ID với BM25."""
+    for uid, u in enumerate(corpus_iter_units(data_dir)):
+        it = u._asdict()
+        it["uid"] = uid
+        yield it
 
 def embed_batch(texts: List[str], retries: int = 3, backoff: float = 2.0):
-    last_err = None
+    """Một request embedding (có retry). Trả về (vectors, số giây, số lần lỗi)."""
+    t0 = time.perf_counter()
     for attempt in range(1, retries + 1):
         try:
-            return embed_ollama(texts)
+            vecs = embed_ollama(texts, batch_size=len(texts), concurrency=1)
+            return vecs, time.perf_counter() - t0, attempt - 1
         except Exception as e:
-            last_err = e
-            if attempt < retries:
-                sleep_s = backoff * attempt
-                print(f"⚠️ Batch lỗi ({e}). Thử lại {attempt}/{retries} sau {sleep_s:.1f}s...")
-                time.sleep(sleep_s)
-            else:
-                raise last_err
+            if attempt >= retries:
+                raise
+            sleep_s = backoff * attempt
+            print(f"⚠️ Batch lỗi ({e}). Thử lại {attempt}/{retries} sau {sleep_s:.1f}s...")
+            time.sleep(sleep_s)
+
+def _fmt_eta(sec: float) -> str:
+    sec = int(sec)
+    return f"{sec // 3600}h{sec % 3600 // 60:02d}m" if sec >= 3600 else f"{sec // 60}m{sec % 60:02d}s"
+
+def _write_binary(index_path: str, args):
+    if not os.path.exists(index_path):
+        raise SystemExit(f"❌ Không tìm thấy {index_path}")
+    t0 = time.perf_counter()
+    man = convert_jsonl(index_path, args.index, dtype=args.binary_dtype,
+                        model=os.getenv("EMBED_MODEL", "nomic-embed-text"), rescore=not args.no_rescore)
+    print(f"💾 Binary index: {man['count']} x {man['dim']} ({man['dtype']}) -> "
+          f"{os.path.join(args.index, man['vectors'])} trong {time.perf_counter() - t0:.1f}s")
+    _write_ann(args)
+
+def _write_ann(args):
+    """Build IVF cạnh vectors.* (--ann ivf, hoặc auto khi đủ --ann-min-units)."""
+    matrix, _, man = open_binary_index(args.index)
+    n = int(man["count"])
+    if args.ann == "none" or (args.ann == "auto" and n < args.ann_min_units) or not n:
+        return
+    t0 = time.perf_counter()
+    print(f"🧭 Build IVF cho {n} unit (nlist={args.nlist or default_nlist(n)})...")
+    ivf = IVFIndex.train(matrix, nlist=args.nlist or None, iters=args.ann_iters, verbose=True)
+    ivf.save(args.index, os.path.join(args.index, man["vectors"]))
+    print(f"💾 IVF: nlist={ivf.nlist} trong {time.perf_counter() - t0:.1f}s")
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--data", default="data")
     ap.add_argument("--index", default="index")
-    ap.add_argument("--batch-size", type=int, default=64)
+    ap.add_argument("--batch-size", type=int, default=64, help="Số text trong một request embedding (ban đầu)")
+    ap.add_argument("--min-batch-size", type=int, default=8)
+    ap.add_argument("--max-batch-size", type=int, default=256)
+    ap.add_argument("--target-batch-sec", type=float, default=2.0,
+                    help="Thời gian mục tiêu mỗi request; batch size tự tăng/giảm quanh mức này")
+    ap.add_argument("--fixed-batch", action="store_true", help="Tắt điều chỉnh batch size")
+    ap.add_argument("--concurrency", type=int, default=int(os.getenv("EMBED_CONCURRENCY", "4")),
+                    help="Số request embedding chạy song song")
     ap.add_argument("--truncate-chars", type=int, default=1000)
     ap.add_argument("--resume", action="store_true")
+    ap.add_argument("--binary-dtype", choices=["float32", "float16", "int8"], default="float32",
+                    help="Kiểu dữ liệu của khối embedding nhị phân (mmap); int8 = 1/4 RAM của float32")
+    ap.add_argument("--no-rescore", action="store_true",
+                    help="float16/int8: không ghi rescore.f32 (không chấm lại ứng viên bằng float32)")
+    ap.add_argument("--no-binary", action="store_true", help="Chỉ ghi index.jsonl, không ghi bản nhị phân")
+    ap.add_argument("--ann", choices=["auto", "ivf", "none"], default="auto",
+                    help="Index ANN (IVF) cho corpus lớn; auto = chỉ build khi >= --ann-min-units")
+    ap.add_argument("--ann-min-units", type=int, default=int(os.getenv("VECTOR_ANN_MIN_ROWS", "50000")))
+    ap.add_argument("--nlist", type=int, default=0, help="Số cụm IVF (mặc định ~sqrt(N))")
+    ap.add_argument("--ann-iters", type=int, default=10, help="Số vòng k-means")
+    ap.add_argument("--convert-only", action="store_true",
+                    help="Không embed; chỉ chuyển index.jsonl hiện có sang định dạng nhị phân")
     args = ap.parse_args()
 
     os.makedirs(args.index, exist_ok=True)
     out_path = os.path.join(args.index, "index.jsonl")
 
-    existing = _load_existing_keys(out_path) if args.resume else set()
-    if existing:
-        print(f"🔁 Resume: phát hiện {len(existing)} entries trong {out_path}")
-
-    total = sum(1 for _ in iter_units(args.data))
-    print(f"📦 Tổng unit: {total}")
-
-    written = 0
-    pending: List[Dict] = []
-    with open(out_path, "a", encoding="utf-8") as fout:
-        for it in iter_units(args.data):
-            key = _unit_key(it)
-            if key in existing: 
-                continue
-            if args.truncate_chars and args.truncate_chars > 0:
-                it["text"] = it["text"][:args.truncate_chars]
-            pending.append(it)
-            if len(pending) >= args.batch_size:
-                texts = [x["text"] for x in pending]
-                vecs = embed_batch(texts)
-                for obj, v in zip(pending, vecs):
+    if args.convert_only:
+        _write_binary(out_path, args)
+        return
+
+    if not args.resume:
+        # build mới từ đầu (trước đây mở chế độ append nên chạy lại sẽ nhân đôi index)
+        for path in (out_path, out_path + KEYS_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+    ckpt = Checkpoint(out_path).load()
+    if ckpt.keys:
+        print(f"🔁 Resume: {len(ckpt.keys)} entries đã có trong {out_path}")
+
+    # một lượt qua corpus: khoá tính trên text SAU khi cắt - đúng text được ghi vào index
+    todo: List[Dict] = []
+    for it in iter_units(args.data):
+        if args.truncate_chars and args.truncate_chars > 0:
+            it["text"] = it["text"][:args.truncate_chars]
+        if _unit_key(it) not in ckpt.keys:
+            todo.append(it)
+    total = len(todo)
+    print(f"📦 Cần embed: {total} unit (bỏ qua {len(ckpt.keys)} đã có)")
+
+    workers = max(1, args.concurrency)
+    sizer = BatchSizer(args.batch_size, args.min_batch_size if not args.fixed_batch else args.batch_size,
+                       args.max_batch_size if not args.fixed_batch else args.batch_size, args.target_batch_sec)
+    written, pos = 0, 0
+    inflight = deque()  # (items, future) theo thứ tự gửi -> index.jsonl giữ thứ tự corpus
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as ex, \
+         open(out_path, "ab") as fout, \
+         open(ckpt.path, "a", encoding="utf-8") as fkeys:
+        try:
+            while pos < total or inflight:
+                # giữ tối đa 2 batch/worker đang chờ để worker không rảnh khi batch đầu hàng chậm
+                while pos < total and len(inflight) < 2 * workers:
+                    items = todo[pos:pos + sizer.size]
+                    pos += len(items)
+                    inflight.append((items, ex.submit(embed_batch, [x["text"] for x in items])))
+                items, fut = inflight.popleft()
+                vecs, sec, errors = fut.result()
+                sizer.record(len(items), sec, ok=errors == 0)
+                if len(vecs) != len(items):
+                    raise RuntimeError(f"Số embedding trả về ({len(vecs)}) khác số text ({len(items)}).")
+                lines = []
+                for obj, v in zip(items, vecs):
                     if not isinstance(v, list) or not v or not isinstance(v[0], (int, float)):
                         raise RuntimeError("Embedding rỗng hoặc không hợp lệ.")
                     obj["embedding"] = v
-                    fout.write(json.dumps(obj, ensure_ascii=False) + "\n")
-                written += len(pending)
-                print(f"✅ Ghi thêm {len(pending)} (tổng {written}).")
-                pending.clear()
-
-        if pending:
-            texts = [x["text"] for x in pending]
-            vecs = embed_batch(texts)
-            for obj, v in zip(pending, vecs):
-                if not isinstance(v, list) or not v or not isinstance(v[0], (int, float)):
-                    raise RuntimeError("Embedding rỗng hoặc không hợp lệ (flush).")
-                obj["embedding"] = v
-                fout.write(json.dumps(obj, ensure_ascii=False) + "\n")
-            written += len(pending)
-            print(f"✅ Ghi thêm {len(pending)} (tổng {written}).")
-
-    print(f"🎉 Xong. File: {out_path} (mới ghi {written} entries).")
+                    lines.append(json.dumps(obj, ensure_ascii=False) + "\n")
+                # ghi cả batch một lần, fsync rồi mới ghi checkpoint khoá
+                fout.write("".join(lines).encode("utf-8"))
+                fout.flush()
+                os.fsync(fout.fileno())
+                ckpt.commit(fkeys, [_unit_key(x) for x in items], fout.tell())
+                written += len(items)
+                elapsed = time.perf_counter() - t_start
+                rate = written / max(elapsed, 1e-9)
+                print(f"✅ {written}/{total} ({written * 100 / max(total, 1):.1f}%) · {rate:.1f} unit/s · "
+                      f"batch {len(items)} trong {sec:.2f}s -> {sizer.size} · ETA {_fmt_eta((total - written) / max(rate, 1e-9))}")
+        except KeyboardInterrupt:
+            for _, fut in inflight:
+                fut.cancel()
+            print(f"\n⏹️ Dừng. Đã checkpoint {len(ckpt.keys)} entries - chạy lại với --resume để tiếp tục.")
+            raise SystemExit(130)
+
+    elapsed = time.perf_counter() - t_start
+    print(f"🎉 Xong. File: {out_path} (mới ghi {written} entries trong {elapsed:.1f}s, "
+          f"{written / max(elapsed, 1e-9):.1f} unit/s).")
+    if not args.no_binary:
+        _write_binary(out_path, args)
+    elif os.path.exists(os.path.join(args.index, MANIFEST_NAME)):
+        # binary index cũ không còn khớp: xoá manifest (ghi sau cùng) để server chuyển sang đọc index.jsonl mới
+        os.remove(os.path.join(args.index, MANIFEST_NAME))
+        print(f"🧹 Đã xoá {MANIFEST_NAME} của binary index cũ (--no-binary)")
     print("💡 Bật EMBEDDINGS_ENABLED=true trong .env để dùng vector search.")
 
 if __name__ == "__main__":
@@ -1,38 +1,23 @@
-import os, json, sys
+import sys, pathlib
 
-def check_dir(data_dir="data"):
-    units = 0
-    warn = 0
-    for name in os.listdir(data_dir):
-        if not name.lower().endswith(".json"):
-            continue
-        path = os.path.join(data_dir, name)
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
 
-        for art, obj in data.items():
-            if "tiêu_đề" not in obj:
-                raise AssertionError(f"Thiếu tiêu_đề: {name} Điều {art}")
+from core.retrieval.corpus import iter_units
 
-            ok = False
-            if isinstance(obj.get("khoản"), dict) and obj["khoản"]:
-                for k, v in obj["khoản"].items():
-                    if isinstance(v, dict) and isinstance(v.get("điểm"), dict) and v["điểm"]:
-                        units += len(v["điểm"])
-                    else:
-                        units += 1
-                ok = True
-            elif isinstance(obj.get("điểm"), dict) and obj["điểm"]:
-                units += len(obj["điểm"])
-                ok = True
-            elif isinstance(obj.get("toàn_văn"), str) and obj["toàn_văn"].strip():
-                units += 1
-                ok = True
+def check_dir(data_dir="data"):
+    warn = 0
 
-            if not ok:
-                warn += 1
-                print(f"⚠️  BỎ QUA: {name} Điều {art} thiếu 'khoản'/'điểm'/'toàn_văn'")
+    def on_warn(name, art, msg):
+        nonlocal warn
+        if msg == "Thiếu tiêu_đề":
+            raise AssertionError(f"Thiếu tiêu_đề: {name} Điều {art}")
+        warn += 1
+        print(f"⚠️  BỎ QUA: {name} Điều {art} {msg}")
 
+    # đếm đúng các unit mà BM25/vector index sẽ nạp (cùng loader)
+    units = sum(1 for _ in iter_units(data_dir, on_warn=on_warn))
     print(f"OK. Tổng đơn vị (điều/khoản/điểm): {units}. Cảnh báo: {warn}")
 
 if __name__ == "__main__":
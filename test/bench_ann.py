@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark ANN (IVF) vs quét chính xác: recall@k và độ trễ theo nprobe.
+
+Chạy: python test/bench_ann.py [--n 200000] [--dim 768] [--nprobe 1,4,16,64]
+      python test/bench_ann.py --index index   # dùng index thật (câu hỏi = hàng ngẫu nhiên + nhiễu)
+Dữ liệu giả gồm các cụm gaussian (gần với embedding thật hơn vector ngẫu nhiên đều).
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from core.retrieval import vector_jsonl
+from core.retrieval.ivf import IVFIndex, default_nlist
+from core.retrieval.vector_bin import open_binary_index
+
+TITLES = ["an_ninh_mang", "dat_dai", "giao_thong_duong_bo", "hon_nhan", "lao_dong", "so_huu_tri_tue"]
+
+def _clustered(n, dim, clusters, noise, rng):
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    return centers[rng.integers(0, clusters, n)] + noise * rng.standard_normal((n, dim), dtype=np.float32)
+
+def _fake_metas(n):
+    return [{"title": TITLES[i * len(TITLES) // n], "article": str(i), "clause": None,
+             "text": "", "source": ""} for i in range(n)]
+
+def _run(store, queries, top_k, allow, **kw):
+    out, t0 = [], time.perf_counter()
+    for q in queries:
+        out.append(store.search_rows(q, top_k, allow, **kw)[0])
+    return out, (time.perf_counter() - t0) * 1000.0 / len(queries)
+
+def _recall(approx, exact):
+    return float(np.mean([len(set(a.tolist()) & set(e.tolist())) / max(len(e), 1) for a, e in zip(approx, exact)]))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200000)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--clusters", type=int, default=2000, help="Số cụm của dữ liệu giả")
+    ap.add_argument("--noise", type=float, default=1.0, help="Độ lệch trong cụm (so với tâm cụm ~N(0,1))")
+    ap.add_argument("--query-noise", type=float, default=0.5,
+                    help="Nhiễu thêm vào hàng được chọn làm câu hỏi (theo độ lớn trung bình mỗi chiều)")
+    ap.add_argument("--index", default="", help="Thư mục index nhị phân thật (bỏ qua --n/--dim)")
+    ap.add_argument("--nlist", type=int, default=0)
+    ap.add_argument("--nprobe", default="1,4,8,16,32,64")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=8)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.index:
+        matrix, metas, _ = open_binary_index(args.index)
+        queries_src = np.asarray(matrix[rng.choice(len(metas), args.queries, replace=False)], dtype=np.float32)
+        store = vector_jsonl._make_store(matrix, metas, normalized=True)
+    else:
+        matrix = _clustered(args.n, args.dim, args.clusters, args.noise, rng)
+        queries_src = matrix[rng.choice(args.n, args.queries, replace=False)].copy()
+        store = vector_jsonl._make_store(matrix, _fake_metas(args.n))
+    n = len(store)
+    scale = np.linalg.norm(queries_src, axis=1, keepdims=True) / np.sqrt(queries_src.shape[1])
+    queries = queries_src + args.query_noise * scale * rng.standard_normal(queries_src.shape, dtype=np.float32)
+
+    t0 = time.perf_counter()
+    store.ann = IVFIndex.train(store.matrix, nlist=args.nlist or None)
+    print(f"IVF: {n} hàng, nlist={store.ann.nlist} (mặc định {default_nlist(n)}), train {time.perf_counter() - t0:.1f}s")
+    # bench đo thẳng IVF, không áp ngưỡng VECTOR_ANN_MIN_ROWS
+    vector_jsonl.ANN_MIN_ROWS = 0
+
+    for allow in (None, ["dat_dai"]):
+        exact, exact_ms = _run(store, queries, args.top_k, allow, exact=True)
+        label = "toàn bộ" if allow is None else f"allow_titles={allow}"
+        print(f"\n[{label}] exact: {exact_ms:.2f} ms/query")
+        print(f"{'nprobe':>7} | {'recall@' + str(args.top_k):>9} | {'ms/query':>9} | {'speedup':>8}")
+        print("-" * 42)
+        for nprobe in [int(x) for x in args.nprobe.split(",") if x.strip()]:
+            approx, ms = _run(store, queries, args.top_k, allow, nprobe=nprobe)
+            print(f"{nprobe:>7} | {_recall(approx, exact):>9.3f} | {ms:>9.2f} | {exact_ms / ms:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
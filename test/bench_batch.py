@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark chế độ batch: vòng lặp answer_question()/retrieve_context() từng câu vs answer_batch()/retrieve_batch().
+
+Chạy: python test/bench_batch.py [--repeat 4] [--concurrency 4] [--batch-size 32]
+Dùng stub LLM/embedding (test/stub_llm.py) như bench_e2e.py; cache kết quả/câu trả lời/embedding tắt.
+Bộ câu hỏi test/bench_questions.jsonl được lặp `--repeat` lần (thêm hậu tố để không trùng nhau).
+Lưu ý: LLM song song chỉ có lợi khi backend phục vụ được nhiều request cùng lúc (Ollama: OLLAMA_NUM_PARALLEL).
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from bench_e2e import _free_port, _load_questions, _run, _start_stub
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--questions", default=str(ROOT / "test" / "bench_questions.jsonl"))
+    ap.add_argument("--data", default=str(ROOT / "data"))
+    ap.add_argument("--repeat", type=int, default=4, help="Số lần lặp bộ câu hỏi")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--embed-ms", type=float, default=20.0)
+    ap.add_argument("--prefill-ms", type=float, default=200.0)
+    ap.add_argument("--prefill-ms-per-1k-chars", type=float, default=0.0)
+    ap.add_argument("--token-ms", type=float, default=5.0)
+    ap.add_argument("--tokens", type=int, default=32)
+    args = ap.parse_args()
+
+    base = _load_questions(args.questions)
+    questions = [q["question"] + ("" if r == 0 else f" (lần {r + 1})") for r in range(args.repeat) for q in base]
+    port = _free_port()
+    tmp = tempfile.mkdtemp(prefix="bench_batch_")
+    stub = _start_stub(args, port)
+    try:
+        env = dict(os.environ, OLLAMA_BASE_URL=f"http://127.0.0.1:{port}", EMBED_MODEL="stub-embed")
+        index_dir = os.path.join(tmp, "index")
+        subprocess.run([sys.executable, str(ROOT / "src" / "tools" / "build_vector_index.py"),
+                        "--data", args.data, "--index", index_dir, "--ann", "none"],
+                       env=env, check=True, stdout=subprocess.DEVNULL)
+        os.environ.update(env)
+        os.environ.update({
+            "INDEX_PATH": os.path.join(index_dir, "index.jsonl"),
+            "DATA_DIR": args.data,
+            "BM25_SNAPSHOT_DIR": os.path.join(tmp, "bm25"),
+            "GOOGLE_API_KEY": "",
+            "CONNECTIVITY_PROBE_URL": "http://127.0.0.1:9/",
+            "DIRECT_CITE_FIRST": "false",
+            "INDEX_WATCH_SEC": "0",
+            "RESULT_CACHE_SIZE": "0", "ANSWER_CACHE_SIZE": "0", "QUERY_EMBED_CACHE_SIZE": "0",
+            "RESULT_CACHE_PATH": "", "QUERY_EMBED_CACHE_PATH": "",
+        })
+        from core.settings import Settings
+        from core import pipeline
+        _run(pipeline.load_index, args.data)
+        settings = Settings()
+        _run(pipeline.answer_question, questions[0], settings)  # warm-up (dò endpoint embedding, pool HTTP)
+
+        n = len(questions)
+        rows = []
+        t0 = time.perf_counter()
+        loop_ret = [_run(pipeline.retrieve_context, q, settings) for q in questions]
+        rows.append(("retrieval: từng câu", time.perf_counter() - t0))
+        t0 = time.perf_counter()
+        batch_ret = []
+        for s in range(0, n, args.batch_size):
+            batch_ret.extend(pipeline.retrieve_batch(questions[s:s + args.batch_size], settings))
+        rows.append((f"retrieval: lô {args.batch_size}", time.perf_counter() - t0))
+        same = sum([h["title"] + h["article"] + str(h.get("clause")) for h in a["hits"]] ==
+                   [h["title"] + h["article"] + str(h.get("clause")) for h in b["hits"]]
+                   for a, b in zip(loop_ret, batch_ret))
+
+        t0 = time.perf_counter()
+        for q in questions:
+            _run(pipeline.answer_question, q, settings)
+        rows.append(("trả lời: từng câu", time.perf_counter() - t0))
+        t0 = time.perf_counter()
+        out = list(pipeline.answer_batch(questions, settings, concurrency=args.concurrency, batch_size=args.batch_size))
+        rows.append((f"trả lời: batch x{args.concurrency}", time.perf_counter() - t0))
+        ordered = [r["index"] for r in out] == list(range(n))
+        ok = sum(r["status"] == "success" for r in out)
+
+        print(f"{n} câu hỏi, stub: embed {args.embed_ms:.0f} ms, prefill {args.prefill_ms:.0f} ms, "
+              f"{args.tokens} token x {args.token_ms:.0f} ms")
+        print(f"{'':>22} | {'tổng s':>8} | {'ms/câu':>8} | {'câu/s':>7}")
+        print("-" * 54)
+        for name, sec in rows:
+            print(f"{name:>22} | {sec:>8.2f} | {sec * 1000 / n:>8.2f} | {n / sec:>7.1f}")
+        print(f"\nretrieval lô trùng hits với từng câu: {same}/{n}; batch đúng thứ tự: {ordered}; thành công {ok}/{n}")
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
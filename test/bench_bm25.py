@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark BM25: rank_bm25.BM25Okapi.get_scores() + sort toàn bộ (cũ) vs inverted index + heap (mới).
+
+Chạy: python test/bench_bm25.py [--scales 1,10,100]
+      python test/bench_bm25.py --startup 1,10   # khởi động: build từ data/ vs nạp snapshot
+      python test/bench_bm25.py --phrase         # độ chính xác top-k với cụm từ: âm tiết vs +bigram
+Corpus = các unit trong data/ nhân bản `scale` lần (giữ các unit cùng title liền nhau).
+Script kiểm tra luôn top-k hai bản trùng nhau, cả khi lọc allow_titles=["dat_dai"].
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from rank_bm25 import BM25Okapi
+from core.retrieval.bm25_json import JsonBM25, _tokenize, _bigrams
+from core.retrieval.bm25_index import InvertedBM25
+from core.retrieval.partitions import title_ranges, ranges_for
+from core.retrieval.bm25_snapshot import save_snapshot, load_snapshot
+from core.retrieval.corpus import iter_units
+
+QUERIES = [
+    "Tuổi kết hôn tối thiểu ở Việt Nam là bao nhiêu?",
+    "Tôi bị sa thải không lý do, có được bồi thường không?",
+    "Mức phạt vi phạm nồng độ cồn khi lái xe máy",
+    "Điều kiện cấp giấy chứng nhận quyền sử dụng đất",
+    "Thời hạn bảo hộ nhãn hiệu là bao lâu",
+    "Hành vi bị nghiêm cấm trên không gian mạng",
+    "hợp đồng lao động xác định thời hạn",
+    "chia tài sản chung khi ly hôn",
+]
+
+# (câu hỏi, cụm từ pháp lý mà đoạn luật liên quan phải chứa)
+PHRASE_QUERIES = [
+    ("Điều kiện cấp giấy chứng nhận quyền sử dụng đất", "quyền sử dụng đất"),
+    ("Thời hạn của hợp đồng lao động xác định thời hạn", "hợp đồng lao động"),
+    ("Người sử dụng lao động đơn phương chấm dứt hợp đồng", "đơn phương chấm dứt"),
+    ("Tài sản chung của vợ chồng khi ly hôn", "tài sản chung"),
+    ("Xử lý vi phạm nồng độ cồn khi điều khiển phương tiện", "nồng độ cồn"),
+    ("Thời hạn bảo hộ quyền tác giả", "quyền tác giả"),
+    ("Bảo vệ dữ liệu cá nhân trên không gian mạng", "không gian mạng"),
+    ("Giấy phép lái xe hạng A1", "giấy phép lái xe"),
+    ("Nhà nước thu hồi đất để phát triển kinh tế", "thu hồi đất"),
+    ("Kết hôn với người nước ngoài cần thủ tục gì", "người nước ngoài"),
+]
+
+def bench_phrase(data_dir, ks):
+    """Precision@k = tỉ lệ hit trong top-k có chứa nguyên cụm từ; so BM25 âm tiết với BM25 + bigram."""
+    units = list(iter_units(data_dir))
+    texts = [u.text.lower() for u in units]
+    docs = [_tokenize(u.text) for u in units]
+    uni = InvertedBM25().build(docs)
+    bi = InvertedBM25().build([_bigrams(d) for d in docs])
+    kmax = max(ks)
+
+    def run(q, phrase):
+        toks = _tokenize(q)
+        return uni.top_k(toks, kmax, boost=bi.score_candidates(_bigrams(toks)) if phrase else None)
+
+    print(f"{len(units)} units, {len(PHRASE_QUERIES)} câu hỏi có cụm từ; bigram vocab {len(bi.postings)} term")
+    print(f"{'':>14} | " + " | ".join(f"{'P@' + str(k):>6}" for k in ks) + f" | {'ms/q':>6}")
+    print("-" * (26 + 9 * len(ks)))
+    for label, phrase in (("âm tiết", False), ("+ bigram", True)):
+        prec = {k: 0.0 for k in ks}
+        for q, ph in PHRASE_QUERIES:
+            hits = run(q, phrase)
+            for k in ks:
+                prec[k] += sum(ph in texts[i] for i, _ in hits[:k]) / k
+        ms = _best_ms(lambda: [run(q, phrase) for q, _ in PHRASE_QUERIES], 5) / len(PHRASE_QUERIES)
+        print(f"{label:>14} | " + " | ".join(f"{prec[k] / len(PHRASE_QUERIES):>6.2f}" for k in ks) + f" | {ms:>6.2f}")
+
+def _legacy_top_k(bm25, qtok, k, titles=None, allow=None):
+    scores = bm25.get_scores(qtok)
+    ranked = sorted([(i, float(scores[i])) for i in range(len(scores)) if not allow or titles[i] in allow],
+                    key=lambda x: x[1], reverse=True)
+    return ranked[:k]
+
+def _best_ms(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, (time.perf_counter() - t0) * 1000.0)
+    return best
+
+def bench_startup(data_dir, scales):
+    """Thư mục data giả = mỗi file luật chép `scale` lần; đo build cold vs nạp snapshot."""
+    print(f"{'units':>9} | {'build ms':>9} | {'snapshot ms':>11} | {'speedup':>7}")
+    print("-" * 46)
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as d:
+            data = os.path.join(d, "data")
+            os.makedirs(data)
+            for name in os.listdir(data_dir):
+                if name.lower().endswith(".json"):
+                    for i in range(scale):
+                        shutil.copy(os.path.join(data_dir, name), os.path.join(data, f"{i}_{name}"))
+            snap = os.path.join(d, "bm25")
+            t0 = time.perf_counter()
+            idx = JsonBM25()
+            n = idx.build_dir(data)
+            build_ms = (time.perf_counter() - t0) * 1000.0
+            save_snapshot(idx.bm25, idx.corpus, data, out_dir=snap)
+            del idx
+            t0 = time.perf_counter()
+            JsonBM25()._set(*load_snapshot(data, out_dir=snap))
+            snap_ms = (time.perf_counter() - t0) * 1000.0
+            print(f"{n:>9} | {build_ms:>9.0f} | {snap_ms:>11.1f} | {build_ms / snap_ms:>6.0f}x")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", default=str(ROOT / "data"))
+    ap.add_argument("--scales", default="1,10,100")
+    ap.add_argument("--top-k", type=int, default=8)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--startup", default="", help="Đo thời gian khởi động với các hệ số nhân data (vd. 1,10) rồi thoát")
+    ap.add_argument("--phrase", action="store_true", help="Đo precision@k cho câu hỏi chứa cụm từ rồi thoát")
+    args = ap.parse_args()
+
+    if args.phrase:
+        bench_phrase(args.data, [1, 3, 5, 8])
+        return
+
+    if args.startup:
+        bench_startup(args.data, [int(x) for x in args.startup.split(",") if x.strip()])
+        return
+
+    base_docs = [(u.title, _tokenize(u.text)) for u in iter_units(args.data)]
+    qtoks = [_tokenize(q) for q in QUERIES]
+    allow = ["dat_dai"]
+
+    print(f"{'units':>9} | {'okapi ms/q':>10} | {'inverted ms/q':>13} | {'speedup':>7} | "
+          f"{'okapi+filter':>12} | {'partition':>9} | top-k")
+    print("-" * 90)
+    for scale in [int(x) for x in args.scales.split(",") if x.strip()]:
+        pairs = sorted(base_docs * scale, key=lambda x: x[0])
+        titles = [t for t, _ in pairs]
+        docs = [d for _, d in pairs]
+        okapi = BM25Okapi(docs)
+        inv = InvertedBM25().build(docs)
+        ranges = ranges_for(title_ranges(titles), allow)
+
+        same = all(
+            [(i, round(s, 4)) for i, s in _legacy_top_k(okapi, q, args.top_k)]
+            == [(i, round(s, 4)) for i, s in inv.top_k(q, args.top_k)]
+            and [(i, round(s, 4)) for i, s in _legacy_top_k(okapi, q, args.top_k, titles, allow)]
+            == [(i, round(s, 4)) for i, s in inv.top_k(q, args.top_k, ranges=ranges)]
+            for q in qtoks
+        )
+        old_ms = _best_ms(lambda: [_legacy_top_k(okapi, q, args.top_k) for q in qtoks], args.repeat) / len(qtoks)
+        new_ms = _best_ms(lambda: [inv.top_k(q, args.top_k) for q in qtoks], args.repeat) / len(qtoks)
+        old_f = _best_ms(lambda: [_legacy_top_k(okapi, q, args.top_k, titles, allow) for q in qtoks], args.repeat) / len(qtoks)
+        new_f = _best_ms(lambda: [inv.top_k(q, args.top_k, ranges=ranges) for q in qtoks], args.repeat) / len(qtoks)
+        print(f"{len(docs):>9} | {old_ms:>10.2f} | {new_ms:>13.3f} | {old_ms / new_ms:>6.0f}x | "
+              f"{old_f:>12.2f} | {new_f:>9.3f} | {'OK' if same else 'KHÁC'}")
+        del okapi, inv
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark định dạng CONTEXT: cũ (mỗi hit một khối + SOURCE, cắt theo ký tự) vs context_packer (gom khoản
+cùng Điều, bỏ tiêu đề/SOURCE lặp, bỏ gần trùng, ngân sách token) - trên CÙNG danh sách hits.
+
+Chạy: python test/bench_context.py [--prefill-ms-per-1k-chars 150] [--rounds 2]
+      python test/bench_context.py --base-url http://localhost:11434   # đo với Ollama thật thay cho stub
+Mặc định dùng stub (test/stub_llm.py) với prefill tỉ lệ theo độ dài prompt để mô phỏng Ollama trên CPU;
+với Ollama thật thì độ trễ LLM là số đo thật (index phải build bằng cùng EMBED_MODEL).
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from bench_e2e import _free_port, _load_questions, _pct, _run, _start_stub
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--questions", default=str(ROOT / "test" / "bench_questions.jsonl"))
+    ap.add_argument("--data", default=str(ROOT / "data"))
+    ap.add_argument("--base-url", default="", help="Backend thật (Ollama); trống = stub")
+    ap.add_argument("--index", default="", help="Thư mục index có sẵn (bắt buộc khi dùng --base-url)")
+    ap.add_argument("--rounds", type=int, default=2)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--embed-ms", type=float, default=5.0)
+    ap.add_argument("--prefill-ms", type=float, default=50.0)
+    ap.add_argument("--prefill-ms-per-1k-chars", type=float, default=150.0)
+    ap.add_argument("--token-ms", type=float, default=2.0)
+    ap.add_argument("--tokens", type=int, default=16)
+    args = ap.parse_args()
+
+    questions = [q["question"] for q in _load_questions(args.questions)]
+    tmp = tempfile.mkdtemp(prefix="bench_context_")
+    stub = None
+    try:
+        if args.base_url:
+            env = dict(os.environ, OLLAMA_BASE_URL=args.base_url)
+            index_dir = args.index or str(ROOT / "index")
+        else:
+            port = _free_port()
+            stub = _start_stub(args, port)
+            env = dict(os.environ, OLLAMA_BASE_URL=f"http://127.0.0.1:{port}", EMBED_MODEL="stub-embed")
+            index_dir = args.index or os.path.join(tmp, "index")
+            if not args.index:
+                subprocess.run([sys.executable, str(ROOT / "src" / "tools" / "build_vector_index.py"),
+                                "--data", args.data, "--index", index_dir, "--ann", "none"],
+                               env=env, check=True, stdout=subprocess.DEVNULL)
+        os.environ.update(env)
+        os.environ.update({
+            "INDEX_PATH": os.path.join(index_dir, "index.jsonl"),
+            "DATA_DIR": args.data,
+            "BM25_SNAPSHOT_DIR": os.path.join(tmp, "bm25"),
+            "CONNECTIVITY_PROBE_URL": "http://127.0.0.1:9/",
+            "INDEX_WATCH_SEC": "0",
+            "RESULT_CACHE_SIZE": "0", "ANSWER_CACHE_SIZE": "0", "RESULT_CACHE_PATH": "",
+        })
+        from core.settings import Settings
+        from core import pipeline
+        from core.context_packer import budget_tokens, estimate_tokens, pack_context
+        from core.llm_client import chat
+        _run(pipeline.load_index, args.data)
+        settings = Settings()
+        hits = [_run(pipeline.retrieve_context, q, settings)["hits"] for q in questions]
+
+        rows = {}
+        for name, packer in (("cũ", False), ("packer", True)):
+            pipeline.CONTEXT_PACKER = packer
+            ctxs = [pipeline._format_context(h, settings.max_context_chars, settings.max_context_tokens) for h in hits]
+            lat = []
+            chat(pipeline._rag_messages(questions[0], ctxs[0]), **pipeline._llm_params(settings))  # warm-up
+            for _ in range(args.rounds):
+                for q, ctx in zip(questions, ctxs):
+                    t0 = time.perf_counter()
+                    chat(pipeline._rag_messages(q, ctx), **pipeline._llm_params(settings))
+                    lat.append((time.perf_counter() - t0) * 1000.0)
+            prompts = ["".join(m["content"] for m in pipeline._rag_messages(q, c)) for q, c in zip(questions, ctxs)]
+            if packer:
+                budget = budget_tokens(settings.max_context_tokens, settings.max_context_chars)
+                used = [pack_context(h, budget)[1]["hits_used"] for h in hits]
+            else:
+                used = [c.count("\nSOURCE: ") for c in ctxs]
+            rows[name] = {
+                "hits": sum(used) / len(used),
+                "ctx_chars": sum(map(len, ctxs)) / len(ctxs),
+                "ctx_tokens": sum(map(estimate_tokens, ctxs)) / len(ctxs),
+                "prompt_tokens": sum(map(estimate_tokens, prompts)) / len(prompts),
+                "llm_p50": _pct(lat, 50),
+                "llm_p95": _pct(lat, 95),
+                "llm_mean": sum(lat) / len(lat),
+            }
+
+        old, new = rows["cũ"], rows["packer"]
+        backend = args.base_url or f"stub (prefill {args.prefill_ms:.0f} ms + {args.prefill_ms_per_1k_chars:.0f} ms/1k ký tự)"
+        print(f"{len(questions)} câu hỏi x {args.rounds} lượt, backend: {backend}")
+        print(f"{'':>16} | {'cũ':>9} | {'packer':>9} | {'Δ':>7}")
+        print("-" * 50)
+        for key, label in (("hits", "hit dùng"), ("ctx_chars", "context ký tự"), ("ctx_tokens", "context token~"),
+                           ("prompt_tokens", "prompt token~"), ("llm_mean", "LLM mean ms"),
+                           ("llm_p50", "LLM p50 ms"), ("llm_p95", "LLM p95 ms")):
+            a, b = old[key], new[key]
+            print(f"{label:>16} | {a:>9.1f} | {b:>9.1f} | {(b - a) / a * 100:+6.1f}%")
+        pipeline.CONTEXT_PACKER = True
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait(timeout=10)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
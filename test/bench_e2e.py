@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark end-to-end offline: pipeline thật + stub LLM/embedding (test/stub_llm.py), không cần Ollama/Gemini.
+
+Chạy: python test/bench_e2e.py [--rounds 3] [--out bench_e2e.json] [--compare bench_e2e_old.json]
+      python test/bench_e2e.py --prefill-ms 800 --token-ms 40   # mô phỏng LLM chậm hơn
+Các bước:
+  1. chạy stub server (process riêng) với độ trễ cấu hình được;
+  2. build vector index cho data/ bằng embedding của stub (thư mục tạm; --index để dùng index có sẵn);
+  3. đo khởi động lạnh (import + load_index + câu hỏi đầu tiên) trong process này;
+  4. chạy bộ câu hỏi test/bench_questions.jsonl `--rounds` lượt, cache kết quả/embedding tắt (--cache để bật);
+  5. in + ghi JSON: p50/p95/p99 từng bước (title, BM25, vector, merge, context, LLM, tổng), peak RSS.
+So sánh hai commit: chạy ở mỗi commit với --out khác nhau, rồi --compare file cũ.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+STAGES = ["title_ms", "bm25_ms", "vector_ms", "merge_ms", "context_ms", "llm_ms", "total_ms"]
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1))))]
+
+def _summary(xs):
+    if not xs:
+        return None
+    return {"n": len(xs), "mean": round(sum(xs) / len(xs), 3), "p50": round(_pct(xs, 50), 3),
+            "p95": round(_pct(xs, 95), 3), "p99": round(_pct(xs, 99), 3), "max": round(max(xs), 3)}
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0, 1)
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _git_rev():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return rev + ("-dirty" if dirty and rev else "")
+    except OSError:
+        return ""
+
+def _start_stub(args, port):
+    cmd = [sys.executable, str(ROOT / "test" / "stub_llm.py"), "--port", str(port), "--dim", str(args.dim),
+           "--embed-ms", str(args.embed_ms), "--prefill-ms", str(args.prefill_ms),
+           "--prefill-ms-per-1k-chars", str(args.prefill_ms_per_1k_chars),
+           "--token-ms", str(args.token_ms), "--tokens", str(args.tokens)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("stub server không khởi động được")
+
+def _load_questions(path):
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                out.append(json.loads(line))
+    return out
+
+def _run(fn, *a):
+    # pipeline in từng bước ra console: nuốt output để không đo tốc độ terminal
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*a)
+
+def _compare(cur, old_path):
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    print(f"\nSo với {old_path} ({old['meta'].get('commit') or '?'}):")
+    print(f"{'bước':>12} | {'p50 cũ':>9} | {'p50 mới':>9} | {'Δ p50':>7} | {'p95 cũ':>9} | {'p95 mới':>9} | {'Δ p95':>7}")
+    print("-" * 80)
+
+    def delta(a, b):
+        return f"{(b - a) / a * 100:+6.1f}%" if a else "    n/a"
+    for st in STAGES:
+        a, b = old["stages"].get(st), cur["stages"].get(st)
+        if not a or not b:
+            continue
+        print(f"{st:>12} | {a['p50']:>9.2f} | {b['p50']:>9.2f} | {delta(a['p50'], b['p50'])} | "
+              f"{a['p95']:>9.2f} | {b['p95']:>9.2f} | {delta(a['p95'], b['p95'])}")
+    for k in ("cold_start_ms", "peak_rss_mb"):
+        a, b = old.get(k), cur.get(k)
+        if a and b:
+            print(f"{k}: {a} -> {b} ({delta(a, b).strip()})")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--questions", default=str(ROOT / "test" / "bench_questions.jsonl"))
+    ap.add_argument("--data", default=str(ROOT / "data"))
+    ap.add_argument("--index", default="", help="Thư mục index có sẵn (phải build bằng embedding của stub cùng --dim)")
+    ap.add_argument("--rounds", type=int, default=3, help="Số lượt chạy bộ câu hỏi (không tính lượt warmup)")
+    ap.add_argument("--warmup", type=int, default=1)
+    ap.add_argument("--cache", action="store_true", help="Giữ cache kết quả/câu trả lời/embedding (mặc định tắt)")
+    ap.add_argument("--no-llm", action="store_true", help="LLM_ENABLED=false (chỉ đo retrieval + direct-cite)")
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--embed-ms", type=float, default=20.0)
+    ap.add_argument("--prefill-ms", type=float, default=300.0)
+    ap.add_argument("--prefill-ms-per-1k-chars", type=float, default=0.0)
+    ap.add_argument("--token-ms", type=float, default=10.0)
+    ap.add_argument("--tokens", type=int, default=64)
+    ap.add_argument("--out", default="", help="File JSON kết quả (mặc định bench_e2e_<commit>.json)")
+    ap.add_argument("--compare", default="", help="File JSON của lần chạy trước để so sánh")
+    args = ap.parse_args()
+
+    questions = _load_questions(args.questions)
+    port = _free_port()
+    tmp = tempfile.mkdtemp(prefix="bench_e2e_")
+    stub = _start_stub(args, port)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        index_dir = args.index or os.path.join(tmp, "index")
+        env = dict(os.environ, OLLAMA_BASE_URL=base_url, EMBED_MODEL="stub-embed")
+        if not args.index:
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, str(ROOT / "src" / "tools" / "build_vector_index.py"),
+                            "--data", args.data, "--index", index_dir, "--ann", "none"],
+                           env=env, check=True, stdout=subprocess.DEVNULL)
+            print(f"Index (stub embedding): {index_dir} - {time.perf_counter() - t0:.1f}s")
+
+        # cấu hình phải có trước khi import core (các module đọc env lúc import)
+        os.environ.update(env)
+        os.environ.update({
+            "INDEX_PATH": os.path.join(index_dir, "index.jsonl"),
+            "DATA_DIR": args.data,
+            "BM25_SNAPSHOT_DIR": os.path.join(tmp, "bm25"),
+            "GOOGLE_API_KEY": "",
+            "CONNECTIVITY_PROBE_URL": "http://127.0.0.1:9/",  # luôn offline -> đường Ollama (stub)
+            "LLM_ENABLED": "false" if args.no_llm else "true",
+            "DIRECT_CITE_FIRST": "false",
+            "INDEX_WATCH_SEC": "0",
+        })
+        if not args.cache:
+            os.environ.update({"RESULT_CACHE_SIZE": "0", "ANSWER_CACHE_SIZE": "0", "QUERY_EMBED_CACHE_SIZE": "0",
+                               "RESULT_CACHE_PATH": "", "QUERY_EMBED_CACHE_PATH": ""})
+
+        t0 = time.perf_counter()
+        from core.settings import Settings
+        from core import pipeline
+        import_ms = (time.perf_counter() - t0) * 1000.0
+        t1 = time.perf_counter()
+        units = _run(pipeline.load_index, args.data)
+        load_ms = (time.perf_counter() - t1) * 1000.0
+        settings = Settings()
+        t1 = time.perf_counter()
+        _run(pipeline.answer_question, questions[0]["question"], settings)
+        first_ms = (time.perf_counter() - t1) * 1000.0
+        cold_ms = (time.perf_counter() - t0) * 1000.0
+        print(f"Khởi động lạnh: {cold_ms:.0f} ms (import {import_ms:.0f}, load_index {load_ms:.0f} / {units} units, "
+              f"câu hỏi đầu {first_ms:.0f})")
+
+        for _ in range(args.warmup):
+            for q in questions:
+                _run(pipeline.answer_question, q["question"], settings)
+
+        samples = {st: [] for st in STAGES}
+        wall, modes, vstatus, title_hit = [], {}, {}, 0
+        t_run = time.perf_counter()
+        for _ in range(args.rounds):
+            for q in questions:
+                t1 = time.perf_counter()
+                out = _run(pipeline.answer_question, q["question"], settings)
+                wall.append((time.perf_counter() - t1) * 1000.0)
+                tm = out["timings"]
+                for st in STAGES:
+                    # bước không chạy ở câu này (tra điều/khoản, cache, direct-cite) không tính vào phân phối
+                    if st in ("bm25_ms", "merge_ms") and tm.get("result_cache") != "miss":
+                        continue
+                    if st == "vector_ms" and tm.get("vector_status") not in ("ok", "timeout", "error"):
+                        continue
+                    if st == "llm_ms" and out["mode"] == "direct-cite":
+                        continue
+                    samples[st].append(float(tm.get(st, 0.0)))
+                modes[out["mode"]] = modes.get(out["mode"], 0) + 1
+                vstatus[tm.get("vector_status")] = vstatus.get(tm.get("vector_status"), 0) + 1
+                cites = out.get("citations") or []
+                title_hit += bool(cites) and cites[0].get("title") == q.get("title")
+        run_sec = time.perf_counter() - t_run
+        n = len(wall)
+
+        result = {
+            "meta": {
+                "commit": _git_rev(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "questions": len(questions),
+                "rounds": args.rounds,
+                "cache": args.cache,
+                "llm": not args.no_llm,
+                "stub": {"dim": args.dim, "embed_ms": args.embed_ms, "prefill_ms": args.prefill_ms,
+                         "prefill_ms_per_1k_chars": args.prefill_ms_per_1k_chars,
+                         "token_ms": args.token_ms, "tokens": args.tokens},
+            },
+            "units": units,
+            "cold_start_ms": round(cold_ms, 1),
+            "cold_start": {"import_ms": round(import_ms, 1), "load_index_ms": round(load_ms, 1),
+                           "first_query_ms": round(first_ms, 1)},
+            "stages": {st: _summary(xs) for st, xs in samples.items()},
+            "wall_ms": _summary(wall),
+            "qps": round(n / run_sec, 2) if run_sec else None,
+            "modes": modes,
+            "vector_status": vstatus,
+            "title_hit_at_1": round(title_hit / n, 3) if n else None,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+
+        print(f"\n{n} câu hỏi ({len(questions)} x {args.rounds} lượt), {result['qps']} câu/s, "
+              f"peak RSS {result['peak_rss_mb']} MB, title@1 {result['title_hit_at_1']}")
+        print(f"mode: {modes}  vector: {vstatus}")
+        print(f"{'bước':>12} | {'n':>4} | {'p50 ms':>9} | {'p95 ms':>9} | {'p99 ms':>9} | {'max ms':>9}")
+        print("-" * 66)
+        for st, s in list(result["stages"].items()) + [("wall", result["wall_ms"])]:
+            if s:
+                print(f"{st:>12} | {s['n']:>4} | {s['p50']:>9.2f} | {s['p95']:>9.2f} | {s['p99']:>9.2f} | {s['max']:>9.2f}")
+
+        out_path = args.out or f"bench_e2e_{result['meta']['commit'] or 'local'}.json"
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nĐã ghi {out_path}")
+        if args.compare:
+            _compare(result, args.compare)
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
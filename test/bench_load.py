@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Load test /ask: gửi N request đồng thời tới một server đang chạy, đo throughput và p50/p95.
+
+Chạy: python test/bench_load.py --url http://localhost:5000 [--concurrency 1,8,32] [--requests 64]
+So sánh Flask (python src/server.py) với ASGI (uvicorn server_asgi:app --app-dir src) trên cùng máy.
+Số kết nối tới Ollama: ASGI dùng ASYNC_HTTP_POOL_MAX (mặc định 64, request dư xếp hàng), Flask dùng HTTP_POOL_MAX.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+QUESTIONS = [
+    "Tuổi kết hôn tối thiểu ở Việt Nam là bao nhiêu?",
+    "Tôi bị sa thải không lý do, có được bồi thường không?",
+    "Điều kiện cấp giấy chứng nhận quyền sử dụng đất",
+    "Thời hạn bảo hộ nhãn hiệu là bao lâu",
+    "Hành vi bị nghiêm cấm trên không gian mạng",
+    "hợp đồng lao động xác định thời hạn",
+]
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1))))]
+
+async def run(url, concurrency, total, timeout):
+    sem = asyncio.Semaphore(concurrency)
+    lat, errors = [], 0
+
+    async def one(client, i):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                r = await client.post(url + "/ask", json={"question": QUESTIONS[i % len(QUESTIONS)]})
+                r.raise_for_status()
+                lat.append((time.perf_counter() - t0) * 1000.0)
+            except Exception:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(total)))
+        wall = time.perf_counter() - t0
+    return lat, errors, wall
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://localhost:5000")
+    ap.add_argument("--concurrency", default="1,8,32")
+    ap.add_argument("--requests", type=int, default=64)
+    ap.add_argument("--timeout", type=float, default=300.0)
+    args = ap.parse_args()
+
+    print(f"{'conc':>5} | {'req/s':>7} | {'p50 ms':>8} | {'p95 ms':>8} | {'max ms':>8} | lỗi")
+    print("-" * 55)
+    for c in [int(x) for x in args.concurrency.split(",") if x.strip()]:
+        lat, errors, wall = asyncio.run(run(args.url.rstrip("/"), c, args.requests, args.timeout))
+        if not lat:
+            print(f"{c:>5} | tất cả request lỗi ({errors})")
+            continue
+        print(f"{c:>5} | {len(lat) / wall:>7.2f} | {statistics.median(lat):>8.0f} | "
+              f"{_pct(lat, 95):>8.0f} | {max(lat):>8.0f} | {errors}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark chi phí log mỗi request: Rich (CLI, như trước) vs JSON qua hàng đợi (server) vs tắt.
+
+Chạy: python test/bench_logging.py [--n 2000] [--threads 4]
+Mỗi "request" phát đúng chuỗi log của answer_question(): các dòng tiến trình, bảng trạng thái,
+thời gian từng bước và bảng thời gian cuối. Output Rich/JSON được ghi vào /dev/null, nên số đo là
+thời gian thread request bị giữ lại (render + ghi với Rich; dựng dict + put_nowait với JSON).
+"""
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from core import eventlog
+from core.eventlog import say
+from core.utils import print_status_info, print_step_timing, print_timing_info
+
+TIMINGS = {"title_ms": 0.13, "result_cache": "miss", "bm25_ms": 4.2, "vector_ms": 21.7, "retrieval_ms": 22.4,
+           "overlap_saved_ms": 3.5, "vector_status": "ok", "embed_cache": "miss", "embed_cache_hits": 3,
+           "embed_cache_misses": 9, "merge_ms": 0.21, "context_ms": 0.05, "llm_ms": 812.0, "total_ms": 836.1}
+
+def one_request(i: int):
+    eventlog.new_request_id()
+    print_status_info(False, "ollama", "qwen2.5:3b-instruct", "Tuổi kết hôn tối thiểu?", "")
+    say("🔍 Đang chọn phạm vi luật phù hợp...")
+    print_step_timing("Chọn phạm vi luật", 0.13)
+    say("📝🎯 Đang tìm kiếm từ khóa (BM25) và ngữ nghĩa (Vector) song song...")
+    print_step_timing("Tìm kiếm BM25", 4.2)
+    print_step_timing("Tìm kiếm Vector", 21.7)
+    print_step_timing("Retrieval song song (tiết kiệm 4ms)", 22.4)
+    say("🔄 Đang hợp nhất kết quả tìm kiếm và định dạng ngữ cảnh...")
+    print_step_timing("Hợp nhất kết quả", 0.21)
+    print_step_timing("Định dạng ngữ cảnh", 0.05)
+    print_status_info(False, "ollama", "qwen2.5:3b-instruct", "Tuổi kết hôn tối thiểu?", "[hon_nhan | Điều 8]")
+    say("🤖 Đang gửi yêu cầu đến AI (OLLAMA)...")
+    print_step_timing("Xử lý AI (OLLAMA)", 812.0)
+    print_timing_info(TIMINGS)
+
+def run(n: int, threads: int) -> float:
+    """Trả về µs trung bình mỗi request (thời gian tường / n)."""
+    per = n // threads
+    def worker():
+        for i in range(per):
+            one_request(i)
+    t0 = time.perf_counter()
+    ts = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return (time.perf_counter() - t0) * 1e6 / (per * threads)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000, help="Số request mỗi lần đo")
+    ap.add_argument("--threads", type=int, default=4)
+    args = ap.parse_args()
+
+    devnull = open(os.devnull, "w", encoding="utf-8")
+    rows = []
+    for mode in ("rich", "json", "off"):
+        os.environ["LOG_FORMAT"] = mode
+        eventlog.configure(mode, stream=devnull if mode == "json" else None)
+        with contextlib.redirect_stdout(devnull):
+            run(min(200, args.n), 1)  # warm-up
+            seq = run(args.n, 1)
+            par = run(args.n, args.threads)
+            eventlog.flush(10.0)
+        rows.append((mode, seq, par))
+
+    st = eventlog.stats()
+    print(f"{'mode':>6} | {'µs/req (1 thread)':>18} | {f'µs/req ({args.threads} threads)':>19}")
+    print("-" * 51)
+    for mode, seq, par in rows:
+        print(f"{mode:>6} | {seq:>18.1f} | {par:>19.1f}")
+    print(f"\njson writer: written={st['written']} dropped={st['dropped']} errors={st['errors']}")
+
+if __name__ == "__main__":
+    main()
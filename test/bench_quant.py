@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark lưu embedding lượng tử (float16 / int8 + scale mỗi hàng) vs float32:
+RAM của ma trận quét, recall@k so với float32 (có/không chấm lại bằng float32) và độ trễ.
+
+Chạy: python test/bench_quant.py [--n 200000] [--dim 768] [--rescore-factor 4]
+Dữ liệu giả dạng cụm (như test/bench_ann.py), không gọi Ollama.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from core.retrieval import vector_jsonl
+from core.retrieval.vector_bin import quantize_rows_int8
+
+def _store(matrix, scales=None, full=None):
+    metas = [{"title": "t", "article": str(i), "clause": None, "text": "", "source": ""} for i in range(matrix.shape[0])]
+    return vector_jsonl.VectorStore(matrix, metas, scales=scales, full=full)
+
+def _run(store, queries, top_k, rescore=True):
+    out, t0 = [], time.perf_counter()
+    for q in queries:
+        out.append(store.search_rows(q, top_k, rescore=rescore)[0])
+    return out, (time.perf_counter() - t0) * 1000.0 / len(queries)
+
+def _recall(approx, exact):
+    return float(np.mean([len(set(a.tolist()) & set(e.tolist())) / max(len(e), 1) for a, e in zip(approx, exact)]))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200000)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--clusters", type=int, default=2000)
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--top-k", type=int, default=8)
+    ap.add_argument("--rescore-factor", type=int, default=vector_jsonl.RESCORE_FACTOR)
+    args = ap.parse_args()
+    vector_jsonl.RESCORE_FACTOR = args.rescore_factor
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.clusters, args.dim), dtype=np.float32)
+    full = centers[rng.integers(0, args.clusters, args.n)] + rng.standard_normal((args.n, args.dim), dtype=np.float32)
+    full /= np.linalg.norm(full, axis=1, keepdims=True)
+    queries = full[rng.choice(args.n, args.queries, replace=False)]
+    queries = queries + 0.5 / np.sqrt(args.dim) * rng.standard_normal(queries.shape, dtype=np.float32)
+
+    ref = _store(full)
+    exact, exact_ms = _run(ref, queries, args.top_k)
+    q8, scales = quantize_rows_int8(full)
+    variants = [
+        ("float32", ref),
+        ("float16", _store(full.astype(np.float16))),
+        ("float16 + rescore", _store(full.astype(np.float16), full=full)),
+        ("int8", _store(q8, scales=scales)),
+        ("int8 + rescore", _store(q8, scales=scales, full=full)),
+    ]
+    base_mb = ref.nbytes()["scan"] / 2**20
+    print(f"{args.n} x {args.dim}, top {args.top_k}, rescore x{args.rescore_factor}")
+    print(f"{'storage':>18} | {'RAM quét MB':>11} | {'tiết kiệm':>9} | {'recall@' + str(args.top_k):>9} | {'ms/query':>9}")
+    print("-" * 70)
+    for name, st in variants:
+        got, ms = _run(st, queries, args.top_k) if st is not ref else (exact, exact_ms)
+        mb = st.nbytes()["scan"] / 2**20
+        print(f"{name:>18} | {mb:>11.1f} | {1 - mb / base_mb:>8.0%} | {_recall(got, exact):>9.4f} | {ms:>9.2f}")
+    print("(rescore: bản float32 nằm trên đĩa/mmap, mỗi câu hỏi chỉ đọc top-k x hệ số hàng)")
+
+if __name__ == "__main__":
+    main()
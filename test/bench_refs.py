@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark tra cứu theo trích dẫn điều/khoản: RefIndex (parse + tra dict) vs BM25 trên cùng câu hỏi.
+
+Chạy: python test/bench_refs.py [--n 2000]
+Câu hỏi được sinh từ chính corpus ("Điều {a} khoản {k} luật {tên}"), nên mỗi câu phải trả về
+đúng unit đó - script kiểm tra luôn độ chính xác của parser + index, và BM25 có tìm thấy unit đó ở top-1 không.
+Thêm các câu trích dẫn văn bản ngoài corpus (nghị định, hiến pháp, luật không có trong data) - phải trả về rỗng
+(dùng retrieval thường) kể cả khi router đoán được một luật.
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from core.retrieval.bm25_json import JsonBM25
+from core.retrieval.refs import RefIndex
+
+FORMS = [
+    "Điều {a} khoản {k} luật {t}",
+    "khoản {k} Điều {a} Luật {t} quy định gì?",
+    "Nội dung khoản {k} của điều {a} bộ luật {t}",
+]
+
+# (câu hỏi, default_titles từ router): trích dẫn không thuộc corpus -> không được tra thẳng
+OUTSIDE = [
+    ("Điều 5 Nghị định 100/2019 quy định mức phạt vượt đèn đỏ", ["giao_thong_duong_bo"]),
+    ("Điều 35 Hiến pháp 2013 về quyền lao động", ["lao_dong"]),
+    ("Điều 35 Hiến pháp 2013 về quyền lao động", []),
+    ("khoản 2 Điều 6 Thông tư 24/2023 về cấp giấy phép lái xe", ["giao_thong_duong_bo"]),
+    ("Điều 8 Bộ luật Dân sự về năng lực hành vi", ["hon_nhan"]),
+    ("Theo Nghị định 145/2020 hướng dẫn Bộ luật Lao động, Điều 3 quy định gì?", ["lao_dong"]),
+]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000, help="Số câu hỏi")
+    args = ap.parse_args()
+
+    idx = JsonBM25()
+    idx.build_dir(str(ROOT / "data"))
+    corpus = idx.corpus
+    t0 = time.perf_counter()
+    refs = RefIndex(corpus)
+    print(f"RefIndex: {len(corpus)} units, {len(refs)} khoá, dựng {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    rng = random.Random(0)
+    pool = [i for i, c in enumerate(corpus.clauses) if c is not None and c.isdigit()]
+    cases = []
+    for uid in rng.choices(pool, k=args.n):
+        q = rng.choice(FORMS).format(a=corpus.articles[uid], k=corpus.clauses[uid],
+                                     t=corpus.titles[uid].replace("_", " "))
+        cases.append((q, uid))
+
+    t0 = time.perf_counter()
+    got = [refs.resolve(q) for q, _ in cases]
+    ref_us = (time.perf_counter() - t0) * 1e6 / len(cases)
+    ok = sum(g == [uid] for g, (_, uid) in zip(got, cases))
+
+    t0 = time.perf_counter()
+    bm = [idx.search_ids(q, top_k=5) for q, _ in cases]
+    bm_us = (time.perf_counter() - t0) * 1e6 / len(cases)
+    bm_ok = sum(bool(h) and h[0][0] == uid for h, (_, uid) in zip(bm, cases))
+
+    print(f"{'':>10} | {'us/query':>9} | {'đúng unit':>10}")
+    print("-" * 36)
+    print(f"{'RefIndex':>10} | {ref_us:>9.1f} | {ok / len(cases):>10.3f}")
+    print(f"{'BM25':>10} | {bm_us:>9.1f} | {bm_ok / len(cases):>10.3f}")
+
+    wrong = [(q, d) for q, d in OUTSIDE if refs.resolve(q, d)]
+    print(f"\nvăn bản ngoài corpus -> retrieval thường: {len(OUTSIDE) - len(wrong)}/{len(OUTSIDE)}")
+    for q, d in wrong:
+        print(f"  ❌ {q} (router: {d}) -> {[corpus.meta(u)['title'] + ' Điều ' + corpus.meta(u)['article'] for u in refs.resolve(q, d)]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark vector search: vòng lặp _cos() thuần Python (cũ) vs ma trận NumPy (mới).
+
+Chạy: python test/bench_vector.py [--sizes 10000,100000,1000000] [--dim 768]
+      python test/bench_vector.py --startup 50000   # thời gian load: index.jsonl vs binary mmap
+Không gọi Ollama - dùng vector ngẫu nhiên, chỉ đo bước chấm điểm + chọn top-k.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from core.retrieval import vector_jsonl
+from core.retrieval.vector_bin import convert_jsonl
+
+TITLES = ["an_ninh_mang", "dat_dai", "giao_thong_duong_bo", "hon_nhan", "lao_dong", "so_huu_tri_tue"]
+
+def _legacy_cos(a, b):
+    dot = sum(x*y for x,y in zip(a,b))
+    na = math.sqrt(sum(x*x for x in a)) + 1e-8
+    nb = math.sqrt(sum(y*y for y in b)) + 1e-8
+    return dot/(na*nb)
+
+def _legacy_search(store, qv, top_k, allow_titles=None):
+    scored = []
+    for it in store:
+        if allow_titles and it.get("title") not in allow_titles:
+            continue
+        scored.append((_legacy_cos(qv, it["embedding"]), it))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored[:top_k]
+
+def _fake_metas(n):
+    # các unit cùng title liền nhau, như index build theo từng file luật
+    return [{"title": TITLES[i * len(TITLES) // n], "article": str(i), "clause": None,
+             "text": "", "source": ""} for i in range(n)]
+
+def _best_ms(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, (time.perf_counter() - t0) * 1000.0)
+    return best
+
+def bench_startup(n, dim):
+    """Ghi index.jsonl giả n unit, đo load JSONL vs load binary (mmap)."""
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "index.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for i in range(n):
+                obj = {"title": TITLES[i % len(TITLES)], "article": str(i), "clause": None,
+                       "text": "x" * 200, "source": "file://data/x.json",
+                       "embedding": [round(float(x), 6) for x in rng.standard_normal(dim)]}
+                f.write(json.dumps(obj) + "\n")
+        size_mb = os.path.getsize(path) / 2**20
+
+        t0 = time.perf_counter()
+        vector_jsonl.load_vector_store(path)
+        jsonl_s = time.perf_counter() - t0
+
+        for dtype in ("float32", "float16"):
+            convert_jsonl(path, d, dtype=dtype)
+            t0 = time.perf_counter()
+            vector_jsonl.load_vector_store(path)
+            bin_s = time.perf_counter() - t0
+            vec_mb = os.path.getsize(os.path.join(d, vector_jsonl._STORE.matrix.filename)) / 2**20
+            print(f"load {n} x {dim}: jsonl {jsonl_s:.2f}s ({size_mb:.0f} MB) | "
+                  f"mmap {dtype} {bin_s:.3f}s ({vec_mb:.0f} MB)")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000,1000000")
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--top-k", type=int, default=8)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--legacy-max", type=int, default=10000,
+                    help="Số unit tối đa chạy thật với bản cũ; lớn hơn thì ngoại suy tuyến tính")
+    ap.add_argument("--startup", type=int, default=0, help="Đo thời gian load index với N unit rồi thoát")
+    args = ap.parse_args()
+
+    if args.startup:
+        bench_startup(args.startup, args.dim)
+        return
+
+    rng = np.random.default_rng(0)
+    qv = rng.standard_normal(args.dim).astype(np.float32)
+    qv_list = qv.tolist()
+
+    print(f"{'units':>10} | {'legacy ms':>12} | {'numpy ms':>9} | {'numpy+filter ms':>15} | {'speedup':>8}")
+    print("-" * 68)
+    for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        emb = rng.standard_normal((n, args.dim), dtype=np.float32)
+
+        # Bản cũ: list dict + list float; chỉ chạy trên mẫu rồi ngoại suy
+        m = min(n, args.legacy_max)
+        store = [{"title": TITLES[i % len(TITLES)], "embedding": emb[i].tolist()} for i in range(m)]
+        legacy_ms = _best_ms(lambda: _legacy_search(store, qv_list, args.top_k), 1) * (n / m)
+        del store
+
+        vector_jsonl._set_store(emb, _fake_metas(n))
+        numpy_ms = _best_ms(lambda: vector_jsonl._search_vector(qv, top_k=args.top_k), args.repeat)
+        filt_ms = _best_ms(lambda: vector_jsonl._search_vector(qv, top_k=args.top_k, allow_titles=["dat_dai"]), args.repeat)
+
+        note = "*" if m < n else " "
+        print(f"{n:>10} | {legacy_ms:>11.1f}{note} | {numpy_ms:>9.2f} | {filt_ms:>15.2f} | {legacy_ms / numpy_ms:>7.0f}x")
+        del emb
+    print("(*) ngoại suy tuyến tính từ --legacy-max unit")
+
+if __name__ == "__main__":
+    main()
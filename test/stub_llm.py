@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Server giả lập Ollama / OpenAI-compatible cho benchmark offline (không cần model thật, không GPU).
+
+Chạy: python test/stub_llm.py [--port 11500] [--embed-ms 20] [--prefill-ms 300] [--token-ms 20] [--tokens 64]
+Rồi: OLLAMA_BASE_URL=http://127.0.0.1:11500 python src/run_cli.py "..."
+
+Endpoint:
+    POST /api/embed, /api/embeddings, /v1/embeddings   - embedding xác định theo nội dung text
+    POST /v1/chat/completions, /api/chat               - câu trả lời cố định, stream hoặc không
+    GET  /api/tags, /v1/models                         - health check (tools/check_system.py)
+Embedding = feature hashing các âm tiết + bigram (blake2b -> chỉ số, dấu), chuẩn hoá L2: cùng text luôn
+cùng vector và text chung từ ngữ có cosine cao, nên retrieval vector trên index build bằng stub vẫn có nghĩa.
+Độ trễ: embedding = embed-ms + embed-ms-per-text x số text; chat = prefill-ms (tỉ lệ theo độ dài prompt
+nếu đặt --prefill-ms-per-1k-chars) rồi token-ms mỗi token.
+"""
+import argparse
+import hashlib
+import json
+import math
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_TOKEN_RE = re.compile(r"[a-zA-Z0-9_À-ỹ]+")
+_ANSWER = ("Theo quy định tại CONTEXT, nội dung được trả lời như sau: đây là câu trả lời giả lập "
+           "của stub server dùng cho benchmark, không phải tư vấn pháp lý. ").split(" ")
+
+def embed_text(text: str, dim: int) -> list:
+    toks = _TOKEN_RE.findall((text or "").lower())
+    feats = toks + [f"{a} {b}" for a, b in zip(toks, toks[1:])]
+    v = [0.0] * dim
+    for f in feats:
+        h = int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "little")
+        v[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+    norm = math.sqrt(sum(x * x for x in v))
+    if not norm:
+        v[0], norm = 1.0, 1.0
+    return [x / norm for x in v]
+
+class StubConfig:
+    def __init__(self, dim=768, embed_ms=20.0, embed_ms_per_text=0.5, prefill_ms=300.0,
+                 prefill_ms_per_1k_chars=0.0, token_ms=20.0, tokens=64):
+        self.dim = dim
+        self.embed_ms = embed_ms
+        self.embed_ms_per_text = embed_ms_per_text
+        self.prefill_ms = prefill_ms
+        self.prefill_ms_per_1k_chars = prefill_ms_per_1k_chars
+        self.token_ms = token_ms
+        self.tokens = tokens
+        self.requests = {}  # path -> số request (GET /stub/stats)
+        self._lock = threading.Lock()
+
+    def count(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+def _sleep_ms(ms: float):
+    if ms > 0:
+        time.sleep(ms / 1000.0)
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive như Ollama (client dùng connection pool)
+    cfg: StubConfig = StubConfig()
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, obj, status: int = 200):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        self.cfg.count(self.path)
+        if self.path == "/api/tags":
+            self._json({"models": [{"name": "stub"}]})
+        elif self.path == "/v1/models":
+            self._json({"data": [{"id": "stub", "object": "model"}]})
+        elif self.path == "/stub/stats":
+            self._json({"requests": dict(self.cfg.requests)})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        self.cfg.count(self.path)
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        except ValueError:
+            return self._json({"error": "invalid json"}, 400)
+        if self.path in ("/api/embed", "/v1/embeddings"):
+            texts = body.get("input", [])
+            texts = [texts] if isinstance(texts, str) else list(texts)
+            _sleep_ms(self.cfg.embed_ms + self.cfg.embed_ms_per_text * len(texts))
+            vecs = [embed_text(t, self.cfg.dim) for t in texts]
+            if self.path == "/api/embed":
+                return self._json({"model": body.get("model"), "embeddings": vecs})
+            return self._json({"object": "list", "data": [{"object": "embedding", "index": i, "embedding": v}
+                                                          for i, v in enumerate(vecs)]})
+        if self.path == "/api/embeddings":
+            _sleep_ms(self.cfg.embed_ms + self.cfg.embed_ms_per_text)
+            return self._json({"embedding": embed_text(body.get("prompt", ""), self.cfg.dim)})
+        if self.path in ("/v1/chat/completions", "/api/chat"):
+            return self._chat(body, openai=self.path.startswith("/v1/"))
+        self._json({"error": "not found"}, 404)
+
+    def _chat(self, body: dict, openai: bool):
+        cfg = self.cfg
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+        n = cfg.tokens
+        if openai and body.get("max_tokens"):
+            n = min(n, int(body["max_tokens"]))
+        words = [_ANSWER[i % len(_ANSWER)] + " " for i in range(n)]
+        # prefill: thời gian xử lý prompt trước token đầu tiên (tăng theo độ dài context)
+        _sleep_ms(cfg.prefill_ms + cfg.prefill_ms_per_1k_chars * prompt_chars / 1000.0)
+        model = body.get("model", "stub")
+        if not body.get("stream"):
+            _sleep_ms(cfg.token_ms * n)
+            text = "".join(words).strip()
+            if openai:
+                return self._json({"object": "chat.completion", "model": model,
+                                   "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                                "finish_reason": "stop"}],
+                                   "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": n}})
+            return self._json({"model": model, "message": {"role": "assistant", "content": text}, "done": True})
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if openai else "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for w in words:
+            _sleep_ms(cfg.token_ms)
+            if openai:
+                chunk = {"object": "chat.completion.chunk", "model": model, "choices": [{"index": 0, "delta": {"content": w}}]}
+                self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            else:
+                chunk = {"model": model, "message": {"role": "assistant", "content": w}, "done": False}
+                self._chunk((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._chunk(b"data: [DONE]\n\n" if openai else b'{"done": true}\n')
+        self.wfile.write(b"0\r\n\r\n")
+
+def serve(host: str, port: int, cfg: StubConfig) -> ThreadingHTTPServer:
+    handler = type("Handler", (StubHandler,), {"cfg": cfg})
+    srv = ThreadingHTTPServer((host, port), handler)
+    srv.daemon_threads = True
+    return srv
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11500)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--embed-ms", type=float, default=20.0, help="Độ trễ cố định mỗi request embedding")
+    ap.add_argument("--embed-ms-per-text", type=float, default=0.5)
+    ap.add_argument("--prefill-ms", type=float, default=300.0, help="Độ trễ trước token đầu tiên")
+    ap.add_argument("--prefill-ms-per-1k-chars", type=float, default=0.0,
+                    help="Thêm độ trễ prefill theo độ dài prompt (mô phỏng CPU prefill)")
+    ap.add_argument("--token-ms", type=float, default=20.0, help="Độ trễ mỗi token sinh ra")
+    ap.add_argument("--tokens", type=int, default=64, help="Số token mỗi câu trả lời")
+    args = ap.parse_args()
+    cfg = StubConfig(args.dim, args.embed_ms, args.embed_ms_per_text, args.prefill_ms,
+                     args.prefill_ms_per_1k_chars, args.token_ms, args.tokens)
+    srv = serve(args.host, args.port, cfg)
+    print(f"stub LLM: http://{args.host}:{srv.server_address[1]} (dim={args.dim})", flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())